@@ -0,0 +1,43 @@
+"""Memory used by the request catalog: list of dicts vs columnar RequestCatalog
+
+Usage: python benchmarks/catalog_memory.py [N ...]
+"""
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+
+from fixtures import make_requests
+from catalog import RequestCatalog
+from request_store import RequestStore
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+
+def main(sizes):
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = RequestStore(os.path.join(tmp, "bench.db"))
+            store.add_requests(make_requests(n))
+            # Rows as the marketplace used to hold them: one dict per request
+            rows, dict_bytes = measure(store.list_requests)
+            _, catalog_bytes = measure(lambda: RequestCatalog.from_requests(rows))
+            store.close()
+        print(
+            f"{n:>9,} requests  list-of-dicts {dict_bytes / 1e6:8.2f} MB  "
+            f"({dict_bytes / n:6.0f} B/req)  catalog {catalog_bytes / 1e6:8.2f} MB  "
+            f"({catalog_bytes / n:6.0f} B/req)  {dict_bytes / catalog_bytes:5.1f}x smaller"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000])
@@ -0,0 +1,62 @@
+"""Deterministic request data shared by the benchmark scripts"""
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "crypto_insurance_app.py")
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from money import service_fee_for  # noqa: E402
+from payouts import pool_fill_pct, pool_target  # noqa: E402
+from request_rules import (  # noqa: E402
+    APR_PER_RATIO, FIXED_RATIO, ICONS, INTEREST_RATE_PER_RATIO, MAX_AMOUNT, MAX_RATIO, MAX_TERM_MONTHS,
+    MIN_AMOUNT, MIN_TERM_MONTHS, TOKENS, TYPES,
+)
+
+
+def make_requests(n, seed=0):
+    """`n` random insurance requests shaped like the ones the dialog creates
+
+    Ratio, pool fill, interest rate, APR and service fee are derived from the
+    drawn fields the way the dialog and bulk import derive them.
+    """
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(n):
+        amount = rng.randrange(MIN_AMOUNT, MAX_AMOUNT + 1, 100)
+        token = rng.choice(TOKENS)
+        icon = rng.choice(ICONS)
+        ratio = round(rng.uniform(0.1, MAX_RATIO), 1)
+        ins_type = rng.choice(TYPES)
+        if ins_type == "fixed":
+            ratio = FIXED_RATIO
+        # Pools from empty to a little past their target, a tenth of them empty
+        target = float(pool_target(amount, ratio, ins_type))
+        pool_size = 0 if rng.random() < 0.1 else int(round(target * rng.uniform(0, 1.2), -1))
+        requests.append({
+            "amount": amount,
+            "token": token,
+            "icon": icon,
+            "ratio": ratio,
+            "type": ins_type,
+            "pool_size": pool_size,
+            "pool_filled": int(pool_fill_pct(pool_size, target)),
+            "term_months": rng.randint(MIN_TERM_MONTHS, MAX_TERM_MONTHS),
+            "interest_rate": int(ratio * INTEREST_RATE_PER_RATIO),
+            "apr": ratio * APR_PER_RATIO,
+            "service_fee": service_fee_for(amount, token),
+            "borrower": f"9{rng.getrandbits(16):04x}...{rng.getrandbits(16):04x}",
+        })
+    return requests
+
+
+def seed_store(path, n, seed=0):
+    """Create a request store at `path` holding `n` requests"""
+    from request_store import RequestStore
+
+    store = RequestStore(path)
+    store.add_requests(make_requests(n, seed))
+    return store
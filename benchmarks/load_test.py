@@ -0,0 +1,374 @@
+"""Concurrent-session load test: rerun latency, CPU and memory as browser sessions scale
+
+Starts `streamlit run crypto_insurance_app.py` against a fresh seeded
+database for every session count and connects that many simulated browsers
+over Streamlit's websocket protocol. Each one loads the page, keeps the
+market fragments polling like the frontend does, and loops through:
+
+    open a request (provide_coverage_modal) -> move the stake a few times -> cancel
+    now and then: open create_request_modal -> change the amount -> create
+
+with exponential think time between steps. Latency is measured from sending
+a rerun to the final `script_finished`, so it includes queueing behind other
+sessions. Server CPU and RSS are read from /proc (Linux only) and the
+harness's own CPU is reported too because it shares the machine. Needs
+the `websockets` package.
+
+Usage:
+    python benchmarks/load_test.py [--sessions 1 10 50 100 200 400] [--duration 30]
+        [--think 1.0] [--requests 1000] [--output results.json]
+"""
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from fixtures import APP_PATH, ROOT, seed_store
+
+import numpy as np
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+SESSION_COUNTS = (1, 10, 50, 100, 200, 400)
+ACTIONS = ("load", "open_provide", "stake", "close_provide", "open_create", "create_input", "create", "poll")
+# Final statuses of a rerun; FINISHED_EARLY_FOR_RERUN (2) means another run follows
+FINISHED = (0, 1, 3)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def proc_usage(pid):
+    """(CPU seconds, RSS bytes) of process `pid`, (None, None) without /proc"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None, None
+    ticks = os.sysconf("SC_CLK_TCK")
+    return (int(fields[11]) + int(fields[12])) / ticks, pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class AppServer:
+    """`streamlit run` subprocess serving the app on a free localhost port"""
+
+    def __init__(self, db_path):
+        self.port = free_port()
+        self.metrics_port = free_port()
+        env = dict(os.environ, SIGMASHIELD_DB=db_path, SIGMASHIELD_METRICS_PORT=str(self.metrics_port))
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", "streamlit", "run", APP_PATH,
+                "--server.headless=true", "--server.address=127.0.0.1", f"--server.port={self.port}",
+                "--server.enableXsrfProtection=false", "--server.fileWatcherType=none",
+                "--browser.gatherUsageStats=false", "--logger.level=error",
+            ],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+        )
+        self.url = f"ws://127.0.0.1:{self.port}/_stcore/stream"
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1).close()
+                break
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.close()
+                    raise RuntimeError("Streamlit server did not start")
+                time.sleep(0.2)
+
+    def usage(self):
+        return proc_usage(self.process.pid)
+
+    def metrics(self):
+        """The app's own /metrics.json, {} if the endpoint is not up yet"""
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{self.metrics_port}/metrics.json", timeout=5) as response:
+                return json.load(response)
+        except OSError:
+            return {}
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class BrowserSession:
+    """One simulated browser tab: a websocket plus the widgets of its last run
+
+    Reruns are serialized per session, so a fragment poll never overlaps a
+    user action from the same tab.
+    """
+
+    def __init__(self, url, latencies, rng):
+        self.url = url
+        self.latencies = latencies
+        self.rng = rng
+        self.errors = 0
+        # delta path -> (element, fragment id)
+        self.elements = {}
+        self.values = {}
+        self._fragments = {}
+        self._pollers = []
+        self._lock = asyncio.Lock()
+        self._ws = None
+
+    async def connect(self):
+        self._ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+
+    async def close(self):
+        for poller in self._pollers:
+            poller.cancel()
+        if self._ws is not None:
+            await self._ws.close()
+
+    def widgets(self, kind):
+        """[(widget proto, fragment id)] of type `kind` from the latest run"""
+        return [
+            (getattr(element, kind), fragment_id)
+            for element, fragment_id in self.elements.values()
+            if element.WhichOneof("type") == kind
+        ]
+
+    def button(self, label=None, key=None):
+        for button, fragment_id in self.widgets("button"):
+            if (label is None or button.label == label) and (key is None or button.id.endswith(f"-{key}")):
+                return button, fragment_id
+        return None, ""
+
+    async def rerun(self, action, trigger=None, value=None, fragment_id="", auto=False):
+        """Send one rerun and wait for it to finish; records and returns its latency"""
+        async with self._lock:
+            if value is not None:
+                self.values[value.id] = value
+            msg = BackMsg()
+            state = msg.rerun_script
+            state.fragment_id = fragment_id
+            state.is_auto_rerun = auto
+            live = {widget.id for kind in ("number_input", "selectbox") for widget, _ in self.widgets(kind)}
+            state.widget_states.widgets.extend(v for widget_id, v in self.values.items() if widget_id in live)
+            if trigger is not None:
+                state.widget_states.widgets.add(id=trigger, trigger_value=True)
+            start = time.perf_counter()
+            await self._ws.send(msg.SerializeToString())
+            while True:
+                forward = ForwardMsg()
+                forward.ParseFromString(await self._ws.recv())
+                kind = forward.WhichOneof("type")
+                if kind == "new_session" and not forward.new_session.fragment_ids_this_run:
+                    self.elements = {}
+                elif kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                    element = forward.delta.new_element
+                    if element.WhichOneof("type") == "exception":
+                        self.errors += 1
+                    self.elements[tuple(forward.metadata.delta_path)] = (element, forward.delta.fragment_id)
+                elif kind == "auto_rerun" and forward.auto_rerun.fragment_id not in self._fragments:
+                    self._fragments[forward.auto_rerun.fragment_id] = forward.auto_rerun.interval
+                    self._pollers.append(asyncio.ensure_future(
+                        self._poll(forward.auto_rerun.fragment_id, forward.auto_rerun.interval)
+                    ))
+                elif kind == "script_finished" and forward.script_finished in FINISHED:
+                    break
+            elapsed = time.perf_counter() - start
+        self.latencies[action].append(elapsed)
+        return elapsed
+
+    async def _poll(self, fragment_id, interval):
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.rerun("poll", fragment_id=fragment_id, auto=True)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def think(self, mean):
+        await asyncio.sleep(self.rng.expovariate(1 / mean) if mean else 0)
+
+    async def provide_coverage(self, think):
+        view = [(b, f) for b, f in self.widgets("button") if "-view_" in b.id]
+        if not view:
+            return
+        button, fragment_id = self.rng.choice(view)
+        await self.rerun("open_provide", trigger=button.id, fragment_id=fragment_id)
+        for _ in range(3):
+            stakes = [(w, f) for w, f in self.widgets("number_input") if w.label.startswith("Your Stake")]
+            if not stakes:
+                return
+            await self.think(think)
+            stake, fragment_id = stakes[0]
+            value = WidgetState(id=stake.id, int_value=self.rng.randrange(int(stake.min), int(stake.max) + 1, 10))
+            await self.rerun("stake", value=value, fragment_id=fragment_id)
+        await self.think(think)
+        button, fragment_id = self.button(label="Cancel")
+        if button is not None:
+            await self.rerun("close_provide", trigger=button.id, fragment_id=fragment_id)
+
+    async def create_request(self, think):
+        button, fragment_id = self.button(key="new_req_btn")
+        if button is None:
+            return
+        await self.rerun("open_create", trigger=button.id, fragment_id=fragment_id)
+        amounts = [(w, f) for w, f in self.widgets("number_input") if w.label == "Insurance Amount"]
+        if not amounts:
+            return
+        await self.think(think)
+        amount, fragment_id = amounts[0]
+        value = WidgetState(id=amount.id, int_value=self.rng.randrange(100, 100_001, 100))
+        await self.rerun("create_input", value=value, fragment_id=fragment_id)
+        await self.think(think)
+        button, fragment_id = self.button(label="✓ Create Request")
+        if button is not None:
+            await self.rerun("create", trigger=button.id, fragment_id=fragment_id)
+
+
+async def simulate_user(url, latencies, seed, start_delay, deadline, think, create_every):
+    """Load the page, then open/stake/cancel (and now and then create) until `deadline`"""
+    await asyncio.sleep(start_delay)
+    session = BrowserSession(url, latencies, random.Random(seed))
+    try:
+        await session.connect()
+        await session.rerun("load")
+        cycle = 0
+        while time.monotonic() < deadline:
+            await session.think(think)
+            await session.provide_coverage(think)
+            cycle += 1
+            if create_every and cycle % create_every == 0:
+                await session.think(think)
+                await session.create_request(think)
+        return session.errors
+    finally:
+        await session.close()
+
+
+def run_level(sessions, n_requests, duration, think, ramp, create_every):
+    """Latency percentiles, CPU and memory for `sessions` concurrent users on a fresh server"""
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "load.db")
+        seed_store(path, n_requests).close()
+        server = AppServer(path)
+        try:
+            # One warm session pays for imports, the shared market and its caches before the baseline
+            warm = {action: [] for action in ACTIONS}
+            asyncio.run(simulate_user(server.url, warm, -1, 0, time.monotonic() + 1, 0, 1))
+            server_cpu, server_rss = server.usage()
+            client_cpu = time.process_time()
+
+            latencies = {action: [] for action in ACTIONS}
+
+            async def drive():
+                deadline = time.monotonic() + ramp + duration
+                return await asyncio.gather(
+                    *(
+                        simulate_user(server.url, latencies, k, ramp * k / sessions, deadline, think, create_every)
+                        for k in range(sessions)
+                    ),
+                    return_exceptions=True,
+                )
+
+            start = time.perf_counter()
+            outcomes = asyncio.run(drive())
+            wall = time.perf_counter() - start
+            cpu, rss = server.usage()
+            client_cpu = time.process_time() - client_cpu
+            metrics = server.metrics()
+        finally:
+            server.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    failures = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+    user = np.concatenate([latencies[action] for action in ACTIONS if action not in ("load", "poll")] + [[]])
+    level = {
+        "sessions": sessions,
+        "wall_seconds": wall,
+        "reruns": sum(len(values) for values in latencies.values()),
+        "app_exceptions": sum(outcome for outcome in outcomes if not isinstance(outcome, BaseException)),
+        "failed_sessions": len(failures),
+        "first_failure": repr(failures[0]) if failures else None,
+        "latency_ms": percentiles(user),
+        "actions": {action: percentiles(values) for action, values in latencies.items() if values},
+        "client_cpu_pct": 100 * client_cpu / wall,
+    }
+    if cpu is not None:
+        level["server_cpu_pct"] = 100 * (cpu - server_cpu) / wall
+        level["server_cpu_pct_per_session"] = level["server_cpu_pct"] / sessions
+        level["server_rss_mb"] = rss / 1e6
+        level["rss_kb_per_session"] = (rss - server_rss) / sessions / 1e3
+    script = metrics.get("spans", {}).get("rerun")
+    if script:
+        level["full_script_mean_ms"] = 1000 * script["mean_seconds"]
+    return level
+
+
+def percentiles(values):
+    if not len(values):
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+    return {"count": len(values), "p50": p50, "p95": p95, "p99": p99}
+
+
+def print_level(level):
+    latency = level["latency_ms"]
+    poll = level["actions"].get("poll", {"count": 0})
+    print(
+        f"{level['sessions']:>5} sessions  {level['reruns']:>7,} reruns  "
+        f"user p50/p95/p99 {latency.get('p50', 0):7.1f} {latency.get('p95', 0):8.1f} {latency.get('p99', 0):8.1f} ms  "
+        f"poll p95 {poll.get('p95', 0):8.1f} ms  "
+        f"server CPU {level.get('server_cpu_pct', float('nan')):5.1f}% "
+        f"({level.get('server_cpu_pct_per_session', float('nan')):5.2f}%/session)  "
+        f"RSS {level.get('server_rss_mb', float('nan')):7.1f} MB "
+        f"(+{level.get('rss_kb_per_session', float('nan')):6.0f} KB/session)  "
+        f"client CPU {level['client_cpu_pct']:5.1f}%  "
+        f"errors {level['app_exceptions'] + level['failed_sessions']}",
+        flush=True,
+    )
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=list(SESSION_COUNTS),
+                        help="concurrent session counts to measure, one fresh server each")
+    parser.add_argument("--requests", type=int, default=1_000, help="requests seeded into the market")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of steady load per level")
+    parser.add_argument("--ramp", type=float, default=10.0, help="seconds over which sessions connect")
+    parser.add_argument("--think", type=float, default=1.0, help="mean think time between actions (s)")
+    parser.add_argument("--create-every", type=int, default=5,
+                        help="create a request every N coverage cycles per session (0: never)")
+    parser.add_argument("--output", "-o", help="also write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    levels = []
+    for sessions in args.sessions:
+        level = run_level(sessions, args.requests, args.duration, args.think, args.ramp, args.create_every)
+        print_level(level)
+        levels.append(level)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "levels": levels}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
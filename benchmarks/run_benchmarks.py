@@ -0,0 +1,468 @@
+"""Reproducible benchmark suite: quote math, card rendering, payout grids, stake optimizer,
+order matching, marketplace search, insurer portfolios, settlement, stress testing, the
+HTTP quote service, restart recovery, full-script reruns and memory per session
+
+Runs offline against temporary databases seeded with deterministic data and
+writes JSON that can be diffed between versions.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--output results.json] [--quick]
+    python benchmarks/run_benchmarks.py --compare old.json new.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from catalog_memory import measure
+from fixtures import APP_PATH, make_requests, seed_store
+
+import numpy as np
+
+from cards import _render_card, render_card_page
+from catalog import RequestCatalog
+from event_log import Journal
+from market import Market
+from market_index import MarketIndex, PrefixIndex
+from matching import MatchingEngine, StakeOrder
+from money import calculate_payouts_units, ratio_bp, to_units, token_decimals
+from optimizer import optimize_portfolio
+from sensitivity import PayoutSurface
+from settlement import MONTH_SECONDS, SettlementEngine
+from stress import Scenario, book_from_market, run_stress
+from payouts import calculate_payouts, calculate_payouts_batch
+from portfolios import Portfolios
+from quote_service import QuoteService
+
+
+def timed(fn, repeat=5, number=1):
+    """Median and best wall time of `fn()` over `repeat` rounds of `number` calls"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return statistics.median(samples), min(samples)
+
+
+def result(unit, median, best, **extra):
+    return {"unit": unit, "median": median, "best": best, **extra}
+
+
+def bench_payouts(n, repeat):
+    results = {}
+    requests = make_requests(n, seed=1)
+    rng = np.random.default_rng(1)
+    stakes = rng.integers(10, 5000, n).astype(np.float64)
+    for ins_type in ("fixed", "variable"):
+        subset = [dict(request, type=ins_type) for request in requests]
+        amount = np.array([request["amount"] for request in subset], dtype=np.float64)
+        ratio = np.array([request["ratio"] for request in subset])
+        pool_size = np.array([request["pool_size"] for request in subset], dtype=np.float64)
+        types = np.full(n, ins_type)
+
+        def scalar():
+            for request, stake in zip(subset, stakes):
+                calculate_payouts(request, stake)
+
+        def batch():
+            calculate_payouts_batch(amount, ratio, pool_size, types, stakes)
+
+        decimals = token_decimals([request["token"] for request in subset])
+        units = to_units(amount, decimals), ratio_bp(ratio), to_units(pool_size, decimals), to_units(stakes, decimals)
+
+        def fixed_point():
+            calculate_payouts_units(units[0], units[1], units[2], types, units[3])
+
+        median, best = timed(scalar, repeat=max(1, repeat // 2))
+        results[f"payouts.scalar.{ins_type}"] = result(
+            "quotes/s", n / median, n / best, n=n, note="higher is better"
+        )
+        median, best = timed(batch, repeat=repeat, number=10)
+        results[f"payouts.batch.{ins_type}"] = result(
+            "quotes/s", n / median, n / best, n=n, note="higher is better"
+        )
+        median, best = timed(fixed_point, repeat=repeat, number=10)
+        results[f"payouts.units.{ins_type}"] = result(
+            "quotes/s", n / median, n / best, n=n, note="higher is better"
+        )
+    return results
+
+
+def bench_cards(n, repeat):
+    requests = make_requests(n, seed=2)
+    for request_id, request in enumerate(requests, start=1):
+        request.update(id=request_id, version=1)
+    page = requests[:12]
+    render_card_page(page)
+
+    def uncached():
+        for request in requests:
+            _render_card(request)
+
+    median, best = timed(uncached, repeat=repeat)
+    cold = result("us/card", median / n * 1e6, best / n * 1e6, n=n)
+    median, best = timed(lambda: render_card_page(page), repeat=repeat, number=100)
+    warm = result("us/page", median * 1e6, best * 1e6, page_size=len(page))
+    return {"cards.render_uncached": cold, "cards.page_cached": warm}
+
+
+def bench_optimizer(n, repeat):
+    requests = make_requests(n, seed=4)
+    for request_id, request in enumerate(requests, start=1):
+        request.update(id=request_id, version=1)
+    catalog = RequestCatalog.from_requests(requests)
+    limits = {"max_per_request": 1_000, "max_per_token": 50_000}
+    median, best = timed(lambda: optimize_portfolio(catalog, 100_000, 0.05, **limits), repeat=repeat)
+    return {"optimizer.portfolio": result("s", median, best, n=n)}
+
+
+def bench_sensitivity(repeat):
+    """Payout grid of one variable request: one stake slice (slider move) and the full cube"""
+    request = {"id": 1, "version": 1, "amount": 10_000, "type": "variable", "ratio": 2.0, "pool_size": 5_000}
+    surface = PayoutSurface(request, 20_000)
+    ratios, pools, stakes = surface.shape
+    # A fresh surface each round, so the slice is evaluated rather than served from memory
+    median, best = timed(lambda: PayoutSurface(request, 20_000).stake_slice(stakes // 2), repeat=repeat)
+    slice_result = result("s", median, best, points=ratios * pools)
+    median, best = timed(surface.cube, repeat=repeat)
+    cube_result = result("s", median, best, points=ratios * pools * stakes)
+    return {"sensitivity.stake_slice": slice_result, "sensitivity.full_grid": cube_result}
+
+
+def bench_matching(n_requests, n_orders, threads=8):
+    """Stake orders per second submitted from concurrent threads, fills committed"""
+    with tempfile.TemporaryDirectory() as tmp:
+        market = Market(seed_store(os.path.join(tmp, "bench.db"), n_requests))
+        engine = MatchingEngine(market)
+        per_thread = n_orders // threads
+
+        def worker(k):
+            futures = [
+                engine.submit(StakeOrder(f"bench-{k}", 1.0, request_id=1 + (k * per_thread + i) % n_requests))
+                for i in range(per_thread)
+            ]
+            for future in futures:
+                future.result()
+
+        workers = [threading.Thread(target=worker, args=(k,)) for k in range(threads)]
+        start = time.perf_counter()
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+        elapsed = time.perf_counter() - start
+        engine.close()
+        market.store.close()
+    rate = per_thread * threads / elapsed
+    return {"matching.stake_orders": result("orders/s", rate, rate, n=per_thread * threads, threads=threads,
+                                            note="higher is better")}
+
+
+def bench_search(n, repeat, queries=2_000):
+    """Prefix search over an `n`-request index: one page plus the match count, and address index upkeep"""
+    requests = make_requests(n, seed=6)
+    for request_id, request in enumerate(requests, 1):
+        request["id"] = request_id
+        if request_id % 4 == 0:
+            # Addresses starting like a token symbol, so "E" matches both
+            request["borrower"] = "E" + request["borrower"][1:]
+    index = MarketIndex.from_requests(requests)
+    addresses = PrefixIndex()
+    addresses.extend([request["borrower"] for request in requests], np.arange(1, n + 1))
+    rng = np.random.default_rng(6)
+    borrowers = [requests[i]["borrower"] for i in rng.integers(0, n, queries)]
+    results = {}
+    for name, prefixes in (
+        ("address", [borrower[:4] for borrower in borrowers]),
+        ("address_exact", borrowers),
+        ("token", ["er"] * queries),
+        ("address_and_token", ["E"] * queries),
+    ):
+        def run():
+            for prefix in prefixes:
+                index.search(prefix, 24, 12)
+                index.search_count(prefix)
+        median, best = timed(run, repeat)
+        results[f"search.{name}"] = result("s", median / queries, best / queries, n=n)
+    added = make_requests(queries, seed=7)
+    for request_id, request in enumerate(added, n + 1):
+        request["id"] = request_id
+
+    def churn():
+        for request in added:
+            addresses.insert(request["borrower"], request["id"])
+        for request in added:
+            addresses.delete(request["borrower"], request["id"])
+    median, best = timed(churn, repeat)
+    results["search.insert_delete"] = result("s", median / queries, best / queries, n=n)
+    return results
+
+
+def bench_portfolio(n, positions, repeat, fills=1_000):
+    """Opening an insurer's portfolio and repricing it per fill, `positions` open positions on an `n`-request book"""
+    rng = np.random.default_rng(8)
+    with tempfile.TemporaryDirectory() as tmp:
+        market = Market(seed_store(os.path.join(tmp, "bench.db"), n))
+        market.store.close()
+    request_ids = rng.choice(np.arange(1, n + 1), positions, replace=False).tolist()
+    # The big insurer shares every pool with a few small ones
+    stakes = [(request_id, "whale", 25.0) for request_id in request_ids]
+    stakes += [(request_id, f"insurer-{k}", 10.0) for request_id in request_ids for k in range(4)]
+    start = time.perf_counter()
+    portfolios = Portfolios.from_stakes(market.catalog, stakes)
+    build = time.perf_counter() - start
+
+    def open_tab():
+        portfolios.totals("whale")
+        portfolios.positions("whale", positions - 50, 50)
+    median, best = timed(open_tab, repeat, number=100)
+    batch = [{"insurer": "whale", "request_id": request_id, "amount": 1.0} for request_id in request_ids[:fills]]
+
+    def fill():
+        for one in batch:
+            portfolios.add_fills([one], market.catalog)
+    fill_median, fill_best = timed(fill, repeat)
+    return {
+        "portfolio.build": result("s", build, build, n=len(stakes)),
+        "portfolio.open": result("s", median, best, positions=positions),
+        "portfolio.fill": result("s", fill_median / fills, fill_best / fills, insurers_per_pool=5),
+    }
+
+
+def bench_settlement(n):
+    """Settling `n` matured contracts in batches, 10% of them claimed"""
+    rng = np.random.default_rng(5)
+    with tempfile.TemporaryDirectory() as tmp:
+        market = Market(seed_store(os.path.join(tmp, "bench.db"), n))
+        engine = SettlementEngine(market, claim_outcomes=lambda ids: rng.random(len(ids)) < 0.1)
+        start = time.perf_counter()
+        settled = engine.run_once(time.time() + 40 * MONTH_SECONDS)
+        elapsed = time.perf_counter() - start
+        market.store.close()
+    return {"settlement.batch": result("s", elapsed, elapsed, n=settled)}
+
+
+def bench_stress(n, paths):
+    """Monte Carlo paths per second over an `n`-request book, ERG crashing in every path"""
+    with tempfile.TemporaryDirectory() as tmp:
+        market = Market(seed_store(os.path.join(tmp, "bench.db"), n))
+        book = book_from_market(market)
+        market.store.close()
+    scenario = Scenario(crash_prob={"ERG": 1.0}, crash_claim_prob={"ERG": 0.5})
+    start = time.perf_counter()
+    run_stress(book, scenario, paths, seed=0)
+    rate = paths / (time.perf_counter() - start)
+    return {"stress.paths": result("paths/s", rate, rate, n=n, paths=paths, processes=os.cpu_count(),
+                                   note="higher is better")}
+
+
+async def _http_quotes(port, request_ids, stake):
+    """Send GET /quote for each id over one keep-alive connection"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for request_id in request_ids:
+        writer.write(f"GET /quote?request_id={request_id}&stake={stake} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+        length = 0
+        while (line := await reader.readline()) != b"\r\n":
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        await reader.readexactly(length)
+    writer.close()
+
+
+def bench_quote_service(n_requests, n_quotes, connections=64):
+    """Single-quote HTTP requests per second over keep-alive connections; clients share the core"""
+    async def run(market):
+        server = await QuoteService(market).start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        per_connection = n_quotes // connections
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _http_quotes(port, [1 + (k * per_connection + i) % n_requests for i in range(per_connection)], 250)
+            for k in range(connections)
+        ))
+        elapsed = time.perf_counter() - start
+        server.close()
+        await server.wait_closed()
+        return per_connection * connections / elapsed
+
+    with tempfile.TemporaryDirectory() as tmp:
+        market = Market(seed_store(os.path.join(tmp, "bench.db"), n_requests))
+        rate = asyncio.run(run(market))
+        market.store.close()
+    return {"quote_service.http_quotes": result("quotes/s", rate, rate, n=n_quotes, connections=connections,
+                                                note="higher is better")}
+
+
+def bench_recovery(n, writes):
+    """Market startup: full reload from the store vs snapshot plus `writes` logged events"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = seed_store(os.path.join(tmp, "bench.db"), n)
+        journal_dir = os.path.join(tmp, "bench.journal")
+        journal = Journal(journal_dir)
+        market = Market(store, journal)
+        for i in range(writes):
+            market.add_coverage(1 + i % n, 1.0, insurer="bench")
+        journal.close()
+
+        start = time.perf_counter()
+        Market(store)
+        rebuild = time.perf_counter() - start
+        journal = Journal(journal_dir)
+        start = time.perf_counter()
+        market = Market(store, journal)
+        recover = time.perf_counter() - start
+        journal.close()
+        store.close()
+    return {
+        "recovery.full_reload": result("s", rebuild, rebuild, n=n),
+        "recovery.snapshot_replay": result("s", recover, recover, n=n, events=writes),
+    }
+
+
+def bench_reruns(sizes, repeat):
+    """Warm full-script rerun latency through Streamlit's AppTest harness"""
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    os.environ.setdefault("SIGMASHIELD_METRICS_PORT", "0")
+    results = {}
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            seed_store(path, n).close()
+            os.environ["SIGMASHIELD_DB"] = path
+            st.cache_resource.clear()
+            st.cache_data.clear()
+            app = AppTest.from_file(APP_PATH, default_timeout=600)
+            start = time.perf_counter()
+            app.run()
+            first = time.perf_counter() - start
+            if app.exception:
+                raise RuntimeError(f"App raised during benchmark: {app.exception[0].message}")
+            median, best = timed(app.run, repeat=repeat)
+            results[f"rerun.requests_{n}"] = result("s", median, best, first_run=first, n=n)
+            st.cache_resource.clear()
+    os.environ.pop("SIGMASHIELD_DB", None)
+    return results
+
+
+def bench_session_memory(n, sessions):
+    """Python heap each extra browser session holds on an `n`-request market
+
+    Measured with tracemalloc, which counts live allocations rather than
+    resident pages, so allocator reuse does not show up as negative memory.
+    `catalog_copy_bytes` is what one list-of-dicts copy of the catalog
+    takes: the per-session cost the shared `Market` avoids.
+    """
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    os.environ.setdefault("SIGMASHIELD_METRICS_PORT", "0")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        store = seed_store(path, n)
+        _, copy_bytes = measure(store.list_requests)
+        store.close()
+        os.environ["SIGMASHIELD_DB"] = path
+        st.cache_resource.clear()
+        st.cache_data.clear()
+        # The first session pays for the shared market, caches and imports
+        apps = [AppTest.from_file(APP_PATH, default_timeout=600)]
+        apps[0].run()
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(sessions):
+            app = AppTest.from_file(APP_PATH, default_timeout=600)
+            app.run()
+            apps.append(app)
+        gc.collect()
+        per_session = (tracemalloc.get_traced_memory()[0] - before) / sessions
+        tracemalloc.stop()
+        st.cache_resource.clear()
+    os.environ.pop("SIGMASHIELD_DB", None)
+    extra = {}
+    if per_session < 0:
+        # Shared caches shrank meanwhile; the figure says nothing about sessions
+        extra["unclamped"] = per_session
+        per_session = 0.0
+    return {f"memory.per_session_{n}": result(
+        "bytes", per_session, per_session, n=n, sessions=sessions, catalog_copy_bytes=copy_bytes, **extra,
+    )}
+
+
+def environment():
+    import streamlit
+
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "streamlit": streamlit.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def run(quick=False):
+    repeat = 3 if quick else 7
+    results = {}
+    results.update(bench_payouts(2_000 if quick else 20_000, repeat))
+    results.update(bench_cards(1_000 if quick else 10_000, repeat))
+    results.update(bench_optimizer(1_000 if quick else 10_000, repeat))
+    results.update(bench_sensitivity(repeat))
+    results.update(bench_matching(1_000, 4_000 if quick else 40_000))
+    results.update(bench_search(100_000 if quick else 1_000_000, repeat))
+    results.update(bench_portfolio(10_000 if quick else 100_000, 5_000 if quick else 50_000, repeat))
+    results.update(bench_settlement(10_000 if quick else 100_000))
+    results.update(bench_stress(1_000, 100_000 if quick else 1_000_000))
+    results.update(bench_quote_service(1_000, 4_000 if quick else 40_000))
+    results.update(bench_recovery(10_000 if quick else 100_000, 1_000))
+    results.update(bench_reruns([10, 1_000] if quick else [10, 1_000, 10_000], repeat))
+    results.update(bench_session_memory(1_000 if quick else 10_000, 20 if quick else 50))
+    return {"environment": environment(), "results": results}
+
+
+def compare(old_path, new_path):
+    """Print the relative change of every benchmark present in both files"""
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    for name in sorted(old.keys() & new.keys()):
+        before, after = old[name]["median"], new[name]["median"]
+        change = (after - before) / before * 100 if before else float("nan")
+        print(f"{name:<32} {before:>14.4g} -> {after:>14.4g} {new[name]['unit']:<9} {change:+7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", "-o", help="write JSON results to this file (default: stdout)")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and fewer repeats")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two result files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = json.dumps(run(quick=args.quick), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
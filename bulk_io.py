@@ -0,0 +1,261 @@
+"""Streaming bulk import and export of insurance requests (CSV and Parquet)
+
+Both directions work chunk by chunk, so memory use depends on the chunk size
+rather than on the size of the request book.
+"""
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from catalog import CATEGORY_COLUMNS, COLUMNS
+from money import service_fee_for
+from payouts import pool_fill_pct, pool_target
+from request_rules import (
+    APR_PER_RATIO, FIXED_RATIO, ICONS, INTEREST_RATE_PER_RATIO, MAX_AMOUNT, MAX_RATIO, MAX_TERM_MONTHS,
+    MIN_AMOUNT, MIN_RATIO, MIN_TERM_MONTHS, TOKEN_ICONS, TOKENS, TYPES,
+    validation_errors,
+)
+
+
+REQUIRED_COLUMNS = ("amount", "token", "type", "ratio", "term_months")
+OPTIONAL_COLUMNS = {"icon": None, "pool_size": 0.0, "borrower": "Imported", "created_at": 0.0, "settled_at": 0.0}
+# The version is store bookkeeping; settled_at lets an import tell settled contracts apart
+EXPORT_COLUMNS = COLUMNS[:-1]
+
+DEFAULT_CHUNKSIZE = 50_000
+MAX_REPORTED_ERRORS = 1_000
+
+
+@dataclass
+class ImportReport:
+    rows_read: int = 0
+    rows_imported: int = 0
+    rows_rejected: int = 0
+    # (source row number, reasons) for the first MAX_REPORTED_ERRORS rejected rows
+    errors: list = field(default_factory=list)
+
+
+def _detect_format(path, file_format):
+    if file_format:
+        return file_format.lower()
+    extension = os.path.splitext(str(path))[1].lower()
+    return "parquet" if extension in (".parquet", ".pq") else "csv"
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise ImportError("Parquet support needs pyarrow: pip install pyarrow") from exc
+    return pq
+
+
+def iter_chunks(path, chunksize=DEFAULT_CHUNKSIZE, file_format=None):
+    """Yield DataFrames of at most `chunksize` rows from a CSV or Parquet file"""
+    if _detect_format(path, file_format) == "parquet":
+        pq = _require_pyarrow()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, float_precision="round_trip")
+
+
+def _blank(column):
+    """Mask of empty cells: missing values and whitespace-only strings"""
+    return column.isna() | column.astype(str).str.strip().eq("")
+
+
+def _pool_size_errors(value):
+    if pd.isna(value) or not str(value).strip():
+        return []
+    pool_size = pd.to_numeric(pd.Series([value]), errors="coerce").iloc[0]
+    if pd.isna(pool_size) or not np.isfinite(pool_size) or pool_size < 0:
+        return ["pool_size must be a non-negative number"]
+    return []
+
+
+def _settled_errors(value):
+    if pd.isna(value) or not str(value).strip():
+        return []
+    if pd.to_numeric(pd.Series([value]), errors="coerce").iloc[0] == 0:
+        return []
+    return ["settled contracts are not imported (settled_at must be blank or 0)"]
+
+
+def validate_chunk(chunk):
+    """Split a chunk into normalized valid requests and a mask of rejected rows
+
+    Applies the same limits as the Create New Insurance Request dialog and
+    fills in the fields the dialog derives (fixed ratio, fees, APR, icon).
+    Optional columns that are missing or blank take their default; a
+    `pool_size` that is not a non-negative number rejects the row. A
+    `created_at` is kept, but a row with a non-zero `settled_at` is
+    rejected: the settlement itself is not part of the file.
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    df = chunk.copy()
+    for column, default in OPTIONAL_COLUMNS.items():
+        if column not in df.columns:
+            df[column] = default
+        elif default is not None:
+            df[column] = df[column].where(~_blank(df[column]), default)
+    amount = pd.to_numeric(df["amount"], errors="coerce")
+    ratio = pd.to_numeric(df["ratio"], errors="coerce")
+    term = pd.to_numeric(df["term_months"], errors="coerce")
+    pool_size = pd.to_numeric(df["pool_size"], errors="coerce")
+    created_at = pd.to_numeric(df["created_at"], errors="coerce").fillna(0.0)
+    settled_at = pd.to_numeric(df["settled_at"], errors="coerce")
+    fixed = df["type"] == "fixed"
+    ratio = ratio.where(~fixed, FIXED_RATIO)
+
+    valid = (
+        df["token"].isin(TOKENS)
+        & df["type"].isin(TYPES)
+        & amount.between(MIN_AMOUNT, MAX_AMOUNT)
+        & ratio.between(MIN_RATIO, MAX_RATIO)
+        & term.between(MIN_TERM_MONTHS, MAX_TERM_MONTHS)
+        & (term == term.round())
+        & (pool_size >= 0)
+        & np.isfinite(pool_size)
+        & (settled_at == 0)
+    )
+
+    df["amount"] = amount
+    df["ratio"] = ratio
+    df["term_months"] = term
+    df["pool_size"] = pool_size
+    df["created_at"] = created_at
+    df = df[valid]
+    icon = df["icon"].where(df["icon"].isin(ICONS), df["token"].map(TOKEN_ICONS))
+    target = pool_target(df["amount"].to_numpy(), df["ratio"].to_numpy(), df["type"].to_numpy())
+    requests = pd.DataFrame({
+        "amount": df["amount"],
+        "token": df["token"],
+        "icon": icon,
+        "ratio": df["ratio"],
+        "type": df["type"],
+        "pool_size": df["pool_size"],
+        "pool_filled": pool_fill_pct(df["pool_size"].to_numpy(), target),
+        "term_months": df["term_months"].astype(np.int64),
+        "interest_rate": np.trunc(df["ratio"] * INTEREST_RATE_PER_RATIO).astype(np.int64),
+        "apr": df["ratio"] * APR_PER_RATIO,
+        "service_fee": service_fee_for(df["amount"].to_numpy(), df["token"].to_numpy()),
+        "borrower": df["borrower"].astype(str),
+        "created_at": df["created_at"],
+    })
+    return requests, ~valid
+
+
+def import_requests(market, path, chunksize=DEFAULT_CHUNKSIZE, file_format=None):
+    """Validate and bulk-insert requests from a CSV or Parquet file, one chunk at a time
+
+    The valid rows of each chunk are written in a single transaction as
+    soon as the chunk is read. Invalid rows are skipped and reported with
+    their reasons. If the import stops partway (a database error, a chunk
+    with missing columns), the chunks before it stay imported;
+    `rows_imported` of the report returned so far says how many rows.
+    """
+    report = ImportReport()
+    for chunk in iter_chunks(path, chunksize, file_format):
+        requests, rejected = validate_chunk(chunk)
+        if rejected.any():
+            for index, row in chunk[rejected.to_numpy()].iterrows():
+                if len(report.errors) >= MAX_REPORTED_ERRORS:
+                    break
+                row = row.to_dict()
+                if row.get("type") == "fixed":
+                    row["ratio"] = FIXED_RATIO
+                reasons = (
+                    validation_errors(row) + _pool_size_errors(row.get("pool_size"))
+                    + _settled_errors(row.get("settled_at"))
+                )
+                report.errors.append((report.rows_read + index - chunk.index[0], reasons))
+        report.rows_read += len(chunk)
+        report.rows_rejected += int(rejected.sum())
+        if len(requests):
+            report.rows_imported += len(market.create_requests(requests.to_dict("records")))
+    return report
+
+
+def iter_export_chunks(catalog, chunksize=DEFAULT_CHUNKSIZE, size=None):
+    """Yield DataFrames of the first `size` catalog rows straight from its columns"""
+    size = len(catalog) if size is None else size
+    for start in range(0, size, chunksize):
+        stop = min(start + chunksize, size)
+        data = {}
+        for name in EXPORT_COLUMNS:
+            column = catalog.column(name)[start:stop]
+            if name in CATEGORY_COLUMNS:
+                values = np.asarray(catalog.categories[name].values, dtype=object)
+                column = values[column]
+            data[name] = column
+        yield pd.DataFrame(data)
+
+
+def export_requests(market, path, chunksize=DEFAULT_CHUNKSIZE, file_format=None):
+    """Stream the whole catalog to a CSV or Parquet file and return the row count"""
+    # Rows present when the export starts; requests created meanwhile are left out
+    catalog = market.catalog
+    size = len(catalog)
+    rows = 0
+    chunks = iter_export_chunks(catalog, chunksize, size)
+    if _detect_format(path, file_format) == "parquet":
+        pq = _require_pyarrow()
+        import pyarrow as pa
+
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(path, "w", newline="") as f:
+            if size == 0:
+                f.write(",".join(EXPORT_COLUMNS) + "\n")
+            for chunk in chunks:
+                chunk.to_csv(f, header=rows == 0, index=False)
+                rows += len(chunk)
+    return rows
+
+
+def main(argv=None):
+    import argparse
+
+    from market import Market
+    from request_store import RequestStore
+
+    parser = argparse.ArgumentParser(description="Bulk import or export insurance requests")
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("path", help="CSV or Parquet file (chosen by extension)")
+    parser.add_argument("--db", help="request database (default: $SIGMASHIELD_DB or insurance_requests.db)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--format", choices=("csv", "parquet"), dest="file_format")
+    args = parser.parse_args(argv)
+
+    market = Market(RequestStore(args.db))
+    try:
+        if args.action == "import":
+            report = import_requests(market, args.path, args.chunksize, args.file_format)
+            print(f"Read {report.rows_read} rows: {report.rows_imported} imported, {report.rows_rejected} rejected")
+            for row, reasons in report.errors:
+                print(f"  row {row}: {'; '.join(reasons)}")
+        else:
+            rows = export_requests(market, args.path, args.chunksize, args.file_format)
+            print(f"Exported {rows} requests to {args.path}")
+    finally:
+        market.store.close()
+
+
+if __name__ == "__main__":
+    main()
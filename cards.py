@@ -0,0 +1,140 @@
+"""HTML rendering for the marketplace card grid"""
+import html
+import threading
+from collections import OrderedDict
+from string import Template
+
+
+# Pre-compiled card template; lines are kept flush-left so markdown never
+# mistakes them for an indented code block
+CARD_TEMPLATE = Template("""<div class="insurance-card">
+<div class="type-badge type-$type">$type_upper</div>
+<div class="card-header">
+<div>
+<div class="card-title">Insurance request #$id</div>
+<div>
+<span class="card-amount">$amount</span>
+<span class="card-token">$token</span>
+</div>
+</div>
+<div class="token-icon icon-$icon">
+"Σ"
+</div>
+</div>
+<div class="collateral-section">
+<div class="collateral-label">Pool Status</div>
+<div class="collateral-badge badge-$risk_color">$risk_text</div>
+<div class="pool-info">
+<div>
+<span class="pool-amount">$pool_size</span>
+<span class="pool-usd">≈$pool_usd USD</span>
+</div>
+</div>
+</div>
+<div class="info-row">
+<div class="info-col">
+<div class="info-label">Term</div>
+<div class="info-value">$term_months months</div>
+</div>
+</div>
+<div class="info-row">
+<div class="info-col">
+<div class="info-label">Payout Ratio</div>
+<div class="info-value">$ratio:1</div>
+<div class="info-subtext">$apr% APR</div>
+</div>
+<div class="info-col" style="text-align: right;">
+<div class="info-label">Requester</div>
+<div class="info-value" style="font-size: 14px;">$borrower</div>
+</div>
+</div>
+<div class="service-fee">Service Fee: $service_fee $token</div>
+</div>""")
+
+GRID_TEMPLATE = Template('<div class="card-grid">$cards</div>')
+
+CARD_CACHE_SIZE = 4096
+PAGE_CACHE_SIZE = 256
+
+_card_cache = OrderedDict()
+_card_cache_lock = threading.Lock()
+# Assembled pages, so sessions looking at the same page share one string
+_page_cache = OrderedDict()
+
+
+def format_amount(value):
+    """Thousands-separated amount, without decimals when it is whole"""
+    value = float(value)
+    return f"{value:,.0f}" if value.is_integer() else f"{value:,.2f}"
+
+
+def risk_badge(pool_filled):
+    """Badge color and text for a pool fill percentage"""
+    if pool_filled < 50:
+        risk_color = "danger"
+    elif pool_filled < 80:
+        risk_color = "warning"
+    else:
+        risk_color = "success"
+    return risk_color, f"△ -{100 - pool_filled}%"
+
+
+def _render_card(request, usd_price=None):
+    """Fill the card template from any mapping with the request fields"""
+    risk_color, risk_text = risk_badge(request['pool_filled'])
+    return CARD_TEMPLATE.substitute(
+        id=request['id'],
+        type=html.escape(request['type']),
+        type_upper=html.escape(request['type'].upper()),
+        amount=format_amount(request['amount']),
+        token=html.escape(request['token']),
+        icon=html.escape(request['icon']),
+        risk_color=risk_color,
+        risk_text=risk_text,
+        pool_size=format_amount(request['pool_size']),
+        pool_usd="–" if usd_price is None else format_amount(request['pool_size'] * usd_price),
+        term_months=request['term_months'],
+        ratio=f"{request['ratio']:.1f}",
+        apr=f"{request['apr']:.2f}",
+        borrower=html.escape(request['borrower']),
+        service_fee=format_amount(request['service_fee']),
+    )
+
+
+def render_card(request, usd_price=None):
+    """Card HTML for one request, cached per (request id, version, USD price)"""
+    key = (request['id'], request['version'], usd_price)
+    with _card_cache_lock:
+        card = _card_cache.get(key)
+        if card is not None:
+            _card_cache.move_to_end(key)
+            return card
+    card = _render_card(request, usd_price)
+    with _card_cache_lock:
+        _card_cache[key] = card
+        if len(_card_cache) > CARD_CACHE_SIZE:
+            _card_cache.popitem(last=False)
+    return card
+
+
+def render_card_page(requests, prices=None):
+    """HTML for one page of cards, emitted as a single markdown payload
+
+    `prices` maps tokens to USD prices; pools in unpriced tokens show no USD value.
+    """
+    prices = prices or {}
+    usd_prices = [prices.get(request['token']) for request in requests]
+    key = tuple((request['id'], request['version'], usd_price) for request, usd_price in zip(requests, usd_prices))
+    with _card_cache_lock:
+        page = _page_cache.get(key)
+        if page is not None:
+            _page_cache.move_to_end(key)
+            return page
+    page = GRID_TEMPLATE.substitute(
+        cards="".join(render_card(request, usd_price) for request, usd_price in zip(requests, usd_prices))
+    )
+    with _card_cache_lock:
+        page = _page_cache.setdefault(key, page)
+        if len(_page_cache) > PAGE_CACHE_SIZE:
+            _page_cache.popitem(last=False)
+    return page
@@ -0,0 +1,225 @@
+"""Columnar (struct-of-arrays) in-memory catalog of insurance requests"""
+import numpy as np
+
+from money import calculate_payouts_exact, token_decimals
+
+
+NUMERIC_COLUMNS = {
+    "id": np.int64,
+    "amount": np.float64,
+    "ratio": np.float64,
+    "pool_size": np.float64,
+    "pool_filled": np.int16,
+    "term_months": np.int16,
+    "interest_rate": np.int32,
+    "apr": np.float64,
+    "service_fee": np.float64,
+    "created_at": np.float64,
+    "settled_at": np.float64,
+    "version": np.int32,
+}
+
+CATEGORY_COLUMNS = {
+    "token": np.uint8,
+    "type": np.uint8,
+    "icon": np.uint8,
+    "borrower": np.uint32,
+}
+
+COLUMNS = (
+    "id", "amount", "token", "icon", "ratio", "type", "pool_size", "pool_filled",
+    "term_months", "interest_rate", "apr", "service_fee", "borrower", "created_at", "settled_at", "version",
+)
+
+
+class Categories:
+    """Interned string values and their integer codes"""
+
+    __slots__ = ("values", "_codes")
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, value):
+        """Code for `value`, or None if it was never interned"""
+        return self._codes.get(value)
+
+
+class RequestView:
+    """Read-only, dict-like view of one catalog row"""
+
+    __slots__ = ("_catalog", "_row")
+
+    def __init__(self, catalog, row):
+        self._catalog = catalog
+        self._row = row
+
+    def __getitem__(self, key):
+        return self._catalog.value(self._row, key)
+
+    def __contains__(self, key):
+        return key in COLUMNS
+
+    def __repr__(self):
+        return f"RequestView({self.to_dict()!r})"
+
+    def get(self, key, default=None):
+        return self[key] if key in COLUMNS else default
+
+    def keys(self):
+        return COLUMNS
+
+    @property
+    def row(self):
+        return self._row
+
+    def to_dict(self):
+        return {key: self[key] for key in COLUMNS}
+
+
+class RequestCatalog:
+    """Insurance requests stored column by column
+
+    Numeric fields live in typed NumPy arrays; token, type, icon and borrower
+    are stored as small integer codes into interned value tables. Arrays grow
+    by doubling. `view(row)` gives a dict-like `RequestView` that the card
+    renderer and `quote_payouts` accept as-is, and `quote` runs the exact batch
+    payout engine straight off the columns.
+    """
+
+    def __init__(self, capacity=1024):
+        self._size = 0
+        self._capacity = max(1, capacity)
+        self._columns = {
+            name: np.zeros(self._capacity, dtype=dtype)
+            for name, dtype in {**NUMERIC_COLUMNS, **CATEGORY_COLUMNS}.items()
+        }
+        self.categories = {name: Categories() for name in CATEGORY_COLUMNS}
+        self._row_of = {}
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, request_id):
+        return request_id in self._row_of
+
+    def __iter__(self):
+        for row in range(self._size):
+            yield RequestView(self, row)
+
+    @classmethod
+    def from_requests(cls, requests):
+        requests = list(requests)
+        catalog = cls(capacity=max(1024, len(requests)))
+        for request in requests:
+            catalog.append(request)
+        return catalog
+
+    @classmethod
+    def from_arrays(cls, columns, categories):
+        """Catalog holding copies of `columns` ({name: array}) and `categories` ({name: values})"""
+        size = len(columns["id"])
+        catalog = cls(capacity=max(1024, size))
+        for name, values in columns.items():
+            catalog._columns[name][:size] = values
+        for name, values in categories.items():
+            for value in values:
+                catalog.categories[name].code(value)
+        catalog._size = size
+        catalog._row_of = dict(zip(np.asarray(columns["id"]).tolist(), range(size)))
+        return catalog
+
+    def arrays(self):
+        """Copies of every column and category table, e.g. for a snapshot"""
+        columns = {name: self.column(name).copy() for name in self._columns}
+        categories = {name: list(table.values) for name, table in self.categories.items()}
+        return columns, categories
+
+    def column(self, name):
+        """Live array (or code array) for a column, trimmed to the catalog size"""
+        return self._columns[name][:self._size]
+
+    def _grow(self):
+        self._capacity *= 2
+        for name, array in self._columns.items():
+            grown = np.zeros(self._capacity, dtype=array.dtype)
+            grown[:self._size] = array[:self._size]
+            self._columns[name] = grown
+
+    def _set_row(self, row, request):
+        for name in NUMERIC_COLUMNS:
+            self._columns[name][row] = request.get(name, 1 if name == "version" else 0)
+        for name in CATEGORY_COLUMNS:
+            self._columns[name][row] = self.categories[name].code(request[name])
+
+    def append(self, request):
+        """Add a request (any mapping with the request fields) and return its row"""
+        request_id = request["id"]
+        if request_id in self._row_of:
+            raise KeyError(f"Request {request_id} is already in the catalog")
+        if self._size == self._capacity:
+            self._grow()
+        row = self._size
+        self._set_row(row, request)
+        self._row_of[request_id] = row
+        self._size += 1
+        return row
+
+    def update(self, request):
+        """Overwrite the stored fields of an existing request"""
+        self._set_row(self._row_of[request["id"]], request)
+
+    def assign(self, rows, **values):
+        """Overwrite numeric columns for many rows at once"""
+        for name, value in values.items():
+            self._columns[name][rows] = value
+
+    def row_of(self, request_id):
+        return self._row_of[request_id]
+
+    def rows_of(self, request_ids):
+        """Rows of many request ids at once, -1 for ids not in the catalog"""
+        row_of = self._row_of
+        return np.array([row_of.get(request_id, -1) for request_id in request_ids], dtype=np.int64)
+
+    def get(self, request_id):
+        """View of a request by id, or None"""
+        row = self._row_of.get(request_id)
+        return None if row is None else RequestView(self, row)
+
+    def view(self, row):
+        return RequestView(self, row)
+
+    def value(self, row, name):
+        """Python value of one field"""
+        if name in CATEGORY_COLUMNS:
+            return self.categories[name].values[self._columns[name][row]]
+        return self._columns[name][row].item()
+
+    def is_fixed(self, rows=slice(None)):
+        code = self.categories["type"].lookup("fixed")
+        types = self.column("type")[rows]
+        return types == code if code is not None else np.zeros(types.shape, dtype=bool)
+
+    def quote(self, rows, stakes):
+        """Payouts for (row, stake) pairs, computed straight from the columns in exact token units"""
+        rows = np.asarray(rows)
+        return calculate_payouts_exact(
+            self.column("amount")[rows],
+            self.column("ratio")[rows],
+            self.column("pool_size")[rows],
+            self.is_fixed(rows),
+            stakes,
+            token_decimals(self.categories["token"].values)[self.column("token")[rows]],
+        )
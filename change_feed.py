@@ -0,0 +1,64 @@
+"""Process-wide market version counter and feed of changed request ids
+
+Sessions remember the version they last rendered and ask the feed what
+changed since then, so an idle session costs one integer comparison per
+poll instead of a rerun of the whole script.
+"""
+import collections
+import threading
+
+
+MAX_ENTRIES = 4096
+
+
+class ChangeFeed:
+    """Bounded history of (version, changed request ids)
+
+    `publish(version, None)` marks a full reset (e.g. a rebuild after
+    another process wrote to the store); anyone behind it must reload.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self._entries = collections.deque()
+        self._max_entries = max_entries
+        self._version = 0
+        # Oldest version `changes_since` can still answer for
+        self._floor = 0
+        self._changed = threading.Condition()
+
+    @property
+    def version(self):
+        return self._version
+
+    def publish(self, version, request_ids):
+        with self._changed:
+            if request_ids is None:
+                self._entries.clear()
+                self._floor = version
+            else:
+                self._entries.append((version, frozenset(request_ids)))
+                if len(self._entries) > self._max_entries:
+                    self._floor = self._entries.popleft()[0]
+            self._version = version
+            self._changed.notify_all()
+
+    def changes_since(self, version):
+        """(current version, ids changed after `version`), ids None if too far behind"""
+        with self._changed:
+            current = self._version
+            if version == current:
+                return current, frozenset()
+            if version < self._floor or version > current:
+                return current, None
+            changed = set()
+            for entry_version, request_ids in reversed(self._entries):
+                if entry_version <= version:
+                    break
+                changed |= request_ids
+            return current, frozenset(changed)
+
+    def wait(self, version, timeout=None):
+        """Block until the version moves past `version`; returns the current version"""
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            return self._version
@@ -1,6 +1,26 @@
 import streamlit as st
-from datetime import datetime, timedelta
+import os
 import random
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from cards import format_amount, render_card_page
+from event_log import Journal, JournalInUseError
+from quote_cache import QuoteCache
+from market import Market
+from matching import MatchingEngine, StakeOrder
+from metrics import METRICS, start_metrics_server
+from money import service_fee_for
+from prices import PriceOracle, price_source_from_env, usd_total
+from request_rules import (
+    APR_PER_RATIO, FIXED_RATIO, ICONS, INTEREST_RATE_PER_RATIO, MAX_AMOUNT, MAX_RATIO,
+    MAX_TERM_MONTHS, MIN_AMOUNT, MIN_RATIO, MIN_TERM_MONTHS, TOKENS, TYPES,
+)
+from request_store import RequestStore
+from sensitivity import SurfaceCache
+from settlement import SettlementEngine
 
 # Page configuration
 st.set_page_config(
@@ -10,352 +30,404 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Custom CSS for SigmaFi-style design
-st.markdown("""
-    <style>
-    /* Global Styles */
-    .stApp {
-        background: #e8eaed;
-    }
-    
-    /* Remove default padding */
-    .main .block-container {
-        padding-top: 1rem;
-        padding-bottom: 2rem;
-        max-width: 1600px;
-    }
-    
-    /* Header */
-    .top-header {
-        display: flex;
-        justify-content: space-between;
-        align-items: center;
-        padding: 20px 30px;
-        background: white;
-        border-radius: 12px;
-        margin-bottom: 20px;
-        box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-    }
-    
-    .logo-section {
-        display: flex;
-        align-items: center;
-        gap: 15px;
-        font-size: 24px;
-        font-weight: 700;
-        color: #1a1a1a;
-    }
-    
-    .tvl-display {
-        color: #666;
-        font-size: 14px;
-    }
-    
-    .tvl-value {
-        color: #1a1a1a;
-        font-weight: 600;
-        margin-left: 5px;
-    }
-    
-    /* Controls Bar */
-    .controls-bar {
-        background: white;
-        border-radius: 12px;
-        padding: 20px 30px;
-        margin-bottom: 20px;
-        display: flex;
-        justify-content: space-between;
-        align-items: center;
-        box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-    }
-    
-    /* Insurance Request Cards */
-    .insurance-card {
-        background: white;
-        border-radius: 16px;
-        padding: 24px;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.08);
-        transition: all 0.3s ease;
-        cursor: pointer;
-        height: 100%;
-        position: relative;
-    }
-    
-    .insurance-card:hover {
-        box-shadow: 0 4px 16px rgba(0,0,0,0.12);
-        transform: translateY(-2px);
-    }
-    
-    .card-header {
-        display: flex;
-        justify-content: space-between;
-        align-items: flex-start;
-        margin-bottom: 20px;
-    }
-    
-    .card-title {
-        color: #999;
-        font-size: 14px;
-        margin-bottom: 8px;
-    }
-    
-    .card-amount {
-        font-size: 28px;
-        font-weight: 700;
-        color: #1a1a1a;
-    }
-    
-    .card-token {
-        font-size: 16px;
-        color: #666;
-        font-weight: 500;
-        margin-left: 8px;
-    }
-    
-    .token-icon {
-        width: 48px;
-        height: 48px;
-        border-radius: 50%;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-size: 24px;
-        font-weight: 700;
-        color: white;
-    }
-    
-    .icon-purple {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-    }
-    
-    .icon-orange {
-        background: linear-gradient(135deg, #f2994a 0%, #f2c94c 100%);
-    }
-    
-    .icon-blue {
-        background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
-    }
-    
-    .icon-red {
-        background: linear-gradient(135deg, #fa709a 0%, #fee140 100%);
-    }
-    
-    /* Collateral Section */
-    .collateral-section {
-        margin: 20px 0;
-        padding: 16px;
-        background: #f8f9fa;
-        border-radius: 12px;
-    }
-    
-    .collateral-label {
-        color: #666;
-        font-size: 13px;
-        margin-bottom: 12px;
-    }
-    
-    .collateral-badge {
-        display: inline-block;
-        padding: 6px 12px;
-        border-radius: 20px;
-        font-size: 12px;
-        font-weight: 600;
-        margin-bottom: 8px;
-    }
-    
-    .badge-danger {
-        background: #fee;
-        color: #d32f2f;
-    }
-    
-    .badge-warning {
-        background: #fff3e0;
-        color: #f57c00;
-    }
-    
-    .badge-success {
-        background: #e8f5e9;
-        color: #388e3c;
-    }
-    
-    .pool-info {
-        display: flex;
-        justify-content: space-between;
-        align-items: center;
-    }
-    
-    .pool-amount {
-        font-size: 20px;
-        font-weight: 700;
-        color: #1a1a1a;
-    }
-    
-    .pool-usd {
-        color: #999;
-        font-size: 12px;
-        margin-left: 5px;
-    }
-    
-    /* Term and Interest */
-    .info-row {
-        display: flex;
-        justify-content: space-between;
-        margin: 16px 0;
-    }
-    
-    .info-col {
-        flex: 1;
-    }
-    
-    .info-label {
-        color: #666;
-        font-size: 13px;
-        margin-bottom: 4px;
-    }
-    
-    .info-value {
-        color: #1a1a1a;
-        font-size: 20px;
-        font-weight: 700;
-    }
-    
-    .info-subtext {
-        color: #999;
-        font-size: 12px;
-    }
-    
-    /* Service Fee */
-    .service-fee {
-        text-align: center;
-        color: #999;
-        font-size: 12px;
-        margin: 16px 0;
-    }
-    
-    /* Connect Button */
-    .connect-btn {
-        width: 100%;
-        padding: 14px;
-        background: #e0e0e0;
-        border: none;
-        border-radius: 8px;
-        color: #999;
-        font-size: 14px;
-        font-weight: 600;
-        text-transform: uppercase;
-        cursor: not-allowed;
-    }
-    
-    .connect-btn-active {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        cursor: pointer;
-    }
-    
-    .connect-btn-active:hover {
-        opacity: 0.9;
-    }
-    
-    /* Type Badge */
-    .type-badge {
-        position: absolute;
-        top: 24px;
-        right: 24px;
-        padding: 6px 12px;
-        border-radius: 20px;
-        font-size: 11px;
-        font-weight: 600;
-        text-transform: uppercase;
-    }
-    
-    .type-fixed {
-        background: #e3f2fd;
-        color: #1976d2;
-    }
-    
-    .type-variable {
-        background: #f3e5f5;
-        color: #7b1fa2;
-    }
-    
-    /* Modal Styles */
-    .modal-overlay {
-        position: fixed;
-        top: 0;
-        left: 0;
-        right: 0;
-        bottom: 0;
-        background: rgba(0,0,0,0.5);
-        z-index: 999;
-    }
-    
-    /* Streamlit overrides */
-    .stButton > button {
-        width: 100%;
-        border-radius: 8px;
-        padding: 12px 24px;
-        font-weight: 600;
-        transition: all 0.3s ease;
-    }
-    
-    /* Remove Streamlit branding */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    
-    /* Tab styling */
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 0px;
-        background: white;
-        border-radius: 12px;
-        padding: 4px;
-    }
-    
-    .stTabs [data-baseweb="tab"] {
-        background: transparent;
-        color: #666;
-        border-radius: 8px;
-        padding: 12px 24px;
-        font-weight: 600;
-    }
-    
-    .stTabs [aria-selected="true"] {
-        background: #1a1a1a;
-        color: white;
-    }
-    
-    /* Input styling */
-    .stNumberInput > div > div > input,
-    .stSelectbox > div > div {
-        background: #f8f9fa;
-        border: 1px solid #e0e0e0;
-        border-radius: 8px;
+
+def main():
+    # Custom CSS for SigmaFi-style design
+    with METRICS.span("css"):
+        st.markdown("""
+            <style>
+            /* Global Styles */
+            .stApp {
+                background: #e8eaed;
+            }
+
+            /* Remove default padding */
+            .main .block-container {
+                padding-top: 1rem;
+                padding-bottom: 2rem;
+                max-width: 1600px;
+            }
+
+            /* Header */
+            .top-header {
+                display: flex;
+                justify-content: space-between;
+                align-items: center;
+                padding: 20px 30px;
+                background: white;
+                border-radius: 12px;
+                margin-bottom: 20px;
+                box-shadow: 0 1px 3px rgba(0,0,0,0.1);
+            }
+
+            .logo-section {
+                display: flex;
+                align-items: center;
+                gap: 15px;
+                font-size: 24px;
+                font-weight: 700;
+                color: #1a1a1a;
+            }
+
+            .tvl-display {
+                color: #666;
+                font-size: 14px;
+            }
+
+            .tvl-value {
+                color: #1a1a1a;
+                font-weight: 600;
+                margin-left: 5px;
+            }
+
+            .market-stats {
+                display: flex;
+                gap: 30px;
+                flex-wrap: wrap;
+                padding: 0 30px;
+                margin: -10px 0 20px 0;
+                color: #666;
+                font-size: 14px;
+            }
+
+            /* Controls Bar */
+            .controls-bar {
+                background: white;
+                border-radius: 12px;
+                padding: 20px 30px;
+                margin-bottom: 20px;
+                display: flex;
+                justify-content: space-between;
+                align-items: center;
+                box-shadow: 0 1px 3px rgba(0,0,0,0.1);
+            }
+
+            /* Insurance Request Cards */
+            .card-grid {
+                display: grid;
+                grid-template-columns: repeat(4, minmax(0, 1fr));
+                gap: 16px;
+                margin-bottom: 16px;
+            }
+
+            .insurance-card {
+                background: white;
+                border-radius: 16px;
+                padding: 24px;
+                box-shadow: 0 2px 8px rgba(0,0,0,0.08);
+                transition: all 0.3s ease;
+                cursor: pointer;
+                height: 100%;
+                position: relative;
+            }
+
+            .insurance-card:hover {
+                box-shadow: 0 4px 16px rgba(0,0,0,0.12);
+                transform: translateY(-2px);
+            }
+
+            .card-header {
+                display: flex;
+                justify-content: space-between;
+                align-items: flex-start;
+                margin-bottom: 20px;
+            }
+
+            .card-title {
+                color: #999;
+                font-size: 14px;
+                margin-bottom: 8px;
+            }
+
+            .card-amount {
+                font-size: 28px;
+                font-weight: 700;
+                color: #1a1a1a;
+            }
+
+            .card-token {
+                font-size: 16px;
+                color: #666;
+                font-weight: 500;
+                margin-left: 8px;
+            }
+
+            .token-icon {
+                width: 48px;
+                height: 48px;
+                border-radius: 50%;
+                display: flex;
+                align-items: center;
+                justify-content: center;
+                font-size: 24px;
+                font-weight: 700;
+                color: white;
+            }
+
+            .icon-purple {
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            }
+
+            .icon-orange {
+                background: linear-gradient(135deg, #f2994a 0%, #f2c94c 100%);
+            }
+
+            .icon-blue {
+                background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
+            }
+
+            .icon-red {
+                background: linear-gradient(135deg, #fa709a 0%, #fee140 100%);
+            }
+
+            /* Collateral Section */
+            .collateral-section {
+                margin: 20px 0;
+                padding: 16px;
+                background: #f8f9fa;
+                border-radius: 12px;
+            }
+
+            .collateral-label {
+                color: #666;
+                font-size: 13px;
+                margin-bottom: 12px;
+            }
+
+            .collateral-badge {
+                display: inline-block;
+                padding: 6px 12px;
+                border-radius: 20px;
+                font-size: 12px;
+                font-weight: 600;
+                margin-bottom: 8px;
+            }
+
+            .badge-danger {
+                background: #fee;
+                color: #d32f2f;
+            }
+
+            .badge-warning {
+                background: #fff3e0;
+                color: #f57c00;
+            }
+
+            .badge-success {
+                background: #e8f5e9;
+                color: #388e3c;
+            }
+
+            .pool-info {
+                display: flex;
+                justify-content: space-between;
+                align-items: center;
+            }
+
+            .pool-amount {
+                font-size: 20px;
+                font-weight: 700;
+                color: #1a1a1a;
+            }
+
+            .pool-usd {
+                color: #999;
+                font-size: 12px;
+                margin-left: 5px;
+            }
+
+            /* Term and Interest */
+            .info-row {
+                display: flex;
+                justify-content: space-between;
+                margin: 16px 0;
+            }
+
+            .info-col {
+                flex: 1;
+            }
+
+            .info-label {
+                color: #666;
+                font-size: 13px;
+                margin-bottom: 4px;
+            }
+
+            .info-value {
+                color: #1a1a1a;
+                font-size: 20px;
+                font-weight: 700;
+            }
+
+            .info-subtext {
+                color: #999;
+                font-size: 12px;
+            }
+
+            /* Service Fee */
+            .service-fee {
+                text-align: center;
+                color: #999;
+                font-size: 12px;
+                margin: 16px 0;
+            }
+
+            /* Connect Button */
+            .connect-btn {
+                width: 100%;
+                padding: 14px;
+                background: #e0e0e0;
+                border: none;
+                border-radius: 8px;
+                color: #999;
+                font-size: 14px;
+                font-weight: 600;
+                text-transform: uppercase;
+                cursor: not-allowed;
+            }
+
+            .connect-btn-active {
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                color: white;
+                cursor: pointer;
+            }
+
+            .connect-btn-active:hover {
+                opacity: 0.9;
+            }
+
+            /* Type Badge */
+            .type-badge {
+                position: absolute;
+                top: 24px;
+                right: 24px;
+                padding: 6px 12px;
+                border-radius: 20px;
+                font-size: 11px;
+                font-weight: 600;
+                text-transform: uppercase;
+            }
+
+            .type-fixed {
+                background: #e3f2fd;
+                color: #1976d2;
+            }
+
+            .type-variable {
+                background: #f3e5f5;
+                color: #7b1fa2;
+            }
+
+            /* Modal Styles */
+            .modal-overlay {
+                position: fixed;
+                top: 0;
+                left: 0;
+                right: 0;
+                bottom: 0;
+                background: rgba(0,0,0,0.5);
+                z-index: 999;
+            }
+
+            /* Streamlit overrides */
+            .stButton > button {
+                width: 100%;
+                border-radius: 8px;
+                padding: 12px 24px;
+                font-weight: 600;
+                transition: all 0.3s ease;
+            }
+
+            /* Remove Streamlit branding */
+            #MainMenu {visibility: hidden;}
+            footer {visibility: hidden;}
+
+            /* Tab styling */
+            .stTabs [data-baseweb="tab-list"] {
+                gap: 0px;
+                background: white;
+                border-radius: 12px;
+                padding: 4px;
+            }
+
+            .stTabs [data-baseweb="tab"] {
+                background: transparent;
+                color: #666;
+                border-radius: 8px;
+                padding: 12px 24px;
+                font-weight: 600;
+            }
+
+            .stTabs [aria-selected="true"] {
+                background: #1a1a1a;
+                color: white;
+            }
+
+            /* Input styling */
+            .stNumberInput > div > div > input,
+            .stSelectbox > div > div {
+                background: #f8f9fa;
+                border: 1px solid #e0e0e0;
+                border-radius: 8px;
+            }
+
+            /* New Request Button */
+            .new-request-btn {
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
+                color: white !important;
+                border: none !important;
+                padding: 12px 32px !important;
+                border-radius: 8px !important;
+                font-weight: 600 !important;
+                float: right;
+            }
+            </style>
+            """, unsafe_allow_html=True)
+
+    # Initialize session state
+    if 'show_provide_modal' not in st.session_state:
+        st.session_state.show_provide_modal = False
+    if 'show_create_modal' not in st.session_state:
+        st.session_state.show_create_modal = False
+    if 'selected_request_id' not in st.session_state:
+        st.session_state.selected_request_id = None
+    if 'market_page' not in st.session_state:
+        st.session_state.market_page = 0
+    if 'show_optimize_modal' not in st.session_state:
+        st.session_state.show_optimize_modal = False
+    if 'insurer_id' not in st.session_state:
+        # No wallet yet, so each session stakes under its own insurer id
+        st.session_state.insurer_id = uuid.uuid4().hex[:12]
+    if 'portfolio_insurer' not in st.session_state:
+        st.session_state.portfolio_insurer = st.session_state.insurer_id
+    if 'portfolio_page' not in st.session_state:
+        st.session_state.portfolio_page = 0
+
+    CARDS_PER_PAGE = 12
+    POSITIONS_PER_PAGE = 50
+    # Payouts the sensitivity heatmap can show
+    SENSITIVITY_FIELDS = {
+        "Your payout if no claim": 'my_earnings_no_claim',
+        "Your loss if claim": 'my_loss_if_claim',
+        "Buyer payout if claim": 'buyer_payout_if_claim',
     }
-    
-    /* New Request Button */
-    .new-request-btn {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-        color: white !important;
-        border: none !important;
-        padding: 12px 32px !important;
-        border-radius: 8px !important;
-        font-weight: 600 !important;
-        float: right;
+    # The header and card grid poll the market this often and redraw only when it changed
+    MARKET_POLL_SECONDS = 2.0
+    SORT_OPTIONS = {
+        "Listing order": ("id", False),
+        "APR: high to low": ("apr", True),
+        "APR: low to high": ("apr", False),
+        "Payout ratio: high to low": ("ratio", True),
+        "Payout ratio: low to high": ("ratio", False),
+        "Term: shortest first": ("term_months", False),
+        "Term: longest first": ("term_months", True),
+        "Pool filled: most first": ("pool_filled", True),
+        "Pool filled: least first": ("pool_filled", False),
     }
-    </style>
-    """, unsafe_allow_html=True)
-
-# Initialize session state
-if 'show_provide_modal' not in st.session_state:
-    st.session_state.show_provide_modal = False
-if 'show_create_modal' not in st.session_state:
-    st.session_state.show_create_modal = False
-if 'selected_request' not in st.session_state:
-    st.session_state.selected_request = None
-if 'insurance_requests' not in st.session_state:
-    # Mock insurance requests
-    st.session_state.insurance_requests = [
+
+    # Mock insurance requests, used to seed an empty store
+    MOCK_INSURANCE_REQUESTS = [
         {
-            "id": 1,
             "amount": 750,
             "token": "SigUSD",
             "icon": "purple",
@@ -370,7 +442,6 @@ if 'insurance_requests' not in st.session_state:
             "borrower": "9iDf...9nhm"
         },
         {
-            "id": 2,
             "amount": 4000,
             "token": "ERG",
             "icon": "orange",
@@ -385,7 +456,6 @@ if 'insurance_requests' not in st.session_state:
             "borrower": "9evr...Pt5n"
         },
         {
-            "id": 3,
             "amount": 1000,
             "token": "SigUSD",
             "icon": "purple",
@@ -400,7 +470,6 @@ if 'insurance_requests' not in st.session_state:
             "borrower": "9fny...fZC1"
         },
         {
-            "id": 4,
             "amount": 150,
             "token": "ERG",
             "icon": "orange",
@@ -416,186 +485,400 @@ if 'insurance_requests' not in st.session_state:
         }
     ]
 
-def calculate_payouts(request, my_contribution):
-    """Calculate payouts based on insurance type"""
-    amount = request['amount']
-    ratio = request['ratio']
-    pool_size = request['pool_size']
-    ins_type = request['type']
-    
-    if ins_type == "fixed":
-        # Fixed: Winner takes all
-        if my_contribution >= pool_size:
-            my_share = 1.0
-        else:
-            my_share = my_contribution / pool_size
-        
-        # If no claim: insurers get all of insurance amount
-        my_earnings_no_claim = amount * my_share
-        # If claim: buyer gets all of pool (insurers lose)
-        my_loss_if_claim = my_contribution
-        
-        return {
-            'my_earnings_no_claim': my_earnings_no_claim,
-            'my_loss_if_claim': my_loss_if_claim,
-            'buyer_payout_if_claim': pool_size,
-            'pool_gets_no_claim': amount,
-            'my_share_pct': my_share * 100
-        }
-    else:
-        # Variable: Ratio-based with caps
-        insurer_max = pool_size * (1 / ratio)
-        buyer_max = amount * ratio
-        
-        insurer_payout = min(insurer_max, amount)
-        buyer_payout = min(buyer_max, pool_size)
-        
-        my_share = my_contribution / pool_size if pool_size > 0 else 0
-        my_earnings = my_share * insurer_payout
-        
-        return {
-            'my_earnings_no_claim': my_earnings,
-            'my_loss_if_claim': my_contribution - (my_contribution * (pool_size - buyer_payout) / pool_size if pool_size > 0 else 0),
-            'buyer_payout_if_claim': buyer_payout,
-            'pool_gets_no_claim': insurer_payout,
-            'my_share_pct': my_share * 100
-        }
+    @st.cache_resource
+    def get_market():
+        """Market (request store + indexes) shared by every session of this server"""
+        store = RequestStore()
+        store.seed(MOCK_INSURANCE_REQUESTS)
+        try:
+            journal = Journal(os.environ.get("SIGMASHIELD_JOURNAL") or store.path + ".journal")
+        except JournalInUseError:
+            # Another server process owns the journal; this one rebuilds from the store
+            journal = None
+        return Market(store, journal)
 
-# Header
-st.markdown("""
-    <div class="top-header">
-        <div class="logo-section">
-            <span style="font-size: 32px;">Σ</span>
-            <span>Insurance Market</span>
-            <span class="tvl-display">
-                TVL: <span class="tvl-value">$21,253.53</span>
-            </span>
-        </div>
-        <button class="connect-wallet-btn" style="padding: 10px 24px; background: #1a1a1a; color: white; border: none; border-radius: 8px; font-weight: 600; cursor: pointer;">
-            CONNECT WALLET
-        </button>
-    </div>
-    """, unsafe_allow_html=True)
-
-# Controls Bar
-col1, col2 = st.columns([3, 1])
-with col1:
-    tab1, tab2 = st.tabs(["Insurance requests", "Active Insurances"])
-with col2:
-    if st.button("+ NEW INSURANCE REQUEST", key="new_req_btn"):
-        st.session_state.show_create_modal = True
-        st.rerun()
-
-# Insurance Request Cards Grid
-if tab1:
-    # Add some spacing
-    st.markdown("<br>", unsafe_allow_html=True)
-    
-    cols = st.columns(4, gap="medium")
-    
-    for idx, request in enumerate(st.session_state.insurance_requests):
-        with cols[idx % 4]:
-            # Determine risk level based on pool fill
-            pool_fill_pct = request['pool_filled']
-            if pool_fill_pct < 50:
-                risk_color = "danger"
-                risk_text = f"△ -{100-pool_fill_pct}%"
-            elif pool_fill_pct < 80:
-                risk_color = "warning"
-                risk_text = f"△ -{100-pool_fill_pct}%"
+    @st.cache_resource
+    def get_matching_engine():
+        """Matching engine for stake orders, shared by every session"""
+        return MatchingEngine(get_market())
+
+    @st.cache_resource
+    def get_settlement_engine():
+        """Background settlement of matured contracts, once per server process"""
+        return SettlementEngine(get_market()).start()
+
+    @st.cache_resource
+    def get_quote_cache():
+        """Quote cache shared by every session of this server"""
+        return QuoteCache()
+
+    @st.cache_resource
+    def get_surface_cache():
+        """Payout sensitivity grids shared by every session, keyed by request version"""
+        return SurfaceCache()
+
+    @st.cache_resource
+    def get_price_oracle():
+        """USD price oracle shared by every session; the first refresh gets half a second"""
+        oracle = PriceOracle(price_source_from_env(), TOKENS)
+        oracle.refresh()
+        oracle.wait(timeout=0.5)
+        return oracle
+
+    @st.cache_data(show_spinner=False, max_entries=4)
+    def load_market_stats(version):
+        """Market aggregates, shared by all sessions until the market version changes"""
+        return get_market().stats_snapshot()
+
+    @st.cache_resource
+    def get_metrics_endpoint():
+        """Expose /metrics and /metrics.json on localhost once per server process"""
+        METRICS.add_collector(lambda: {
+            f"quote_cache_{name}": value for name, value in get_quote_cache().stats().items()
+        })
+        METRICS.add_collector(lambda: {"requests": get_market().count()})
+        METRICS.add_collector(lambda: {
+            f"prices_{name}": value for name, value in get_price_oracle().stats().items()
+        })
+        port = int(os.environ.get("SIGMASHIELD_METRICS_PORT", "9464"))
+        return start_metrics_server(port) if port else None
+
+    def reset_market_page():
+        st.session_state.market_page = 0
+
+    def reset_portfolio_page():
+        st.session_state.portfolio_page = 0
+
+    market = get_market()
+    matching_engine = get_matching_engine()
+    get_settlement_engine()
+    quote_cache = get_quote_cache()
+    surface_cache = get_surface_cache()
+    prices = get_price_oracle().prices()
+    get_metrics_endpoint()
+
+    # Header
+    def render_header(market_stats, prices):
+        tvl_usd, tvl_unpriced = usd_total(market_stats['tvl_by_token'], prices)
+        tvl_text = " + ".join(
+            [f"≈${tvl_usd:,.2f}"] + [f"{value:,.2f} {token}" for token, value in sorted(tvl_unpriced.items())]
+        )
+        pool_text = " · ".join(
+            f"{value:,.2f} {token}" for token, value in sorted(market_stats['pool_by_token'].items())
+        ) or "0"
+        apr_text = " · ".join(
+            f"{ins_type.capitalize()} {apr:.2f}%" for ins_type, apr in sorted(market_stats['avg_apr_by_type'].items())
+        ) or "—"
+        return f"""
+            <div class="top-header">
+                <div class="logo-section">
+                    <span style="font-size: 32px;">Σ</span>
+                    <span>Insurance Market</span>
+                    <span class="tvl-display">
+                        TVL: <span class="tvl-value">{tvl_text}</span>
+                    </span>
+                </div>
+                <button class="connect-wallet-btn" style="padding: 10px 24px; background: #1a1a1a; color: white; border: none; border-radius: 8px; font-weight: 600; cursor: pointer;">
+                    CONNECT WALLET
+                </button>
+            </div>
+            <div class="market-stats">
+                <span>Open requests: <span class="tvl-value">{market_stats['open_count']:,}</span></span>
+                <span>Pool capital: <span class="tvl-value">{pool_text}</span></span>
+                <span>Avg APR: <span class="tvl-value">{apr_text}</span></span>
+            </div>
+            """
+
+    @st.cache_resource(max_entries=8, show_spinner=False)
+    def shared_header_html(market_version, price_items):
+        """Header HTML built once per market version and price set, shared by every session"""
+        with METRICS.span("header"):
+            header_html = render_header(load_market_stats(market_version), dict(price_items))
+        return header_html
+
+    @st.fragment(run_every=MARKET_POLL_SECONDS)
+    def market_header():
+        """Redrawn only when the market version or a price moved"""
+        prices = get_price_oracle().prices()
+        st.markdown(shared_header_html(market.poll(), tuple(sorted(prices.items()))), unsafe_allow_html=True)
+
+    market_header()
+
+    # Controls Bar
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        # Rerun on switch so only the open tab is built (tab key/on_change/.open need Streamlit 1.55)
+        tab1, tab2 = st.tabs(["Insurance requests", "Active Insurances"], key="market_tab", on_change="rerun")
+    with col2:
+        if st.button("+ NEW INSURANCE REQUEST", key="new_req_btn"):
+            st.session_state.show_create_modal = True
+            st.rerun()
+        if st.button("⚙ OPTIMIZE MY STAKE", key="optimize_btn"):
+            st.session_state.show_optimize_modal = True
+            st.rerun()
+
+    # Insurance Request Cards Grid
+    @st.fragment(run_every=MARKET_POLL_SECONDS)
+    def market_grid():
+        """Card grid that polls the change feed and redraws only when its page changed"""
+        with METRICS.span("card_grid"):
+            # Add some spacing
+            st.markdown("<br>", unsafe_allow_html=True)
+
+            # Search, sort and filter controls; a search lists its matches by address, then token
+            col_search, col_sort, col_token, col_type = st.columns([2, 2, 1, 1])
+            with col_search:
+                search = st.text_input(
+                    "Search", key="market_search", placeholder="Address or token prefix", on_change=reset_market_page
+                ).strip()
+            with col_sort:
+                sort_label = st.selectbox("Sort by", list(SORT_OPTIONS), key="market_sort", on_change=reset_market_page, disabled=bool(search))
+            with col_token:
+                token_filter = st.selectbox("Token", ["All tokens"] + TOKENS, key="market_token", on_change=reset_market_page, disabled=bool(search))
+            with col_type:
+                type_filter = st.selectbox("Type", ["All types"] + TYPES, key="market_type", on_change=reset_market_page, disabled=bool(search))
+            sort_key, descending = SORT_OPTIONS[sort_label]
+            token_filter = None if token_filter == "All tokens" else token_filter
+            type_filter = None if type_filter == "All types" else type_filter
+
+            market.poll()
+            prices = get_price_oracle().prices()
+            view = (sort_label, token_filter, type_filter, st.session_state.market_page, tuple(sorted(prices.items())), search)
+            grid = st.session_state.get('market_grid')
+            if grid is not None and grid['view'] == view:
+                _, changed = market.feed.changes_since(grid['version'])
             else:
-                risk_color = "success"
-                risk_text = f"△ -{100-pool_fill_pct}%"
-            
-            # Create card using container
-            with st.container():
-                # Card wrapper
-                st.markdown(f"""
-                    <div class="insurance-card">
-                        <div class="type-badge type-{request['type']}">{request['type'].upper()}</div>
-                        <div class="card-header">
-                            <div>
-                                <div class="card-title">Insurance request</div>
-                                <div>
-                                    <span class="card-amount">{request['amount']:,}</span>
-                                    <span class="card-token">{request['token']}</span>
-                                </div>
-                            </div>
-                            <div class="token-icon icon-{request['icon']}">
-                                "Σ"
-                            </div>
-                        </div>
-                        <div class="collateral-section">
-                            <div class="collateral-label">Pool Status</div>
-                            <div class="collateral-badge badge-{risk_color}">{risk_text}</div>
-                            <div class="pool-info">
-                                <div>
-                                    <span class="pool-amount">{request['pool_size']:,}</span>
-                                    <span class="pool-usd">≈0 USD</span>
-                                </div>
-                            </div>
-                        </div>
-                        <div class="info-row">
-                            <div class="info-col">
-                                <div class="info-label">Term</div>
-                                <div class="info-value">{request['term_months']} months</div>
-                            </div>
-                        </div>
-                        <div class="info-row">
-                            <div class="info-col">
-                                <div class="info-label">Payout Ratio</div>
-                                <div class="info-value">{request['ratio']:.1f}:1</div>
-                                <div class="info-subtext">{request['apr']:.2f}% APR</div>
-                            </div>
-                            <div class="info-col" style="text-align: right;">
-                                <div class="info-label">Requester</div>
-                                <div class="info-value" style="font-size: 14px;">{request['borrower']}</div>
-                            </div>
-                        </div>
-                        <div class="service-fee">Service Fee: {request['service_fee']} {request['token']}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                # Button below card
-                if st.button(f"📋 View Details", key=f"view_{request['id']}", use_container_width=True):
-                    st.session_state.selected_request = request
-                    st.session_state.show_provide_modal = True
+                changed = None
+            if changed is None or changed:
+                with market.lock:
+                    market_version = market.feed.version
+                    total_requests = market.search_count(search) if search else market.count(token_filter, type_filter)
+                    page_count = max(1, -(-total_requests // CARDS_PER_PAGE))
+                    if st.session_state.market_page >= page_count:
+                        st.session_state.market_page = page_count - 1
+                        view = view[:3] + (st.session_state.market_page,) + view[4:]
+
+                    # Only the visible page is fetched; cards whose version did not move come from the card cache
+                    offset = st.session_state.market_page * CARDS_PER_PAGE
+                    if search:
+                        page_requests = market.search(search, offset, CARDS_PER_PAGE)
+                    else:
+                        page_requests = market.page(sort_key, descending, token_filter, type_filter, offset, CARDS_PER_PAGE)
+                    page_ids = [request['id'] for request in page_requests]
+                    if changed is None or page_ids != grid['ids'] or not changed.isdisjoint(page_ids):
+                        html = render_card_page(page_requests, prices)
+                        METRICS.inc("cards_rendered", len(page_requests))
+                    else:
+                        html = grid['html']
+                    buttons = [(request['id'], f"📋 #{request['id']} · {format_amount(request['amount'])} {request['token']}") for request in page_requests]
+                grid = st.session_state.market_grid = {
+                    "view": view, "version": market_version, "ids": page_ids, "html": html, "buttons": buttons,
+                    "total": total_requests, "page_count": page_count,
+                }
+            total_requests, page_count = grid['total'], grid['page_count']
+            st.markdown(grid['html'], unsafe_allow_html=True)
+
+            # One details button per visible card, in the same order as the grid
+            cols = st.columns(4, gap="medium")
+            for idx, (request_id, label) in enumerate(grid['buttons']):
+                with cols[idx % 4]:
+                    if st.button(label, key=f"view_{request_id}", use_container_width=True):
+                        st.session_state.selected_request_id = request_id
+                        st.session_state.show_provide_modal = True
+                        st.rerun()
+
+            # Pagination
+            col_prev, col_page, col_next = st.columns([1, 2, 1])
+            with col_prev:
+                if st.button("← Previous", key="page_prev", disabled=st.session_state.market_page == 0, use_container_width=True):
+                    st.session_state.market_page -= 1
+                    st.rerun()
+            with col_page:
+                st.markdown(
+                    f"<div style='text-align: center; color: #666; padding-top: 10px;'>Page {st.session_state.market_page + 1} of {page_count} · {total_requests:,} requests</div>",
+                    unsafe_allow_html=True
+                )
+            with col_next:
+                if st.button("Next →", key="page_next", disabled=st.session_state.market_page >= page_count - 1, use_container_width=True):
+                    st.session_state.market_page += 1
                     st.rerun()
 
-# Provide Coverage Modal
-if st.session_state.show_provide_modal and st.session_state.selected_request:
-    request = st.session_state.selected_request
-    
-    @st.dialog("Provide Coverage", width="large")
-    def provide_coverage_modal():
-        st.markdown(f"### Insurance Request: {request['amount']:,} {request['token']}")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown("#### Request Details")
-            st.write(f"**Amount:** {request['amount']:,} {request['token']}")
-            st.write(f"**Type:** {request['type'].capitalize()}")
-            st.write(f"**Payout Ratio:** {request['ratio']:.1f}:1")
-            st.write(f"**Term:** {request['term_months']} months")
-            st.write(f"**Current Pool:** {request['pool_size']:,} {request['token']}")
-            st.write(f"**Pool Filled:** {request['pool_filled']}%")
-            
-            st.markdown("---")
-            
-            if request['type'] == 'fixed':
-                st.info("🎲 **FIXED Insurance** - Winner takes all! Like a bet.")
-                st.write("- If NO CLAIM: Pool gets ALL insurance amount")
-                st.write("- If CLAIM: Buyer gets ALL pool funds")
+    # Active Insurances: one insurer's open positions
+    @st.fragment(run_every=MARKET_POLL_SECONDS)
+    def portfolio_view():
+        """Totals come from the market's running aggregates; only the visible page of positions is read"""
+        with METRICS.span("portfolio"):
+            st.markdown("<br>", unsafe_allow_html=True)
+            insurer = st.text_input("Insurer", key="portfolio_insurer", on_change=reset_portfolio_page).strip()
+            market.poll()
+            prices = get_price_oracle().prices()
+            totals, position_count, positions = market.portfolio(
+                insurer, st.session_state.portfolio_page * POSITIONS_PER_PAGE, POSITIONS_PER_PAGE
+            )
+            page_count = max(1, -(-position_count // POSITIONS_PER_PAGE))
+            if st.session_state.portfolio_page >= page_count:
+                st.session_state.portfolio_page = page_count - 1
+                totals, position_count, positions = market.portfolio(
+                    insurer, st.session_state.portfolio_page * POSITIONS_PER_PAGE, POSITIONS_PER_PAGE
+                )
+            if not position_count:
+                st.info("No open positions. Provide coverage to a request and it shows up here until the contract settles.")
+                return
+
+            # Per token in token units; per type in USD, since a type spans several tokens
+            by_token, by_type = {}, {}
+            for (token, ins_type), cell in totals.items():
+                token_row = by_token.setdefault(token, dict.fromkeys(cell, 0))
+                type_row = by_type.setdefault(ins_type, {"positions": 0, "stake": {}, "worst_loss": {}, "best_earnings": {}})
+                for field, value in cell.items():
+                    token_row[field] += value
+                    if field == "positions":
+                        type_row[field] += value
+                    else:
+                        type_row[field][token] = value
+            usd = {
+                field: usd_total({token: row[field] for token, row in by_token.items()}, prices)[0]
+                for field in ("stake", "worst_loss", "best_earnings")
+            }
+            col_a, col_b, col_c, col_d = st.columns(4)
+            col_a.metric("Open positions", f"{position_count:,}")
+            col_b.metric("Staked", f"${usd['stake']:,.2f}")
+            col_c.metric("Worst-case loss", f"${usd['worst_loss']:,.2f}")
+            col_d.metric("Best-case earnings", f"${usd['best_earnings']:,.2f}")
+
+            col_token, col_type = st.columns(2)
+            with col_token:
+                st.markdown("**By token**")
+                st.dataframe(
+                    {
+                        "Token": list(by_token),
+                        "Positions": [row["positions"] for row in by_token.values()],
+                        "Stake": [round(row["stake"], 2) for row in by_token.values()],
+                        "Worst-case loss": [round(row["worst_loss"], 2) for row in by_token.values()],
+                        "Best-case earnings": [round(row["best_earnings"], 2) for row in by_token.values()],
+                    },
+                    hide_index=True,
+                    use_container_width=True,
+                )
+            with col_type:
+                st.markdown("**By type (USD)**")
+                st.dataframe(
+                    {
+                        "Type": [ins_type.capitalize() for ins_type in by_type],
+                        "Positions": [row["positions"] for row in by_type.values()],
+                        "Stake": [round(usd_total(row["stake"], prices)[0], 2) for row in by_type.values()],
+                        "Worst-case loss": [round(usd_total(row["worst_loss"], prices)[0], 2) for row in by_type.values()],
+                        "Best-case earnings": [round(usd_total(row["best_earnings"], prices)[0], 2) for row in by_type.values()],
+                    },
+                    hide_index=True,
+                    use_container_width=True,
+                )
+
+            st.markdown("**Positions**")
+            st.dataframe(
+                {
+                    "Request": [f"#{position['request_id']}" for position in positions],
+                    "Token": [position['token'] for position in positions],
+                    "Type": [position['type'].capitalize() for position in positions],
+                    "Stake": [round(position['stake'], 2) for position in positions],
+                    "Pool share (%)": [round(position['share_pct'], 2) for position in positions],
+                    "Worst-case loss": [round(position['worst_loss'], 2) for position in positions],
+                    "Best-case earnings": [round(position['best_earnings'], 2) for position in positions],
+                },
+                hide_index=True,
+                use_container_width=True,
+            )
+            col_prev, col_page, col_next = st.columns([1, 2, 1])
+            with col_prev:
+                if st.button("← Previous", key="portfolio_prev", disabled=st.session_state.portfolio_page == 0, use_container_width=True):
+                    st.session_state.portfolio_page -= 1
+                    st.rerun()
+            with col_page:
+                st.markdown(
+                    f"<div style='text-align: center; color: #666; padding-top: 10px;'>Page {st.session_state.portfolio_page + 1} of {page_count} · {position_count:,} positions</div>",
+                    unsafe_allow_html=True,
+                )
+            with col_next:
+                if st.button("Next →", key="portfolio_next", disabled=st.session_state.portfolio_page >= page_count - 1, use_container_width=True):
+                    st.session_state.portfolio_page += 1
+                    st.rerun()
+
+    if tab1.open:
+        market_grid()
+    elif tab2.open:
+        portfolio_view()
+
+    # Provide Coverage Modal
+    # The dialog keeps only the id and resolves the live request on every rerun
+    selected_request = None
+    if st.session_state.show_provide_modal and st.session_state.selected_request_id is not None:
+        selected_request = market.get_request(st.session_state.selected_request_id)
+        if selected_request is None:
+            st.session_state.show_provide_modal = False
+
+    if selected_request is not None:
+        request = selected_request
+
+        def payout_heatmap(request, max_contribution, my_contribution):
+            """Heatmap of one payout over pool size and ratio (or stake, for fixed requests)"""
+            surface = surface_cache.surface(request, max_contribution)
+            label = st.selectbox("Show", list(SENSITIVITY_FIELDS), key="sensitivity_field")
+            field = SENSITIVITY_FIELDS[label]
+            with METRICS.span("sensitivity_grid"):
+                if surface.fixed:
+                    # The ratio does not matter for a bet, so sweep the stake instead
+                    values = surface.cube()[field][0]
+                    x_title, x_values, x_now = "Stake", surface.stakes, my_contribution
+                else:
+                    values = surface.stake_slice(surface.stake_index(my_contribution))[field].T
+                    x_title, x_values, x_now = "Ratio", surface.ratios, request['ratio']
+                x_edges = np.r_[x_values, x_values[-1] + (x_values[-1] - x_values[-2] if len(x_values) > 1 else 1.0)]
+                y_edges = np.r_[surface.pool_sizes, 2 * surface.pool_sizes[-1] - surface.pool_sizes[-2]]
+                x0, y0 = np.meshgrid(x_edges[:-1], y_edges[:-1])
+                x1, y1 = np.meshgrid(x_edges[1:], y_edges[1:])
+                cells = pd.DataFrame({
+                    "x": x0.ravel(), "x2": x1.ravel(), "y": y0.ravel(), "y2": y1.ravel(), "value": values.ravel(),
+                })
+            # A plain Vega-Lite spec: building it through Altair costs more than the grid itself
+            spec = {"layer": [
+                {
+                    "mark": "rect",
+                    "encoding": {
+                        "x": {"field": "x", "type": "quantitative", "title": x_title},
+                        "x2": {"field": "x2"},
+                        "y": {"field": "y", "type": "quantitative", "title": f"Pool size ({request['token']})"},
+                        "y2": {"field": "y2"},
+                        "color": {"field": "value", "type": "quantitative", "title": request['token'],
+                                  "scale": {"scheme": "viridis"}},
+                    },
+                },
+                {
+                    "data": {"values": [{"x": float(x_now), "y": float(request['pool_size'])}]},
+                    "mark": {"type": "point", "filled": True, "color": "red", "size": 120},
+                    "encoding": {"x": {"field": "x", "type": "quantitative"}, "y": {"field": "y", "type": "quantitative"}},
+                },
+            ]}
+            st.vega_lite_chart(cells, spec, use_container_width=True)
+            if surface.fixed:
+                st.caption(f"{label} by stake and pool size. The red dot is your stake on this pool.")
             else:
-                st.info("⚖️ **VARIABLE Insurance** - Ratio-based protection")
-                st.write(f"- Payout capped by pool size and ratio")
-                st.write(f"- Your earnings proportional to stake")
-        
-        with col2:
+                grid_stake = surface.stakes[surface.stake_index(my_contribution)]
+                st.caption(
+                    f"{label} at a stake of {format_amount(grid_stake)} {request['token']}. "
+                    "The red dot is this request's current ratio and pool."
+                )
+
+        # Stake changes rerun only this panel, not the dialog or the page
+        @st.fragment
+        def coverage_quote_panel(request_id):
+            request = market.get_request(request_id)
+            if request is None or request['settled_at']:
+                st.warning("This request is no longer available.")
+                return
+
             st.markdown("#### Your Contribution")
-            
-            max_contribution = request['amount'] * 2  # Allow overbidding
+
+            max_contribution = int(request['amount'] * 2)  # Allow overbidding
             my_contribution = st.number_input(
                 f"Your Stake ({request['token']})",
                 min_value=10,
@@ -603,28 +886,33 @@ if st.session_state.show_provide_modal and st.session_state.selected_request:
                 value=min(500, max_contribution),
                 step=10
             )
-            
-            # Calculate payouts
-            payouts = calculate_payouts(request, my_contribution)
-            
+
+            # Calculate payouts (memoized across sessions)
+            with METRICS.span("calculate_payouts"):
+                payouts = quote_cache.quote(request, my_contribution)
+            METRICS.inc("quotes")
+
             st.markdown("---")
             st.markdown("#### Your Potential Outcomes")
-            
+
             # Your share
             st.metric("Your Pool Share", f"{payouts['my_share_pct']:.2f}%")
-            
+
             # No claim scenario
             st.success(f"**If NO CLAIM:** You earn {payouts['my_earnings_no_claim']:.2f} {request['token']}")
             roi_no_claim = ((payouts['my_earnings_no_claim'] - my_contribution) / my_contribution * 100)
             st.write(f"ROI: {roi_no_claim:+.2f}%")
-            
+
             # Claim scenario
             st.error(f"**If CLAIM:** You lose {payouts['my_loss_if_claim']:.2f} {request['token']}")
             roi_claim = -((payouts['my_loss_if_claim'] / my_contribution * 100))
             st.write(f"ROI: {roi_claim:.2f}%")
-            
+
+            with st.expander("📈 Payout sensitivity"):
+                payout_heatmap(request, max_contribution, my_contribution)
+
             st.markdown("---")
-            
+
             col_a, col_b = st.columns(2)
             with col_a:
                 if st.button("Cancel", use_container_width=True):
@@ -632,131 +920,243 @@ if st.session_state.show_provide_modal and st.session_state.selected_request:
                     st.rerun()
             with col_b:
                 if st.button("✓ Provide Coverage", type="primary", use_container_width=True):
-                    st.success(f"Coverage provided: {my_contribution} {request['token']}!")
-                    st.session_state.show_provide_modal = False
+                    order = StakeOrder(st.session_state.insurer_id, my_contribution, request_id=request['id'])
+                    fills = matching_engine.place(order)
+                    if not fills:
+                        st.warning("This pool is already full; nothing was staked.")
+                    else:
+                        st.success(f"Coverage provided: {format_amount(order.filled)} {request['token']}!")
+                        st.session_state.show_provide_modal = False
+                        st.balloons()
+                        st.rerun()
+
+        @st.dialog("Provide Coverage", width="large")
+        def provide_coverage_modal():
+            st.markdown(f"### Insurance Request: {format_amount(request['amount'])} {request['token']}")
+
+            col1, col2 = st.columns(2)
+
+            with col1:
+                st.markdown("#### Request Details")
+                st.write(f"**Amount:** {format_amount(request['amount'])} {request['token']}")
+                st.write(f"**Type:** {request['type'].capitalize()}")
+                st.write(f"**Payout Ratio:** {request['ratio']:.1f}:1")
+                st.write(f"**Term:** {request['term_months']} months")
+                st.write(f"**Current Pool:** {format_amount(request['pool_size'])} {request['token']}")
+                st.write(f"**Pool Filled:** {request['pool_filled']}%")
+
+                st.markdown("---")
+
+                if request['type'] == 'fixed':
+                    st.info("🎲 **FIXED Insurance** - Winner takes all! Like a bet.")
+                    st.write("- If NO CLAIM: Pool gets ALL insurance amount")
+                    st.write("- If CLAIM: Buyer gets ALL pool funds")
+                else:
+                    st.info("⚖️ **VARIABLE Insurance** - Ratio-based protection")
+                    st.write(f"- Payout capped by pool size and ratio")
+                    st.write(f"- Your earnings proportional to stake")
+
+            with col2:
+                coverage_quote_panel(request['id'])
+
+        with METRICS.span("provide_modal"):
+            provide_coverage_modal()
+
+    # Create New Request Modal
+    if st.session_state.show_create_modal:
+        @st.dialog("Create New Insurance Request", width="large")
+        def create_request_modal():
+            st.markdown("### New Insurance Request")
+
+            col1, col2 = st.columns(2)
+
+            with col1:
+                st.markdown("#### Insurance Details")
+
+                insurance_amount = st.number_input(
+                    "Insurance Amount",
+                    min_value=MIN_AMOUNT,
+                    max_value=MAX_AMOUNT,
+                    value=1000,
+                    step=100,
+                    help="Amount you want to insure"
+                )
+
+                token_choice = st.selectbox(
+                    "Token",
+                    TOKENS,
+                    help="Choose your insurance token"
+                )
+
+                insurance_type = st.selectbox(
+                    "Insurance Type",
+                    TYPES,
+                    help="Variable: ratio-based | Fixed: winner takes all"
+                )
+
+                if insurance_type == "variable":
+                    insurance_ratio = st.slider(
+                        "Payout Ratio",
+                        min_value=MIN_RATIO,
+                        max_value=MAX_RATIO,
+                        value=2.0,
+                        step=0.1,
+                        help="Higher ratio = higher risk/reward"
+                    )
+                    st.caption(f"Ratio: {insurance_ratio:.1f}:1")
+                else:
+                    insurance_ratio = FIXED_RATIO
+                    st.info("🎲 Fixed insurance - Winner takes all!")
+
+                term_months = st.number_input(
+                    "Term (months)",
+                    min_value=MIN_TERM_MONTHS,
+                    max_value=MAX_TERM_MONTHS,
+                    value=12,
+                    step=1
+                )
+
+            with col2:
+                st.markdown("#### Preview")
+
+                st.write(f"**Amount:** {insurance_amount:,} {token_choice}")
+                st.write(f"**Type:** {insurance_type.capitalize()}")
+                st.write(f"**Ratio:** {insurance_ratio:.1f}:1")
+                st.write(f"**Term:** {term_months} months")
+
+                st.markdown("---")
+
+                if insurance_type == "fixed":
+                    st.info("**FIXED Insurance (Bet)**")
+                    st.write(f"- If claim: You win the entire pool")
+                    st.write(f"- If no claim: Pool wins your {insurance_amount:,} {token_choice}")
+                else:
+                    st.info("**VARIABLE Insurance (Protected)**")
+                    estimated_pool = insurance_amount * insurance_ratio
+                    max_payout = min(insurance_amount * insurance_ratio, estimated_pool)
+                    st.write(f"- Estimated pool needed: {estimated_pool:,} {token_choice}")
+                    st.write(f"- Your max payout: {max_payout:,} {token_choice}")
+                    st.write(f"- Ratio protection: {insurance_ratio:.1f}:1")
+
+                st.markdown("---")
+
+                service_fee = service_fee_for(insurance_amount, token_choice)
+                st.write(f"**Service Fee:** {service_fee:.2f} {token_choice}")
+
+            st.markdown("---")
+
+            col_a, col_b = st.columns(2)
+            with col_a:
+                if st.button("Cancel", use_container_width=True):
+                    st.session_state.show_create_modal = False
+                    st.rerun()
+            with col_b:
+                if st.button("✓ Create Request", type="primary", use_container_width=True):
+                    # Persist new request to the shared store
+                    new_request = {
+                        "amount": insurance_amount,
+                        "token": token_choice,
+                        "icon": random.choice(ICONS),
+                        "ratio": insurance_ratio,
+                        "type": insurance_type,
+                        "pool_size": 0,
+                        "pool_filled": 0,
+                        "term_months": term_months,
+                        "interest_rate": int(insurance_ratio * INTEREST_RATE_PER_RATIO),
+                        "apr": insurance_ratio * APR_PER_RATIO,
+                        "service_fee": service_fee,
+                        "borrower": "You"
+                    }
+                    market.create_request(new_request)
+                    st.success(f"Insurance request created: {insurance_amount} {token_choice}!")
+                    st.session_state.show_create_modal = False
                     st.balloons()
                     st.rerun()
-    
-    provide_coverage_modal()
-
-# Create New Request Modal
-if st.session_state.show_create_modal:
-    @st.dialog("Create New Insurance Request", width="large")
-    def create_request_modal():
-        st.markdown("### New Insurance Request")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown("#### Insurance Details")
-            
-            insurance_amount = st.number_input(
-                "Insurance Amount",
-                min_value=100,
-                max_value=100000,
-                value=1000,
-                step=100,
-                help="Amount you want to insure"
-            )
-            
-            token_choice = st.selectbox(
-                "Token",
-                ["SigUSD", "ERG", "AHT", "Other"],
-                help="Choose your insurance token"
-            )
-            
-            insurance_type = st.selectbox(
-                "Insurance Type",
-                ["variable", "fixed"],
-                help="Variable: ratio-based | Fixed: winner takes all"
-            )
-            
-            if insurance_type == "variable":
-                insurance_ratio = st.slider(
-                    "Payout Ratio",
+
+        with METRICS.span("create_modal"):
+            create_request_modal()
+
+    # Optimize My Stake Modal
+    if st.session_state.show_optimize_modal:
+        @st.dialog("Optimize My Stake", width="large")
+        def optimize_stake_modal():
+            st.markdown("### Spread a budget across the open book")
+
+            col1, col2 = st.columns(2)
+
+            with col1:
+                budget = st.number_input("Budget (USD)", min_value=10, max_value=10_000_000, value=5_000, step=100)
+                claim_pct = st.slider(
+                    "Claim probability (%)",
                     min_value=0.0,
-                    max_value=5.0,
-                    value=2.0,
-                    step=0.1,
-                    help="Higher ratio = higher risk/reward"
+                    max_value=100.0,
+                    value=5.0,
+                    step=0.5,
+                    help="Your estimate of how likely each request is to pay out"
                 )
-                st.caption(f"Ratio: {insurance_ratio:.1f}:1")
-            else:
-                insurance_ratio = 1.0
-                st.info("🎲 Fixed insurance - Winner takes all!")
-            
-            term_months = st.number_input(
-                "Term (months)",
-                min_value=1,
-                max_value=36,
-                value=12,
-                step=1
-            )
-        
-        with col2:
-            st.markdown("#### Preview")
-            
-            st.write(f"**Amount:** {insurance_amount:,} {token_choice}")
-            st.write(f"**Type:** {insurance_type.capitalize()}")
-            st.write(f"**Ratio:** {insurance_ratio:.1f}:1")
-            st.write(f"**Term:** {term_months} months")
-            
+
+            with col2:
+                max_per_request = st.number_input("Max per request (USD)", min_value=10, max_value=10_000_000, value=1_000, step=100)
+                max_per_token = st.number_input("Max per token (USD)", min_value=10, max_value=10_000_000, value=5_000, step=100)
+
+            with METRICS.span("optimize_stake"):
+                allocation = market.optimize(budget, claim_pct / 100, prices, max_per_request, max_per_token)
+
             st.markdown("---")
-            
-            if insurance_type == "fixed":
-                st.info("**FIXED Insurance (Bet)**")
-                st.write(f"- If claim: You win the entire pool")
-                st.write(f"- If no claim: Pool wins your {insurance_amount:,} {token_choice}")
+
+            if not len(allocation):
+                st.info("No open request has a positive expected return under these limits.")
             else:
-                st.info("**VARIABLE Insurance (Protected)**")
-                estimated_pool = insurance_amount * insurance_ratio
-                max_payout = min(insurance_amount * insurance_ratio, estimated_pool)
-                st.write(f"- Estimated pool needed: {estimated_pool:,} {token_choice}")
-                st.write(f"- Your max payout: {max_payout:,} {token_choice}")
-                st.write(f"- Ratio protection: {insurance_ratio:.1f}:1")
-            
+                col_a, col_b, col_c = st.columns(3)
+                col_a.metric("Staked", f"${allocation.total_usd:,.2f}")
+                col_b.metric("Expected return", f"${allocation.total_expected_return_usd:,.2f}")
+                col_c.metric("Requests", f"{len(allocation):,}")
+
+                st.dataframe(
+                    {
+                        "Request": [f"#{request_id}" for request_id in allocation.request_ids],
+                        "Token": allocation.tokens,
+                        "Stake": allocation.stakes.round(2),
+                        "Stake (USD)": allocation.stakes_usd.round(2),
+                        "Expected return (USD)": allocation.expected_return_usd.round(2),
+                    },
+                    hide_index=True,
+                    use_container_width=True,
+                )
+
             st.markdown("---")
-            
-            service_fee = insurance_amount * 0.01  # 1% fee
-            st.write(f"**Service Fee:** {service_fee:.2f} {token_choice}")
-        
-        st.markdown("---")
-        
-        col_a, col_b = st.columns(2)
-        with col_a:
-            if st.button("Cancel", use_container_width=True):
-                st.session_state.show_create_modal = False
-                st.rerun()
-        with col_b:
-            if st.button("✓ Create Request", type="primary", use_container_width=True):
-                # Add new request to list
-                new_request = {
-                    "id": len(st.session_state.insurance_requests) + 1,
-                    "amount": insurance_amount,
-                    "token": token_choice,
-                    "icon": random.choice(["purple", "orange", "blue", "red"]),
-                    "ratio": insurance_ratio,
-                    "type": insurance_type,
-                    "pool_size": 0,
-                    "pool_filled": 0,
-                    "term_months": term_months,
-                    "interest_rate": int(insurance_ratio * 20),
-                    "apr": insurance_ratio * 15,
-                    "service_fee": service_fee,
-                    "borrower": "You"
-                }
-                st.session_state.insurance_requests.append(new_request)
-                st.success(f"Insurance request created: {insurance_amount} {token_choice}!")
-                st.session_state.show_create_modal = False
-                st.balloons()
-                st.rerun()
-    
-    create_request_modal()
-
-# Footer
-st.markdown("<br>", unsafe_allow_html=True)
-st.markdown("""
-    <div style="text-align: center; color: #999; font-size: 12px; padding: 20px;">
-        SigmaShield Protocol • Decentralized Insurance
-    </div>
-    """, unsafe_allow_html=True)
\ No newline at end of file
+
+            col_a, col_b = st.columns(2)
+            with col_a:
+                if st.button("Cancel", use_container_width=True):
+                    st.session_state.show_optimize_modal = False
+                    st.rerun()
+            with col_b:
+                if st.button("✓ Provide Coverage", type="primary", use_container_width=True, disabled=not len(allocation)):
+                    futures = [
+                        matching_engine.submit(StakeOrder(st.session_state.insurer_id, round(stake, 2), request_id=request_id))
+                        for request_id, stake in zip(allocation.request_ids.tolist(), allocation.stakes.tolist())
+                        if round(stake, 2) > 0
+                    ]
+                    filled = sum(1 for future in futures if future.result())
+                    st.success(f"Coverage provided to {filled:,} requests!")
+                    st.session_state.show_optimize_modal = False
+                    st.balloons()
+                    st.rerun()
+
+        with METRICS.span("optimize_modal"):
+            optimize_stake_modal()
+
+    # Footer
+    st.markdown("<br>", unsafe_allow_html=True)
+    st.markdown("""
+        <div style="text-align: center; color: #999; font-size: 12px; padding: 20px;">
+            SigmaShield Protocol • Decentralized Insurance
+        </div>
+        """, unsafe_allow_html=True)
+
+
+METRICS.inc("reruns")
+# The span ends even when st.rerun(), st.stop() or an error cuts the run short
+with METRICS.span("rerun"):
+    main()
@@ -0,0 +1,254 @@
+"""Append-only market event log with catalog snapshots for fast restarts
+
+Every write the Market mirrors in memory is also appended to the log as one
+JSON line `[version, kind, payload]`. Lines are buffered and a flusher
+thread writes and fsyncs them together. After every `snapshot_every_rows`
+changed rows the catalog columns are saved to an .npz snapshot and a new log
+segment is started, so a restart loads the newest snapshot and replays only
+the events after it: recovery time depends on the snapshot interval, not on
+how much history there is. Old segments and snapshots are deleted once a
+newer snapshot is safely on disk.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from catalog import CATEGORY_COLUMNS, NUMERIC_COLUMNS, RequestCatalog
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock on the journal directory
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.05
+SNAPSHOT_EVERY_ROWS = 100_000
+KEEP_SNAPSHOTS = 2
+
+
+class JournalInUseError(RuntimeError):
+    """Another process already writes to this journal directory"""
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot log {type(value).__name__}")
+
+
+def _version_of(path):
+    return int(os.path.basename(path).split("-")[1].split(".")[0])
+
+
+def apply_event(catalog, kind, payload):
+    """Replay one logged write onto a catalog"""
+    if kind == "create":
+        for request in payload["rows"]:
+            catalog.append(request)
+    elif kind == "pool":
+        for request_id, pool_size, pool_filled in payload["updates"]:
+            row = catalog.row_of(request_id)
+            catalog.assign(row, pool_size=pool_size, pool_filled=pool_filled,
+                           version=catalog.column("version")[row] + 1)
+    elif kind == "settle":
+        rows = np.array([catalog.row_of(request_id) for request_id in payload["ids"]], dtype=np.int64)
+        catalog.assign(rows, settled_at=payload["settled_at"], version=catalog.column("version")[rows] + 1)
+    else:
+        raise ValueError(f"Unknown event kind {kind!r}")
+
+
+class Journal:
+    """Event log segments and catalog snapshots in one directory
+
+    Only one process may own a journal; a second one gets
+    `JournalInUseError` and should run without it.
+    """
+
+    def __init__(self, directory, flush_interval=FLUSH_INTERVAL, snapshot_every_rows=SNAPSHOT_EVERY_ROWS):
+        self.directory = directory
+        self.snapshot_every_rows = snapshot_every_rows
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, "journal.lock"), "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                raise JournalInUseError(directory) from None
+        self.rows_since_snapshot = 0
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._buffer = []
+        self._segment = None
+        self._snapshot_thread = None
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, args=(flush_interval,), name="journal-flush", daemon=True)
+        self._flusher.start()
+
+    def _path(self, prefix, version, extension):
+        return os.path.join(self.directory, f"{prefix}-{version:012d}.{extension}")
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, "events-*.jsonl")), key=_version_of)
+
+    def _snapshots(self):
+        return sorted(glob.glob(os.path.join(self.directory, "snapshot-*.npz")), key=_version_of)
+
+    def append(self, version, kind, payload, rows=1):
+        """Queue one event; it reaches disk with the next batched flush"""
+        line = json.dumps([version, kind, payload], separators=(",", ":"), default=_json_default)
+        with self._lock:
+            if self._segment is None:
+                self._segment = open(self._path("events", version, "jsonl"), "a")
+            self._buffer.append(line)
+            self.rows_since_snapshot += rows
+
+    def flush(self):
+        """Write and fsync everything appended so far"""
+        with self._io_lock:
+            with self._lock:
+                lines, self._buffer = self._buffer, []
+                segment = self._segment
+            if lines:
+                segment.write("\n".join(lines) + "\n")
+                segment.flush()
+                os.fsync(segment.fileno())
+
+    def _flush_loop(self, interval):
+        while not self._closed.wait(interval):
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Journal flush failed")
+
+    def _rotate(self):
+        """Flush and close the current segment; the next event starts a new one"""
+        with self._io_lock:
+            with self._lock:
+                lines, self._buffer = self._buffer, []
+                segment, self._segment = self._segment, None
+            if segment is not None:
+                if lines:
+                    segment.write("\n".join(lines) + "\n")
+                    segment.flush()
+                    os.fsync(segment.fileno())
+                segment.close()
+
+    def snapshot(self, catalog, version, background=True):
+        """Save `catalog` as of `version` and start a new log segment
+
+        Call it while no write can reach the catalog (the Market holds its
+        lock). The columns are copied right away and written to disk on a
+        background thread; skipped if the previous snapshot is still writing.
+        """
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            return False
+        columns, categories = catalog.arrays()
+        self._rotate()
+        self.rows_since_snapshot = 0
+        if background:
+            self._snapshot_thread = threading.Thread(
+                target=self._write_snapshot, args=(columns, categories, version), name="journal-snapshot", daemon=True
+            )
+            self._snapshot_thread.start()
+        else:
+            self._write_snapshot(columns, categories, version)
+        return True
+
+    def _write_snapshot(self, columns, categories, version):
+        path = self._path("snapshot", version, "npz")
+        tmp = path + ".tmp"
+        arrays = {f"column_{name}": values for name, values in columns.items()}
+        arrays.update({f"category_{name}": np.array(values, dtype=str) for name, values in categories.items()})
+        try:
+            with open(tmp, "wb") as f:
+                np.savez(f, **arrays)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except OSError:
+            logger.exception("Writing snapshot %s failed", path)
+            return
+        self._compact()
+
+    def _compact(self):
+        """Drop snapshots beyond the newest KEEP_SNAPSHOTS and segments none of them needs"""
+        snapshots = self._snapshots()
+        for path in snapshots[:-KEEP_SNAPSHOTS]:
+            os.remove(path)
+        oldest = _version_of(snapshots[-KEEP_SNAPSHOTS:][0])
+        segments = self._segments()
+        for path, following in zip(segments, segments[1:]):
+            if _version_of(following) <= oldest + 1:
+                os.remove(path)
+
+    def _load_snapshot(self, path):
+        with np.load(path) as data:
+            names = set(data.files)
+            expected = {f"column_{name}" for name in {**NUMERIC_COLUMNS, **CATEGORY_COLUMNS}}
+            expected |= {f"category_{name}" for name in CATEGORY_COLUMNS}
+            if names != expected:
+                return None
+            columns = {name: data[f"column_{name}"] for name in {**NUMERIC_COLUMNS, **CATEGORY_COLUMNS}}
+            categories = {name: data[f"category_{name}"].tolist() for name in CATEGORY_COLUMNS}
+        return RequestCatalog.from_arrays(columns, categories)
+
+    def _events(self, after):
+        """Logged (version, kind, payload) with version > `after`, oldest first"""
+        segments = self._segments()
+        for path, following in zip(segments, segments[1:] + [None]):
+            if following is not None and _version_of(following) <= after + 1:
+                continue
+            with open(path) as f:
+                for line in f:
+                    try:
+                        version, kind, payload = json.loads(line)
+                    except ValueError:
+                        # Torn last line from a crash mid-write
+                        return
+                    if version > after:
+                        yield version, kind, payload
+
+    def recover(self, store_version):
+        """Catalog as of `store_version` from a snapshot plus the log tail, or None"""
+        self.flush()
+        for path in reversed(self._snapshots()):
+            snapshot_version = _version_of(path)
+            if snapshot_version > store_version:
+                continue
+            try:
+                catalog = self._load_snapshot(path)
+            except (OSError, ValueError):
+                logger.warning("Skipping unreadable snapshot %s", path)
+                continue
+            if catalog is None:
+                continue
+            version = snapshot_version
+            try:
+                for event_version, kind, payload in self._events(snapshot_version):
+                    if event_version != version + 1 or event_version > store_version:
+                        break
+                    apply_event(catalog, kind, payload)
+                    version = event_version
+            except (KeyError, ValueError):
+                logger.warning("Replaying the log after %s failed", path, exc_info=True)
+                continue
+            if version == store_version:
+                return catalog
+            logger.info("Journal stops at version %d but the store is at %d", version, store_version)
+            return None
+        return None
+
+    def close(self):
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        self._closed.set()
+        self._flusher.join()
+        self._rotate()
+        self._lock_file.close()
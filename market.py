@@ -0,0 +1,361 @@
+"""Market facade: the shared request store plus the in-memory views kept in step with it"""
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from catalog import RequestCatalog
+from change_feed import ChangeFeed
+from market_index import MarketIndex
+from market_stats import MarketStats
+from money import from_units, ratio_bp, to_units, token_decimals
+from optimizer import optimize_portfolio
+from payouts import pool_fill_pct, pool_target
+from portfolios import Portfolios
+from request_store import StaleWriteError
+from settlement import UNATTRIBUTED, settle_batch
+
+
+# Seconds between checks of the store for writes made by other processes
+POLL_INTERVAL = 1.0
+
+
+def _event_request_ids(kind, payload):
+    if kind == "create":
+        return [request['id'] for request in payload["rows"]]
+    if kind == "pool":
+        return [update[0] for update in payload["updates"]]
+    return payload["ids"]
+
+
+class Market:
+    """Single entry point for reading and changing insurance requests
+
+    Reads are served from the columnar in-memory catalog. All writes go
+    through here so the catalog, index and running stats are updated
+    incrementally alongside the store. If another process writes to
+    the same database they are rebuilt the next time `sync` notices the
+    version moved.
+
+    With a `Journal`, every mirrored write is also logged as an event and
+    startup recovers the catalog from the latest snapshot plus the log tail
+    instead of reading every row back from the store.
+
+    `feed` publishes the ids touched by every write under the new version,
+    so sessions can cheaply tell whether what they show is still current.
+
+    `portfolios` holds every insurer's open positions, repriced as fills
+    land and closed as contracts settle.
+    """
+
+    def __init__(self, store, journal=None):
+        self.store = store
+        self.journal = journal
+        self._lock = threading.RLock()
+        self.catalog = RequestCatalog()
+        self.index = MarketIndex()
+        self.stats = MarketStats()
+        self.portfolios = Portfolios()
+        self._synced_version = None
+        self._polled_at = time.monotonic()
+        self.feed = ChangeFeed()
+        if journal is not None:
+            self._recover()
+        self.sync()
+
+    @property
+    def lock(self):
+        """Re-entrant lock held by every read and write; hold it to group several calls"""
+        return self._lock
+
+    def version(self):
+        return self.store.version()
+
+    def sync(self):
+        """Rebuild in-memory views if the store changed behind our back"""
+        with self._lock:
+            version = self.store.version()
+            if version != self._synced_version:
+                self._install(RequestCatalog.from_requests(self.store.list_requests()))
+                self._synced_version = version
+                self.feed.publish(version, None)
+                if self.journal is not None:
+                    # The log cannot explain this state, so anchor a new snapshot on it
+                    self.journal.snapshot(self.catalog, version)
+            return version
+
+    def poll(self, max_age=POLL_INTERVAL):
+        """Current market version without touching the store more than every `max_age` seconds
+
+        Writes made through this Market are published right away; writes
+        from other processes show up after the next throttled `sync`.
+        """
+        now = time.monotonic()
+        if now - self._polled_at >= max_age:
+            self._polled_at = now
+            self.sync()
+        return self.feed.version
+
+    def _recover(self):
+        version = self.store.version()
+        catalog = self.journal.recover(version)
+        if catalog is not None:
+            self._install(catalog)
+            self._synced_version = version
+            self.feed.publish(version, None)
+
+    def _install(self, catalog):
+        self.catalog = catalog
+        # Settled contracts stay in the catalog but leave the marketplace
+        self.index = MarketIndex.from_catalog(catalog, np.flatnonzero(catalog.column("settled_at") == 0))
+        self.stats = MarketStats.from_catalog(catalog)
+        self.portfolios = Portfolios.from_stakes(catalog, self.store.open_stakes())
+
+    def _apply_write(self, write, on_success):
+        """Run a store write and mirror it in memory if nobody else wrote meanwhile"""
+        with self._lock:
+            self.sync()
+            before = self._synced_version
+            result = write()
+            after = self.store.version()
+            if after == before + 1:
+                event = on_success(result)
+                self._synced_version = after
+                self.feed.publish(after, None if event is None else _event_request_ids(*event[:2]))
+                if event is not None and self.journal is not None:
+                    self._log(after, *event)
+            else:
+                self.sync()
+            return result
+
+    def _log(self, version, kind, payload, rows):
+        self.journal.append(version, kind, payload, rows)
+        if self.journal.rows_since_snapshot >= self.journal.snapshot_every_rows:
+            self.journal.snapshot(self.catalog, version)
+
+    def create_request(self, request):
+        """Persist a new request and return its id"""
+        def indexed(request_id):
+            request = self.store.get_request(request_id)
+            self.catalog.append(request)
+            self.index.add(request)
+            self.stats.add(request)
+            return "create", {"rows": [request]}, 1
+        return self._apply_write(lambda: self.store.add_request(request), indexed)
+
+    def create_requests(self, requests):
+        """Persist many requests in one transaction and return their ids"""
+        now = time.time()
+        requests = [dict(request, created_at=request.get('created_at') or now) for request in requests]
+
+        def indexed(request_ids):
+            # New rows are exactly what we inserted, so skip reading them back
+            rows = [
+                dict(request, id=request_id, settled_at=0.0, version=1)
+                for request_id, request in zip(request_ids, requests)
+            ]
+            for request in rows:
+                self.catalog.append(request)
+                self.stats.add(request)
+            self.index.add_many(rows)
+            return "create", {"rows": rows}, len(rows)
+        return self._apply_write(lambda: self.store.add_requests(requests), indexed)
+
+    def update_pool(self, request_id, pool_size, pool_filled):
+        """Change a request's pool and re-index it"""
+        with self._lock:
+            self.sync()
+            old_request = self.catalog.get(request_id)
+            if old_request is None:
+                raise KeyError(request_id)
+            old_request = old_request.to_dict()
+
+            def indexed(_):
+                request = self.store.get_request(request_id)
+                self.catalog.update(request)
+                self.index.update(request)
+                self.stats.update(old_request, request)
+                self.portfolios.reprice([request_id], self.catalog)
+                return "pool", {"updates": [[request_id, pool_size, pool_filled]]}, 1
+            self._apply_write(lambda: self.store.update_pool(request_id, pool_size, pool_filled), indexed)
+
+    def apply_fills(self, fills, versions=None):
+        """Add filled stakes to their pools and log the fills, in one store transaction
+
+        Each fill is a dict with order_id, insurer, request_id and amount;
+        pool_before and pool_after are filled in from the catalog. `versions`
+        ({request_id: version}) holds the versions the fills were sized
+        against. If another process changed one of the pools meanwhile,
+        nothing is written, the views are resynced and `StaleWriteError` is
+        raised.
+        """
+        with self._lock:
+            self.sync()
+            old_requests, pools = {}, {}
+            for fill in fills:
+                request_id = fill["request_id"]
+                if request_id not in old_requests:
+                    request = self.catalog.get(request_id)
+                    if versions is not None and request is not None and request['version'] != versions[request_id]:
+                        raise StaleWriteError(f"Request {request_id} changed since version {versions[request_id]}")
+                    if request is None or request['settled_at']:
+                        raise KeyError(request_id)
+                    old_requests[request_id] = request.to_dict()
+                    pools[request_id] = old_requests[request_id]["pool_size"]
+                fill["pool_before"] = pools[request_id]
+                pools[request_id] = fill["pool_after"] = pools[request_id] + fill["amount"]
+
+            new_requests, updates = {}, []
+            for request_id, old_request in old_requests.items():
+                pool_size = pools[request_id]
+                target = pool_target(old_request["amount"], old_request["ratio"], old_request["type"])
+                pool_filled = int(pool_fill_pct(pool_size, target))
+                new_requests[request_id] = dict(
+                    old_request, pool_size=pool_size, pool_filled=pool_filled, version=old_request["version"] + 1
+                )
+                updates.append((request_id, old_request["version"], pool_size, pool_filled))
+
+            def indexed(_):
+                for request_id, request in new_requests.items():
+                    self.catalog.update(request)
+                    self.index.update(request)
+                    self.stats.update(old_requests[request_id], request)
+                self.portfolios.add_fills(fills, self.catalog)
+                return "pool", {"updates": [[request_id, pool_size, pool_filled] for request_id, _, pool_size, pool_filled in updates]}, len(updates)
+            try:
+                return self._apply_write(lambda: self.store.apply_fills(updates, fills), indexed)
+            except StaleWriteError:
+                self.sync()
+                raise
+
+    def add_coverage(self, request_id, stake, insurer="direct"):
+        """Add an insurer's whole stake to a request's pool and return the updated request"""
+        fill = {"order_id": uuid.uuid4().hex, "insurer": insurer, "request_id": request_id, "amount": stake}
+        with self._lock:
+            self.apply_fills([fill])
+            return self.catalog.get(request_id)
+
+    def settle(self, request_ids, claimed=None, settled_at=None):
+        """Settle contracts and record buyer and insurer payouts in one transaction
+
+        `claimed` holds one boolean per request (default: no claims). Unknown
+        or already settled requests are skipped. Each insurer is paid by its
+        share of the pool as recorded in the fill log; pool capital not traced
+        to any fill is paid out as `UNATTRIBUTED`. Returns how many settled.
+        """
+        settled_at = time.time() if settled_at is None else settled_at
+        request_ids = np.asarray(request_ids, dtype=np.int64)
+        claimed = np.zeros(len(request_ids), dtype=bool) if claimed is None else np.asarray(claimed, dtype=bool)
+        with self._lock:
+            for attempt in range(2):
+                self.sync()
+                try:
+                    return self._settle(request_ids, claimed, settled_at)
+                except StaleWriteError:
+                    if attempt:
+                        raise
+
+    def _settle(self, request_ids, claimed, settled_at):
+        catalog = self.catalog
+        known = np.array([request_id in catalog for request_id in request_ids.tolist()], dtype=bool)
+        rows = np.array([catalog.row_of(request_id) for request_id in request_ids[known].tolist()], dtype=np.int64)
+        pending = catalog.column("settled_at")[rows] == 0
+        rows, claimed = rows[pending], claimed[known][pending]
+        if not len(rows):
+            return 0
+        ids = catalog.column("id")[rows]
+        amount = catalog.column("amount")[rows]
+        pool_size = catalog.column("pool_size")[rows]
+        # Settle in exact token units; see `money` for the rounding rules
+        decimals = token_decimals(catalog.categories["token"].values)[catalog.column("token")[rows]]
+        pool_units = to_units(pool_size, decimals)
+
+        position = {request_id: i for i, request_id in enumerate(ids.tolist())}
+        stakes_by_insurer = self.store.stakes_by_insurer(ids.tolist())
+        stake_rows = np.array([position[request_id] for request_id, _, _ in stakes_by_insurer], dtype=np.int64)
+        insurers = [insurer for _, insurer, _ in stakes_by_insurer]
+        stakes = to_units([stake for _, _, stake in stakes_by_insurer], decimals[stake_rows])
+        untraced = pool_units.copy()
+        np.subtract.at(untraced, stake_rows, stakes)
+        untraced_rows = np.flatnonzero(untraced > 0)
+        insurers.extend([UNATTRIBUTED] * len(untraced_rows))
+        stake_rows = np.concatenate([stake_rows, untraced_rows])
+        stakes = np.concatenate([stakes, untraced[untraced_rows]])
+
+        buyer, insurer = settle_batch(
+            to_units(amount, decimals), ratio_bp(catalog.column("ratio")[rows]), pool_units,
+            catalog.is_fixed(rows), claimed, stake_rows, stakes,
+        )
+        buyer = from_units(buyer, decimals)
+        stake_decimals = decimals[stake_rows]
+        settlements = list(zip(ids.tolist(), claimed.tolist(), buyer.tolist()))
+        payouts = list(zip(
+            ids[stake_rows].tolist(), insurers, from_units(stakes, stake_decimals).tolist(),
+            from_units(insurer, stake_decimals).tolist(),
+        ))
+
+        tokens = catalog.categories["token"].values
+        types = catalog.categories["type"].values
+        old_requests = [
+            {'token': tokens[token], 'type': types[ins_type], 'amount': request_amount, 'pool_size': pool,
+             'apr': apr, 'pool_filled': pool_filled, 'settled_at': 0.0}
+            for token, ins_type, request_amount, pool, apr, pool_filled in zip(
+                catalog.column("token")[rows].tolist(), catalog.column("type")[rows].tolist(),
+                amount.tolist(), pool_size.tolist(), catalog.column("apr")[rows].tolist(),
+                catalog.column("pool_filled")[rows].tolist(),
+            )
+        ]
+
+        def indexed(_):
+            catalog.assign(rows, settled_at=settled_at, version=catalog.column("version")[rows] + 1)
+            self.index.remove_many(ids.tolist())
+            self.portfolios.settle(ids.tolist())
+            for old_request in old_requests:
+                self.stats.update(old_request, dict(old_request, settled_at=settled_at))
+            return "settle", {"ids": ids.tolist(), "settled_at": settled_at}, len(rows)
+        self._apply_write(lambda: self.store.settle(settlements, payouts, settled_at), indexed)
+        return len(rows)
+
+    def get_request(self, request_id):
+        """Live view of a request, or None"""
+        with self._lock:
+            return self.catalog.get(request_id)
+
+    def stats_snapshot(self):
+        with self._lock:
+            return self.stats.snapshot()
+
+    def count(self, token=None, ins_type=None):
+        with self._lock:
+            return self.index.count(token, ins_type)
+
+    def portfolio(self, insurer, offset=0, limit=50):
+        """An insurer's totals per (token, type), open position count and one page of positions"""
+        with self._lock:
+            return (
+                self.portfolios.totals(insurer),
+                self.portfolios.position_count(insurer),
+                self.portfolios.positions(insurer, offset, limit),
+            )
+
+    def optimize(self, budget, claim_prob=0.05, prices=None, max_per_request=float("inf"), max_per_token=float("inf")):
+        """Best spread of a USD budget over the open requests (see `optimize_portfolio`)"""
+        with self._lock:
+            return optimize_portfolio(self.catalog, budget, claim_prob, prices, max_per_request, max_per_token)
+
+    def page(self, sort_key="id", descending=False, token=None, ins_type=None, offset=0, limit=12):
+        """One sorted, filtered page of requests as catalog views"""
+        with self._lock:
+            request_ids = self.index.page(sort_key, descending, token, ins_type, offset, limit)
+            return [self.catalog.get(request_id) for request_id in request_ids]
+
+    def search_count(self, prefix):
+        with self._lock:
+            return self.index.search_count(prefix)
+
+    def search(self, prefix, offset=0, limit=12):
+        """One page of requests whose borrower address or token starts with `prefix`"""
+        with self._lock:
+            request_ids = self.index.search(prefix, offset, limit)
+            return [self.catalog.get(request_id) for request_id in request_ids]
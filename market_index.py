@@ -0,0 +1,388 @@
+"""In-memory secondary indexes for sorting, filtering and searching the marketplace"""
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+SORT_KEYS = ("id", "apr", "ratio", "term_months", "pool_filled")
+
+# Batches at least this large are appended and re-sorted instead of inserted one by one
+BULK_THRESHOLD = 64
+# Sorts after any character that can follow a prefix
+PREFIX_END = "\U0010ffff"
+
+
+class _SortedColumn:
+    """Request ids kept sorted by (value, id) in two parallel NumPy arrays
+
+    Inserts and deletes shift the tail in place (a memmove), lookups are
+    binary searches, and a page is a slice of the id array.
+    """
+
+    __slots__ = ("values", "ids", "size")
+
+    def __init__(self, capacity=64):
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, size):
+        if size <= len(self.ids):
+            return
+        capacity = max(size, 2 * len(self.ids))
+        for name in ("values", "ids"):
+            old = getattr(self, name)
+            grown = np.empty(capacity, dtype=old.dtype)
+            grown[:self.size] = old[:self.size]
+            setattr(self, name, grown)
+
+    def _position(self, value, request_id):
+        values = self.values[:self.size]
+        low = int(np.searchsorted(values, value, "left"))
+        high = int(np.searchsorted(values, value, "right"))
+        return low + int(np.searchsorted(self.ids[low:high], request_id))
+
+    def insert(self, value, request_id):
+        self._reserve(self.size + 1)
+        pos = self._position(value, request_id)
+        self.values[pos + 1:self.size + 1] = self.values[pos:self.size]
+        self.ids[pos + 1:self.size + 1] = self.ids[pos:self.size]
+        self.values[pos] = value
+        self.ids[pos] = request_id
+        self.size += 1
+
+    def delete(self, value, request_id):
+        pos = self._position(value, request_id)
+        if pos >= self.size or self.ids[pos] != request_id:
+            raise KeyError(request_id)
+        self.values[pos:self.size - 1] = self.values[pos + 1:self.size]
+        self.ids[pos:self.size - 1] = self.ids[pos + 1:self.size]
+        self.size -= 1
+
+    def extend(self, values, request_ids):
+        """Add many entries and restore order with one sort"""
+        values = np.concatenate([self.values[:self.size], values])
+        request_ids = np.concatenate([self.ids[:self.size], request_ids])
+        order = np.lexsort((request_ids, values))
+        self.size = 0
+        self._reserve(len(order))
+        self.values[:len(order)] = values[order]
+        self.ids[:len(order)] = request_ids[order]
+        self.size = len(order)
+
+    def discard_many(self, request_ids):
+        """Drop every entry whose id is in the `request_ids` array, in one pass"""
+        keep = ~np.isin(self.ids[:self.size], request_ids)
+        size = int(keep.sum())
+        self.values[:size] = self.values[:self.size][keep]
+        self.ids[:size] = self.ids[:self.size][keep]
+        self.size = size
+
+    def slice(self, start, stop):
+        return self.ids[max(0, start):min(max(0, stop), self.size)]
+
+
+class PrefixIndex:
+    """Request ids sorted by (key, id), so every key starting with a prefix is one slice
+
+    Keys are kept in a sorted Python list searched with `bisect` and ids in a
+    parallel NumPy array. A prefix lookup is two binary searches and a page is
+    a slice of the ids. Inserts and deletes shift the tail in place; bulk
+    loads sort once.
+    """
+
+    __slots__ = ("keys", "ids", "size")
+
+    def __init__(self, capacity=64):
+        self.keys = []
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, size):
+        if size > len(self.ids):
+            grown = np.empty(max(size, 2 * len(self.ids)), dtype=np.int64)
+            grown[:self.size] = self.ids[:self.size]
+            self.ids = grown
+
+    def _position(self, key, request_id):
+        low = bisect_left(self.keys, key)
+        high = bisect_right(self.keys, key, low)
+        return low + int(np.searchsorted(self.ids[low:high], request_id))
+
+    def insert(self, key, request_id):
+        self._reserve(self.size + 1)
+        pos = self._position(key, request_id)
+        self.keys.insert(pos, key)
+        self.ids[pos + 1:self.size + 1] = self.ids[pos:self.size]
+        self.ids[pos] = request_id
+        self.size += 1
+
+    def delete(self, key, request_id):
+        pos = self._position(key, request_id)
+        if pos >= self.size or self.ids[pos] != request_id:
+            raise KeyError(request_id)
+        del self.keys[pos]
+        self.ids[pos:self.size - 1] = self.ids[pos + 1:self.size]
+        self.size -= 1
+
+    def extend(self, keys, request_ids):
+        """Add many entries and restore order with one sort"""
+        keys = self.keys + list(keys)
+        request_ids = np.concatenate([self.ids[:self.size], np.asarray(request_ids, dtype=np.int64)])
+        # A stable sort by key keeps equal keys in id order
+        order = sorted(np.argsort(request_ids, kind="stable").tolist(), key=keys.__getitem__)
+        self.keys = [keys[i] for i in order]
+        self.size = 0
+        self._reserve(len(order))
+        self.ids[:len(order)] = request_ids[order]
+        self.size = len(order)
+
+    def discard_many(self, request_ids):
+        """Drop every entry whose id is in the `request_ids` array, in one pass"""
+        keep = ~np.isin(self.ids[:self.size], request_ids)
+        self.keys = [key for key, kept in zip(self.keys, keep.tolist()) if kept]
+        size = len(self.keys)
+        self.ids[:size] = self.ids[:self.size][keep]
+        self.size = size
+
+    def span(self, prefix):
+        """[start, stop) positions of the keys that start with `prefix`"""
+        start = bisect_left(self.keys, prefix)
+        return start, bisect_left(self.keys, prefix + PREFIX_END, start)
+
+    def slice(self, start, stop):
+        return self.ids[max(0, start):min(max(0, stop), self.size)]
+
+
+class MarketIndex:
+    """Sorted id columns for every sort key and token/type filter
+
+    Each request is filed under four filter buckets: everything, its token,
+    its type, and its (token, type) pair. Every bucket keeps one sorted column
+    per sort key, so a filtered, sorted page is a slice found by position in
+    O(log n + page size). Adding, updating or removing a request touches only
+    that request's entries; bulk loads append and sort once.
+
+    For `search`, borrower addresses are kept in a `PrefixIndex` over all
+    requests and one per token, so every part of a search result is a slice.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._buckets = {}
+        # Token (None for all) -> PrefixIndex of borrower addresses
+        self._borrowers = {None: PrefixIndex()}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, request_id):
+        return request_id in self._entries
+
+    @classmethod
+    def from_requests(cls, requests):
+        index = cls()
+        index.add_many(requests)
+        return index
+
+    @classmethod
+    def from_catalog(cls, catalog, rows=slice(None)):
+        """Index catalog rows (all by default) straight from its columns"""
+        index = cls()
+        index.add_columns(
+            catalog.column("id")[rows],
+            np.asarray(catalog.categories["token"].values, dtype=object)[catalog.column("token")[rows]],
+            np.asarray(catalog.categories["type"].values, dtype=object)[catalog.column("type")[rows]],
+            np.asarray(catalog.categories["borrower"].values, dtype=object)[catalog.column("borrower")[rows]],
+            [catalog.column(key)[rows] for key in SORT_KEYS],
+        )
+        return index
+
+    @staticmethod
+    def _filter_keys(token, ins_type):
+        return ((None, None), (token, None), (None, ins_type), (token, ins_type))
+
+    @staticmethod
+    def _entry(request):
+        return (request['token'], request['type'], tuple(request[key] for key in SORT_KEYS), request['borrower'])
+
+    def _address_index(self, token):
+        index = self._borrowers.get(token)
+        if index is None:
+            index = self._borrowers[token] = PrefixIndex()
+        return index
+
+    def _bucket(self, filter_key):
+        bucket = self._buckets.get(filter_key)
+        if bucket is None:
+            bucket = self._buckets[filter_key] = {key: _SortedColumn() for key in SORT_KEYS}
+        return bucket
+
+    def add(self, request):
+        """Index a new request"""
+        request_id = request['id']
+        if request_id in self._entries:
+            raise KeyError(f"Request {request_id} is already indexed")
+        entry = self._entry(request)
+        self._entries[request_id] = entry
+        token, ins_type, values, borrower = entry
+        for filter_key in self._filter_keys(token, ins_type):
+            bucket = self._bucket(filter_key)
+            for key, value in zip(SORT_KEYS, values):
+                bucket[key].insert(value, request_id)
+        for address_key in (None, token):
+            self._address_index(address_key).insert(borrower, request_id)
+
+    def add_many(self, requests):
+        """Index many new requests; large batches are appended and sorted once"""
+        requests = list(requests)
+        if len(requests) < BULK_THRESHOLD:
+            for request in requests:
+                self.add(request)
+            return
+        self.add_columns(
+            [request['id'] for request in requests],
+            [request['token'] for request in requests],
+            [request['type'] for request in requests],
+            [request['borrower'] for request in requests],
+            [[request[key] for request in requests] for key in SORT_KEYS],
+        )
+
+    def add_columns(self, request_ids, tokens, types, borrowers, values):
+        """Bulk-index requests given as arrays; `values` holds one row per sort key"""
+        request_ids = np.asarray(request_ids, dtype=np.int64)
+        tokens = np.asarray(tokens, dtype=object)
+        types = np.asarray(types, dtype=object)
+        borrowers = np.asarray(list(borrowers), dtype=object)
+        values = np.asarray(values, dtype=np.float64).reshape(len(SORT_KEYS), len(request_ids))
+        id_list = request_ids.tolist()
+        for request_id in id_list:
+            if request_id in self._entries:
+                raise KeyError(f"Request {request_id} is already indexed")
+        for request_id, token, ins_type, row, borrower in zip(
+            id_list, tokens.tolist(), types.tolist(), values.T.tolist(), borrowers.tolist()
+        ):
+            self._entries[request_id] = (token, ins_type, tuple(row), borrower)
+        for token in [None] + sorted(set(tokens.tolist())):
+            token_mask = np.ones(len(id_list), dtype=bool) if token is None else tokens == token
+            if token_mask.any():
+                self._address_index(token).extend(borrowers[token_mask].tolist(), request_ids[token_mask])
+            for ins_type in [None] + sorted(set(types.tolist())):
+                mask = token_mask if ins_type is None else token_mask & (types == ins_type)
+                if not mask.any():
+                    continue
+                bucket = self._bucket((token, ins_type))
+                for key, column in zip(SORT_KEYS, values):
+                    bucket[key].extend(column[mask], request_ids[mask])
+
+    def remove(self, request_id):
+        """Drop a request from every bucket"""
+        token, ins_type, values, borrower = self._entries.pop(request_id)
+        for filter_key in self._filter_keys(token, ins_type):
+            bucket = self._buckets[filter_key]
+            for key, value in zip(SORT_KEYS, values):
+                bucket[key].delete(value, request_id)
+        for address_key in (None, token):
+            self._borrowers[address_key].delete(borrower, request_id)
+
+    def remove_many(self, request_ids):
+        """Drop many requests; large batches filter each column once"""
+        request_ids = list(request_ids)
+        if len(request_ids) < BULK_THRESHOLD:
+            for request_id in request_ids:
+                self.remove(request_id)
+            return
+        groups = {}
+        for request_id in request_ids:
+            token, ins_type, _, _ = self._entries.pop(request_id)
+            for filter_key in self._filter_keys(token, ins_type):
+                groups.setdefault(filter_key, []).append(request_id)
+        for filter_key, group_ids in groups.items():
+            group_ids = np.array(group_ids, dtype=np.int64)
+            for column in self._buckets[filter_key].values():
+                column.discard_many(group_ids)
+            token, ins_type = filter_key
+            if ins_type is None:
+                self._borrowers[token].discard_many(group_ids)
+
+    def update(self, request):
+        """Re-index a request whose fields changed (e.g. its pool filled)"""
+        request_id = request['id']
+        old_token, old_type, old_values, old_borrower = self._entries[request_id]
+        token, ins_type, values, borrower = entry = self._entry(request)
+        if (token, ins_type, borrower) != (old_token, old_type, old_borrower):
+            self.remove(request_id)
+            self.add(request)
+            return
+        self._entries[request_id] = entry
+        for filter_key in self._filter_keys(token, ins_type):
+            bucket = self._buckets[filter_key]
+            for key, old_value, value in zip(SORT_KEYS, old_values, values):
+                if old_value == value:
+                    continue
+                bucket[key].delete(old_value, request_id)
+                bucket[key].insert(value, request_id)
+
+    def count(self, token=None, ins_type=None):
+        """Number of requests matching the filters"""
+        bucket = self._buckets.get((token, ins_type))
+        return len(bucket["id"]) if bucket else 0
+
+    def page(self, sort_key="id", descending=False, token=None, ins_type=None, offset=0, limit=12):
+        """Ids of one sorted, filtered page"""
+        if sort_key not in SORT_KEYS:
+            raise ValueError(f"Cannot sort by {sort_key!r}")
+        bucket = self._buckets.get((token, ins_type))
+        if not bucket:
+            return []
+        column = bucket[sort_key]
+        if descending:
+            stop = len(column) - offset
+            return column.slice(stop - limit, stop)[::-1].tolist()
+        return column.slice(offset, offset + limit).tolist()
+
+    def _search_parts(self, prefix):
+        """Slices of id arrays that together hold every match of `prefix`, each id once"""
+        if not prefix:
+            bucket = self._buckets.get((None, None))
+            return [bucket["id"].slice(0, len(bucket["id"]))] if bucket else []
+        addresses = self._borrowers[None]
+        parts = [addresses.slice(*addresses.span(prefix))]
+        folded = prefix.casefold()
+        tokens = sorted(token for token in self._borrowers if token is not None and token.casefold().startswith(folded))
+        for token in tokens:
+            # The token's requests whose address matches too are already in the first part
+            index = self._borrowers[token]
+            start, stop = index.span(prefix)
+            parts += [index.slice(0, start), index.slice(stop, len(index))]
+        return [part for part in parts if len(part)]
+
+    def search_count(self, prefix):
+        """Number of requests `search` finds for `prefix`"""
+        return sum(len(part) for part in self._search_parts(prefix))
+
+    def search(self, prefix, offset=0, limit=12):
+        """Ids of one page of requests whose borrower address or token starts with `prefix`
+
+        Addresses match case-sensitively and come first; token symbols match
+        case-insensitively and follow, token by token, minus the requests
+        already listed by address. Within each, requests are ordered by
+        address then id. Counting and paging cost O(log n + page size)
+        whatever the prefix. An empty prefix lists the whole market by id.
+        """
+        page = []
+        for part in self._search_parts(prefix):
+            if offset >= len(part):
+                offset -= len(part)
+                continue
+            page.extend(part[offset:offset + limit - len(page)].tolist())
+            offset = 0
+            if len(page) >= limit:
+                break
+        return page
@@ -0,0 +1,108 @@
+"""Running market aggregates maintained alongside the request catalog"""
+from collections import defaultdict
+
+import numpy as np
+
+from money import from_units, to_units, token_decimals
+
+
+class MarketStats:
+    """TVL, pool capital, open request count and average APR, updated in O(1)
+
+    Every figure is a running sum adjusted by `add`, `remove` and `update`, so
+    nothing is recomputed by scanning the catalog. TVL counts the buyer's
+    locked amount plus the insurer pool, per token. A request is open while
+    its pool is less than 100% filled. Settled contracts have paid out, so
+    they only count towards `request_count`. Token sums are kept in integer
+    token units (see `money`), so they go back to exactly zero once every
+    request of a token has settled.
+    """
+
+    def __init__(self):
+        self.request_count = 0
+        self.open_count = 0
+        self.tvl_by_token = defaultdict(int)
+        self.pool_by_token = defaultdict(int)
+        self._apr_sum_by_type = defaultdict(float)
+        self._count_by_type = defaultdict(int)
+
+    @classmethod
+    def from_requests(cls, requests):
+        stats = cls()
+        for request in requests:
+            stats.add(request)
+        return stats
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """Aggregates computed straight from a `RequestCatalog`'s columns"""
+        stats = cls()
+        active = catalog.column("settled_at") == 0
+        stats.request_count = len(catalog)
+        stats.open_count = int((active & (catalog.column("pool_filled") < 100)).sum())
+        amount = catalog.column("amount")[active]
+        pool_size = catalog.column("pool_size")[active]
+        tokens = catalog.categories["token"].values
+        token_codes = catalog.column("token")[active]
+        decimals = token_decimals(tokens)[token_codes]
+        amount_units = to_units(amount, decimals)
+        pool_units = to_units(pool_size, decimals)
+        for code, token in enumerate(tokens):
+            rows = token_codes == code
+            if rows.any():
+                stats.pool_by_token[token] = int(pool_units[rows].sum())
+                stats.tvl_by_token[token] = int(amount_units[rows].sum()) + stats.pool_by_token[token]
+        types = catalog.categories["type"].values
+        type_codes = catalog.column("type")[active]
+        apr_sum = np.bincount(type_codes, weights=catalog.column("apr")[active], minlength=len(types))
+        counts = np.bincount(type_codes, minlength=len(types))
+        for code, ins_type in enumerate(types):
+            if counts[code]:
+                stats._apr_sum_by_type[ins_type] = float(apr_sum[code])
+                stats._count_by_type[ins_type] = int(counts[code])
+        return stats
+
+    def _apply(self, request, sign):
+        self.request_count += sign
+        if request.get('settled_at'):
+            return
+        if request['pool_filled'] < 100:
+            self.open_count += sign
+        decimals = token_decimals(request['token'])
+        pool_units = int(to_units(request['pool_size'], decimals))
+        self.tvl_by_token[request['token']] += sign * (int(to_units(request['amount'], decimals)) + pool_units)
+        self.pool_by_token[request['token']] += sign * pool_units
+        self._apr_sum_by_type[request['type']] += sign * request['apr']
+        self._count_by_type[request['type']] += sign
+
+    def add(self, request):
+        self._apply(request, 1)
+
+    def remove(self, request):
+        self._apply(request, -1)
+
+    def update(self, old_request, new_request):
+        self._apply(old_request, -1)
+        self._apply(new_request, 1)
+
+    def avg_apr_by_type(self):
+        return {
+            ins_type: self._apr_sum_by_type[ins_type] / count
+            for ins_type, count in self._count_by_type.items()
+            if count > 0
+        }
+
+    def snapshot(self):
+        """Plain-dict copy of every aggregate, token sums in token amounts"""
+        def amounts(units_by_token):
+            return {
+                token: float(from_units(units, token_decimals(token)))
+                for token, units in units_by_token.items() if units
+            }
+        return {
+            'request_count': self.request_count,
+            'open_count': self.open_count,
+            'tvl_by_token': amounts(self.tvl_by_token),
+            'pool_by_token': amounts(self.pool_by_token),
+            'avg_apr_by_type': self.avg_apr_by_type(),
+        }
@@ -0,0 +1,296 @@
+"""Order-book matching of insurer stake orders against open request pools"""
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import uuid
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from metrics import METRICS
+from payouts import pool_target
+from request_store import StaleWriteError
+
+
+logger = logging.getLogger(__name__)
+
+# Pools with less room than this (in token units) count as full
+MIN_FILL = 1e-9
+MAX_BATCH = 4096
+# Requests fetched per index page while scanning for cross-request fills
+SCAN_PAGE = 256
+MAX_RETRIES = 3
+# How often the matcher wakes up to match resting orders against new requests
+RESTING_POLL_SECONDS = 0.5
+
+
+@dataclass(eq=False)
+class StakeOrder:
+    """An insurer's offer to stake `amount` on one request or on a token's best requests
+
+    With `request_id` set the order only fills that request's pool. Otherwise
+    it fills open `token` requests (optionally of one `ins_type`) from the
+    highest APR down to `min_apr`; with `rest=True` whatever is left waits in
+    the book for requests created later.
+    """
+    insurer: str
+    amount: float
+    request_id: int = None
+    token: str = None
+    ins_type: str = None
+    min_apr: float = 0.0
+    rest: bool = False
+    order_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    filled: float = 0.0
+
+    @property
+    def remaining(self):
+        return self.amount - self.filled
+
+
+def _room(request):
+    """Stake a request can still take before its pool reaches its target"""
+    target = float(pool_target(request['amount'], request['ratio'], request['type']))
+    return max(target - request['pool_size'], 0.0)
+
+
+class MatchingEngine:
+    """Matches stake orders against request pools on one matcher thread
+
+    Any session thread can `submit` orders. The matcher drains them in
+    batches and matches each batch in arrival order, so orders for the same
+    request fill with time priority. All fills of a batch are committed
+    through `Market.apply_fills` in a single store transaction, which updates
+    `pool_size` / `pool_filled` and appends to the fill log atomically.
+    Resting cross-request orders are kept per token, lowest `min_apr` first
+    and then by time, and are matched against newly created requests.
+    """
+
+    def __init__(self, market, max_batch=MAX_BATCH):
+        self.market = market
+        self.max_batch = max_batch
+        self._inbox = queue.SimpleQueue()
+        self._resting = {}
+        # Guards `_resting`, which only the matcher thread changes, against readers on other threads
+        self._book_lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._last_request_id = self._max_request_id()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _max_request_id(self):
+        with self.market.lock:
+            ids = self.market.catalog.column("id")
+            return int(ids.max()) if len(ids) else 0
+
+    def _ensure_thread(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="matching-engine", daemon=True)
+                self._thread.start()
+
+    def submit(self, order):
+        """Queue an order; the future resolves to the fills it got on arrival"""
+        if not order.amount > 0:
+            raise ValueError("Stake amount must be positive")
+        if order.request_id is None and order.token is None:
+            raise ValueError("An order needs a request_id or a token")
+        future = Future()
+        self._inbox.put(("order", order, future))
+        self._ensure_thread()
+        return future
+
+    def place(self, order, timeout=30):
+        """Submit an order and wait for its immediate fills"""
+        return self.submit(order).result(timeout)
+
+    def cancel(self, order_id, timeout=30):
+        """Remove a resting order from the book; True if it was there"""
+        future = Future()
+        self._inbox.put(("cancel", order_id, future))
+        self._ensure_thread()
+        return future.result(timeout)
+
+    def resting_orders(self, token=None):
+        """Snapshot of resting orders in priority order"""
+        with self._book_lock:
+            tokens = [token] if token is not None else list(self._resting)
+            return [entry[2] for name in tokens for entry in sorted(self._resting.get(name, []))]
+
+    def close(self):
+        if self._thread is not None:
+            self._inbox.put(("stop", None, None))
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                item = self._inbox.get(timeout=RESTING_POLL_SECONDS if self._resting else None)
+            except queue.Empty:
+                item = None
+            batch = [] if item is None else [item]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._inbox.get_nowait())
+                except queue.Empty:
+                    break
+            orders = [(order, future) for kind, order, future in batch if kind == "order"]
+            try:
+                self._process(orders)
+            except Exception as exc:
+                logger.exception("Matching batch of %d orders failed", len(orders))
+                for _, future in orders:
+                    if not future.done():
+                        future.set_exception(exc)
+            for kind, payload, future in batch:
+                if kind == "cancel":
+                    future.set_result(self._cancel(payload))
+            if any(kind == "stop" for kind, _, _ in batch):
+                return
+
+    def _cancel(self, order_id):
+        with self._book_lock:
+            for token, book in self._resting.items():
+                kept = [entry for entry in book if entry[2].order_id != order_id]
+                if len(kept) != len(book):
+                    heapq.heapify(kept)
+                    self._resting[token] = kept
+                    return True
+            return False
+
+    def _process(self, orders):
+        if not orders and not self._resting:
+            return
+        METRICS.inc("stake_orders", len(orders))
+        with METRICS.span("match_batch"):
+            for attempt in range(MAX_RETRIES):
+                with self.market.lock:
+                    fills, filled, last_request_id, versions = self._match([order for order, _ in orders])
+                    try:
+                        # Another process may have moved a pool since matching; then match again
+                        seqs = self.market.apply_fills(fills, versions) if fills else []
+                    except StaleWriteError:
+                        if attempt == MAX_RETRIES - 1:
+                            raise
+                        continue
+                    break
+        for fill, seq in zip(fills, seqs):
+            fill["seq"] = seq
+        METRICS.inc("fills", len(fills))
+        self._last_request_id = last_request_id
+
+        for order, amount in filled.items():
+            order.filled += amount
+        with self._book_lock:
+            for order, _ in orders:
+                if order.rest and order.request_id is None and order.remaining > MIN_FILL:
+                    book = self._resting.setdefault(order.token, [])
+                    heapq.heappush(book, (order.min_apr, next(self._sequence), order))
+            for token in list(self._resting):
+                book = [entry for entry in self._resting[token] if entry[2].remaining > MIN_FILL]
+                if book:
+                    heapq.heapify(book)
+                    self._resting[token] = book
+                else:
+                    del self._resting[token]
+
+        by_order = {}
+        for fill in fills:
+            by_order.setdefault(fill["order_id"], []).append(fill)
+        for order, future in orders:
+            future.set_result(by_order.get(order.order_id, []))
+
+    def _match(self, orders):
+        """Fills for incoming orders, then resting orders against new requests
+
+        Works on copies of the pool room so nothing changes until the fills
+        are committed. Returns (fills, {order: amount filled}, newest request
+        id, {request id: version the room was read at}).
+        """
+        catalog = self.market.catalog
+        rooms = {}
+        versions = {}
+        fills = []
+        filled = {}
+
+        def take(order, request, wanted):
+            request_id = request['id']
+            if request_id not in rooms:
+                rooms[request_id] = _room(request)
+                versions[request_id] = request['version']
+            room = rooms[request_id]
+            amount = min(wanted, room)
+            if amount <= MIN_FILL:
+                return 0.0
+            rooms[request_id] = room - amount
+            fills.append({
+                "order_id": order.order_id,
+                "insurer": order.insurer,
+                "request_id": request_id,
+                "amount": amount,
+            })
+            filled[order] = filled.get(order, 0.0) + amount
+            return amount
+
+        for order in orders:
+            left = order.remaining
+            if order.request_id is not None:
+                request = catalog.get(order.request_id)
+                if request is not None and not request['settled_at']:
+                    take(order, request, left)
+                continue
+            for request in self._candidates(order.token, order.ins_type, order.min_apr):
+                left -= take(order, request, left)
+                if left <= MIN_FILL:
+                    break
+
+        last_request_id = self._last_request_id
+        if self._resting:
+            ids = catalog.column("id")
+            new_ids = ids[ids > self._last_request_id]
+            for request_id in sorted(new_ids.tolist()):
+                request = catalog.get(request_id)
+                for _, _, order in sorted(self._resting.get(request['token'], [])):
+                    if order.min_apr > request['apr']:
+                        break
+                    if order.ins_type not in (None, request['type']):
+                        continue
+                    take(order, request, order.remaining - filled.get(order, 0.0))
+                last_request_id = max(last_request_id, request_id)
+        return fills, filled, last_request_id, versions
+
+    def _candidates(self, token, ins_type, min_apr):
+        """Requests of `token`, highest APR first, down to `min_apr`"""
+        market = self.market
+        offset = 0
+        while True:
+            request_ids = market.index.page("apr", True, token, ins_type, offset, SCAN_PAGE)
+            if not request_ids:
+                return
+            for request_id in request_ids:
+                request = market.catalog.get(request_id)
+                if request['apr'] < min_apr:
+                    return
+                yield request
+            offset += SCAN_PAGE
+
+
+def replay_fills(fills, pools=None):
+    """Rebuild pool sizes from the fill log
+
+    Starts from `pools` ({request_id: pool_size}) or, for requests not in it,
+    from the `pool_before` of their first fill, then applies every fill in
+    sequence order. Returns the final pools and the sequence numbers whose
+    recorded `pool_before` did not match the replayed pool.
+    """
+    pools = dict(pools or {})
+    mismatches = []
+    for fill in sorted(fills, key=lambda fill: fill["seq"]):
+        request_id = fill["request_id"]
+        pool = pools.setdefault(request_id, fill["pool_before"])
+        if abs(pool - fill["pool_before"]) > 1e-6:
+            mismatches.append(fill["seq"])
+        pools[request_id] = pool + fill["amount"]
+    return pools, mismatches
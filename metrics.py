@@ -0,0 +1,175 @@
+"""Lightweight process-wide timing spans and counters with Prometheus/JSON export"""
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "sigmashield"
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Histogram:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+
+
+class Metrics:
+    """Counters and span-duration histograms for one process
+
+    Recording a span or bumping a counter is a clock read plus one dict
+    update under a lock, so the instrumentation can stay on in production.
+    Collectors registered with `add_collector` are called only at export
+    time and return extra gauge values.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._spans = {}
+        self._collectors = []
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._spans.get(name)
+            if histogram is None:
+                histogram = self._spans[name] = _Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def add_collector(self, collector):
+        """Register `collector()` -> {gauge name: value}, evaluated on export"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _gauges(self):
+        gauges = {}
+        for collector in list(self._collectors):
+            try:
+                gauges.update(collector())
+            except Exception:
+                logger.exception("Metrics collector %r failed", collector)
+        return gauges
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._spans.clear()
+
+    def to_dict(self):
+        with self._lock:
+            counters = dict(self._counters)
+            spans = {
+                name: {
+                    "count": h.count,
+                    "sum_seconds": h.total,
+                    "mean_seconds": h.total / h.count if h.count else 0.0,
+                    "max_seconds": h.max,
+                    "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], h.buckets)),
+                }
+                for name, h in self._spans.items()
+            }
+        return {"counters": counters, "spans": spans, "gauges": self._gauges()}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def dump_json(self, path):
+        with open(path, "w") as f:
+            f.write(self.to_json(indent=2, sort_keys=True) + "\n")
+
+    def to_prometheus(self):
+        """Everything in Prometheus text exposition format"""
+        data = self.to_dict()
+        lines = []
+        for name, value in sorted(data["counters"].items()):
+            metric = f"{PREFIX}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        if data["spans"]:
+            metric = f"{PREFIX}_span_seconds"
+            lines.append(f"# HELP {metric} Time spent in instrumented sections of a rerun")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, span in sorted(data["spans"].items()):
+                cumulative = 0
+                for bound, count in span["buckets"].items():
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{span="{name}"}} {span["sum_seconds"]}')
+                lines.append(f'{metric}_count{{span="{name}"}} {span["count"]}')
+        for name, value in sorted(data["gauges"].items()):
+            metric = f"{PREFIX}_{name}"
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics = METRICS
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = self.metrics.to_prometheus().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = self.metrics.to_json().encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1", metrics=METRICS):
+    """Serve /metrics (Prometheus) and /metrics.json from a daemon thread
+
+    Returns the server, or None if the port is already taken (e.g. by another
+    server process on the same machine).
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": metrics})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as exc:
+        logger.warning("Metrics endpoint not started on %s:%s: %s", host, port, exc)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,148 @@
+"""Capital allocation across the open request book for one insurer's budget"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from payouts import calculate_payouts_batch, pool_target
+
+
+DEFAULT_SEGMENTS = 32
+
+
+def expected_return(amount, ratio, pool_size, ins_type, stake, claim_prob):
+    """Expected profit of adding `stake` to a pool, in token units
+
+    The stake joins the pool, so the payout formulas are evaluated against
+    `pool_size + stake`. No claim earns `my_earnings_no_claim`; a claim costs
+    `my_loss_if_claim`. All arguments broadcast.
+    """
+    stake = np.asarray(stake, dtype=np.float64)
+    claim_prob = np.asarray(claim_prob, dtype=np.float64)
+    payouts = calculate_payouts_batch(amount, ratio, np.asarray(pool_size, dtype=np.float64) + stake, ins_type, stake)
+    return (1 - claim_prob) * payouts['my_earnings_no_claim'] - claim_prob * payouts['my_loss_if_claim']
+
+
+def optimize_stakes(amount, ratio, pool_size, ins_type, claim_prob, budget, max_stake,
+                    price=1.0, group=None, max_per_group=np.inf, segments=DEFAULT_SEGMENTS):
+    """Stakes (token units) that maximize total expected return under the limits
+
+    Budget and limits are in USD: `max_stake` caps each request, and
+    `max_per_group` (scalar or per-group array) caps each `group` code, e.g.
+    a token. Each request's return curve is cut into `segments` pieces whose
+    marginal rates are made non-increasing; the pieces with the best positive
+    rates are then taken greedily until a limit is hit.
+    """
+    amount = np.asarray(amount, dtype=np.float64)
+    n = len(amount)
+    price = np.broadcast_to(np.asarray(price, dtype=np.float64), (n,))
+    max_stake = np.nan_to_num(np.broadcast_to(np.asarray(max_stake, dtype=np.float64), (n,)), nan=0.0)
+    claim_prob = np.broadcast_to(np.asarray(claim_prob, dtype=np.float64), (n,))
+    if n == 0 or budget <= 0:
+        return np.zeros(n)
+
+    # Stake grid per request, in USD, and expected return at every grid point
+    grid = max_stake[:, None] * np.linspace(0.0, 1.0, segments + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        token_stake = np.where(price[:, None] > 0, grid / price[:, None], 0.0)
+        value = price[:, None] * expected_return(
+            amount[:, None],
+            np.asarray(ratio, dtype=np.float64)[:, None],
+            np.asarray(pool_size, dtype=np.float64)[:, None],
+            np.asarray(ins_type)[:, None],
+            token_stake,
+            claim_prob[:, None],
+        )
+        sizes = np.diff(grid, axis=1)
+        rates = np.where(sizes > 0, np.diff(value, axis=1) / sizes, -np.inf)
+    rates = np.minimum.accumulate(np.nan_to_num(rates, nan=-np.inf), axis=1)
+
+    rows, pieces = np.nonzero(rates > 0)
+    if len(rows) == 0:
+        return np.zeros(n)
+    rates, sizes = rates[rows, pieces], sizes[rows, pieces]
+    order = np.lexsort((pieces, rows, -rates))
+    rows, take = rows[order], sizes[order]
+
+    if group is not None:
+        groups = np.asarray(group)[rows]
+        caps = np.broadcast_to(np.asarray(max_per_group, dtype=np.float64), (int(groups.max(initial=0)) + 1,))
+        by_group = np.argsort(groups, kind='stable')
+        grouped = take[by_group]
+        spent = np.cumsum(grouped)
+        starts = np.r_[0, np.flatnonzero(np.diff(groups[by_group])) + 1]
+        spent -= np.repeat(spent[starts] - grouped[starts], np.diff(np.r_[starts, len(grouped)]))
+        take[by_group] = np.clip(caps[groups[by_group]] - (spent - grouped), 0.0, grouped)
+
+    spent = np.cumsum(take)
+    take = np.clip(budget - (spent - take), 0.0, take)
+    stakes_usd = np.bincount(rows, weights=take, minlength=n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(price > 0, stakes_usd / price, 0.0)
+
+
+@dataclass
+class Allocation:
+    request_ids: np.ndarray
+    tokens: list
+    stakes: np.ndarray
+    stakes_usd: np.ndarray
+    expected_return_usd: np.ndarray
+
+    def __len__(self):
+        return len(self.request_ids)
+
+    @property
+    def total_usd(self):
+        return float(self.stakes_usd.sum())
+
+    @property
+    def total_expected_return_usd(self):
+        return float(self.expected_return_usd.sum())
+
+
+def optimize_portfolio(catalog, budget, claim_prob=0.05, prices=None,
+                       max_per_request=np.inf, max_per_token=np.inf, segments=DEFAULT_SEGMENTS):
+    """Spread a USD budget over the open requests of a `RequestCatalog`; settled rows get nothing
+
+    `claim_prob` is a scalar or one probability per catalog row. `prices`
+    maps tokens to USD; without it every token counts 1:1 and with it
+    unpriced tokens are skipped. `max_per_token` is a scalar or a
+    {token: USD} dict. A request never gets more than it needs to fill its
+    pool. Returns only the requests that received a stake.
+    """
+    amount = catalog.column("amount")
+    ratio = catalog.column("ratio")
+    pool_size = catalog.column("pool_size")
+    fixed = catalog.is_fixed()
+    token_codes = catalog.column("token")
+    token_names = catalog.categories["token"].values
+
+    if prices is None:
+        token_price = np.ones(len(token_names))
+    else:
+        token_price = np.array([prices.get(token, np.nan) for token in token_names], dtype=np.float64)
+    price = np.nan_to_num(token_price[token_codes], nan=0.0) if len(token_names) else np.ones(len(amount))
+
+    room = np.maximum(pool_target(amount, ratio, fixed) - pool_size, 0.0) * price
+    # Settled contracts stay in the catalog but can no longer take stakes
+    room[catalog.column("settled_at") != 0] = 0.0
+    max_stake = np.minimum(room, max_per_request)
+    if isinstance(max_per_token, dict):
+        token_caps = np.array([max_per_token.get(token, np.inf) for token in token_names], dtype=np.float64)
+    else:
+        token_caps = max_per_token
+
+    stakes = optimize_stakes(
+        amount, ratio, pool_size, fixed, claim_prob, budget, max_stake,
+        price=price, group=token_codes, max_per_group=token_caps, segments=segments,
+    )
+    rows = np.flatnonzero(stakes > 0)
+    claim_prob = np.broadcast_to(np.asarray(claim_prob, dtype=np.float64), stakes.shape)[rows]
+    returns = expected_return(amount[rows], ratio[rows], pool_size[rows], fixed[rows], stakes[rows], claim_prob)
+    return Allocation(
+        request_ids=catalog.column("id")[rows].copy(),
+        tokens=[token_names[code] for code in token_codes[rows]],
+        stakes=stakes[rows],
+        stakes_usd=stakes[rows] * price[rows],
+        expected_return_usd=returns * price[rows],
+    )
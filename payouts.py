@@ -0,0 +1,94 @@
+"""Payout math for insurance requests, vectorized with NumPy"""
+import numpy as np
+
+
+PAYOUT_FIELDS = (
+    'my_earnings_no_claim',
+    'my_loss_if_claim',
+    'buyer_payout_if_claim',
+    'pool_gets_no_claim',
+    'my_share_pct',
+)
+
+
+def _is_fixed(ins_type):
+    """Boolean mask of fixed requests from type strings or a ready-made mask"""
+    ins_type = np.asarray(ins_type)
+    if ins_type.dtype == bool:
+        return ins_type
+    return ins_type == "fixed"
+
+
+def calculate_payouts_batch(amount, ratio, pool_size, ins_type, my_contribution):
+    """Calculate payouts for many (request, stake) pairs at once
+
+    All arguments broadcast against each other. `ins_type` holds "fixed" /
+    "variable" strings or a boolean is-fixed mask. Returns a dict of float64
+    arrays keyed like `calculate_payouts`.
+    """
+    amount = np.asarray(amount, dtype=np.float64)
+    ratio = np.asarray(ratio, dtype=np.float64)
+    pool_size = np.asarray(pool_size, dtype=np.float64)
+    stake = np.asarray(my_contribution, dtype=np.float64)
+    fixed = _is_fixed(ins_type)
+    amount, ratio, pool_size, stake, fixed = np.broadcast_arrays(
+        amount, ratio, pool_size, stake, fixed
+    )
+
+    has_pool = pool_size > 0
+    safe_pool = np.where(has_pool, pool_size, 1.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Fixed: Winner takes all
+        fixed_share = np.where(stake >= pool_size, 1.0, stake / safe_pool)
+
+        # Variable: Ratio-based with caps (a zero ratio leaves the insurer side uncapped)
+        insurer_max = np.where(ratio > 0, pool_size * (1 / ratio), np.inf)
+    buyer_max = amount * ratio
+    insurer_payout = np.minimum(insurer_max, amount)
+    buyer_payout = np.minimum(buyer_max, pool_size)
+    variable_share = np.where(has_pool, stake / safe_pool, 0.0)
+    variable_loss = stake - np.where(
+        has_pool, stake * (pool_size - buyer_payout) / safe_pool, 0.0
+    )
+
+    my_share = np.where(fixed, fixed_share, variable_share)
+    return {
+        'my_earnings_no_claim': np.where(fixed, amount * fixed_share, variable_share * insurer_payout),
+        'my_loss_if_claim': np.where(fixed, stake, variable_loss),
+        'buyer_payout_if_claim': np.where(fixed, pool_size, buyer_payout),
+        'pool_gets_no_claim': np.where(fixed, amount, insurer_payout),
+        'my_share_pct': my_share * 100,
+    }
+
+
+def calculate_payouts(request, my_contribution):
+    """Calculate payouts based on insurance type"""
+    payouts = calculate_payouts_batch(
+        request['amount'],
+        request['ratio'],
+        request['pool_size'],
+        request['type'],
+        my_contribution,
+    )
+    return {field: float(payouts[field]) for field in PAYOUT_FIELDS}
+
+
+def pool_target(amount, ratio, ins_type):
+    """Insurer capital a request needs to be fully covered
+
+    Variable requests need `amount * ratio` so the buyer's capped payout is
+    funded; fixed requests are an even bet against `amount`.
+    """
+    amount = np.asarray(amount, dtype=np.float64)
+    ratio = np.asarray(ratio, dtype=np.float64)
+    return np.where(_is_fixed(ins_type), amount, amount * ratio)
+
+
+def pool_fill_pct(pool_size, target):
+    """Whole-percent pool fill, capped at 100"""
+    pool_size = np.asarray(pool_size, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = np.where(target > 0, np.round(100 * pool_size / target), np.where(pool_size > 0, 100, 0))
+    return np.minimum(pct, 100).astype(np.int64)
@@ -0,0 +1,118 @@
+"""Open positions of every insurer with running payout totals per token and type"""
+from itertools import islice
+
+import numpy as np
+
+
+
+POSITION_FIELDS = ("request_id", "token", "type", "stake", "share_pct", "worst_loss", "best_earnings")
+TOTAL_FIELDS = ("positions", "stake", "worst_loss", "best_earnings")
+
+
+class Portfolios:
+    """Each insurer's stake, pool share, worst-case loss and best-case earnings per open request
+
+    A position's loss and earnings come from `Catalog.quote`, rounded to token
+    units like settlement, and depend on the request's pool, so whenever a
+    pool moves every position in that request is repriced. Per-insurer totals by (token, type) are running
+    sums adjusted by the old and new value of each repriced position; nothing
+    is recomputed by scanning an insurer's book. Settled contracts are closed
+    and drop out of the totals.
+    """
+
+    def __init__(self):
+        self._stakes = {}
+        self._positions = {}
+        self._totals = {}
+
+    def __len__(self):
+        return sum(len(positions) for positions in self._positions.values())
+
+    @classmethod
+    def from_stakes(cls, catalog, stakes):
+        """Positions from (request_id, insurer, stake) rows, skipping settled or unknown requests"""
+        portfolios = cls()
+        rows = catalog.rows_of([request_id for request_id, _, _ in stakes])
+        is_open = (rows >= 0) & (catalog.column("settled_at")[rows] == 0)
+        for (request_id, insurer, stake), keep in zip(stakes, is_open.tolist()):
+            if keep and stake:
+                portfolios._stakes.setdefault(request_id, {})[insurer] = stake
+        portfolios.reprice(list(portfolios._stakes), catalog)
+        return portfolios
+
+    def _tally(self, insurer, position, sign):
+        _, token, ins_type, stake, _, loss, earnings = position
+        totals = self._totals.setdefault(insurer, {})
+        cell = totals.setdefault((token, ins_type), [0, 0.0, 0.0, 0.0])
+        cell[0] += sign
+        if not cell[0]:
+            # Start the next position from zero rather than from float residue
+            del totals[(token, ins_type)]
+            return
+        cell[1] += sign * stake
+        cell[2] += sign * loss
+        cell[3] += sign * earnings
+
+    def _close(self, insurer, request_id):
+        positions = self._positions[insurer]
+        self._tally(insurer, positions.pop(request_id), -1)
+        if not positions:
+            del self._positions[insurer]
+            del self._totals[insurer]
+
+    def add_fills(self, fills, catalog):
+        """Add filled stakes (dicts with insurer, request_id and amount) and reprice their requests
+
+        Call after the catalog holds the pools the fills produced.
+        """
+        for fill in fills:
+            stakes = self._stakes.setdefault(fill["request_id"], {})
+            stakes[fill["insurer"]] = stakes.get(fill["insurer"], 0.0) + fill["amount"]
+        self.reprice(list(dict.fromkeys(fill["request_id"] for fill in fills)), catalog)
+
+    def reprice(self, request_ids, catalog):
+        """Recompute every position in requests whose pool changed"""
+        pairs = [
+            (request_id, insurer, stake)
+            for request_id in request_ids
+            for insurer, stake in self._stakes.get(request_id, {}).items()
+        ]
+        if not pairs:
+            return
+        rows = catalog.rows_of([request_id for request_id, _, _ in pairs])
+        stakes = np.array([stake for _, _, stake in pairs], dtype=np.float64)
+        payouts = catalog.quote(rows, stakes)
+        tokens = catalog.categories["token"].values
+        types = catalog.categories["type"].values
+        for (request_id, insurer, stake), token, ins_type, share, loss, earnings in zip(
+            pairs, catalog.column("token")[rows].tolist(), catalog.column("type")[rows].tolist(),
+            payouts['my_share_pct'].tolist(), payouts['my_loss_if_claim'].tolist(),
+            payouts['my_earnings_no_claim'].tolist(),
+        ):
+            positions = self._positions.setdefault(insurer, {})
+            old = positions.get(request_id)
+            if old is not None:
+                self._tally(insurer, old, -1)
+            position = positions[request_id] = (request_id, tokens[token], types[ins_type], stake, share, loss, earnings)
+            self._tally(insurer, position, 1)
+
+    def settle(self, request_ids):
+        """Close every position in settled contracts"""
+        for request_id in request_ids:
+            for insurer in self._stakes.pop(request_id, {}):
+                self._close(insurer, request_id)
+
+    def position_count(self, insurer):
+        return len(self._positions.get(insurer, ()))
+
+    def positions(self, insurer, offset=0, limit=50):
+        """One page of an insurer's open positions as dicts keyed like `POSITION_FIELDS`, oldest first"""
+        positions = self._positions.get(insurer, {}).values()
+        return [dict(zip(POSITION_FIELDS, position)) for position in islice(positions, offset, offset + limit)]
+
+    def totals(self, insurer):
+        """{(token, type): dict keyed like `TOTAL_FIELDS`} over an insurer's open positions"""
+        return {
+            key: dict(zip(TOTAL_FIELDS, cell))
+            for key, cell in sorted(self._totals.get(insurer, {}).items())
+        }
@@ -0,0 +1,186 @@
+"""Token -> USD price oracle with a TTL cache and non-blocking, batched refreshes
+
+A price source is any object with an async `fetch(tokens)` method returning
+{token: usd price} for the tokens it knows. The oracle asks it for every
+token in one call on a background event loop, so reruns only ever read the
+cache: stale prices keep being served until the refresh lands.
+"""
+import asyncio
+import concurrent.futures
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from metrics import METRICS
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60.0
+REFRESH_TIMEOUT = 10.0
+# Minimum gap between refresh attempts, so a failing source is not hammered
+RETRY_INTERVAL = 5.0
+
+# Offline placeholder prices; "Other" has no price on purpose
+STUB_PRICES = {"SigUSD": 1.0, "ERG": 1.25, "AHT": 0.02}
+
+
+class StaticPriceSource:
+    """Fixed in-memory prices, for offline use and tests"""
+
+    def __init__(self, prices=None):
+        self.prices = dict(STUB_PRICES if prices is None else prices)
+
+    async def fetch(self, tokens):
+        return {token: self.prices[token] for token in tokens if token in self.prices}
+
+
+class FilePriceSource:
+    """Prices read from a JSON file of {token: usd price}, re-read on every fetch"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    async def fetch(self, tokens):
+        prices = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        return {token: prices[token] for token in tokens if token in prices}
+
+
+def price_source_from_env():
+    """`FilePriceSource` for $SIGMASHIELD_PRICES if set, otherwise the stub prices"""
+    path = os.environ.get("SIGMASHIELD_PRICES")
+    return FilePriceSource(path) if path else StaticPriceSource()
+
+
+def _valid_price(value):
+    return isinstance(value, (int, float)) and math.isfinite(value) and value >= 0
+
+
+class PriceOracle:
+    """TTL cache of USD prices refreshed in the background (stale-while-revalidate)
+
+    `prices()` returns whatever is cached right away. If any requested price
+    is missing or older than `ttl`, one batched refresh of every known token
+    is started on the oracle's event loop thread; concurrent callers share it.
+    A failed or timed-out refresh keeps the previous prices. A token the
+    source has no price for counts as checked, so it is asked for again
+    after `ttl` like any other rather than on every retry.
+    """
+
+    def __init__(self, source, tokens=(), ttl=DEFAULT_TTL, timeout=REFRESH_TIMEOUT):
+        self.source = source
+        self.tokens = set(tokens)
+        self.ttl = ttl
+        self.timeout = timeout
+        self._prices = {}
+        # Token -> when a refresh last got an answer for it, priced or not
+        self._checked = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._refreshing = None
+        self._attempted_at = None
+
+    def _event_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name="price-oracle", daemon=True).start()
+        return self._loop
+
+    def _is_stale(self, token, now):
+        checked_at = self._checked.get(token)
+        return checked_at is None or now - checked_at >= self.ttl
+
+    def prices(self, tokens=None):
+        """Cached {token: usd price}; never waits for the source"""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self.tokens if tokens is None else set(tokens)
+            self.tokens |= tokens
+            prices = {token: self._prices[token][0] for token in tokens if token in self._prices}
+            stale = any(self._is_stale(token, now) for token in tokens)
+        if stale:
+            self.refresh()
+        return prices
+
+    def price(self, token):
+        """Cached USD price of one token, or None"""
+        return self.prices([token]).get(token)
+
+    def refresh(self, force=False):
+        """Start a batched refresh of every known token and return its future
+
+        Returns the in-flight refresh if there is one, or None if the last
+        attempt was too recent (unless `force`).
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing is not None and not self._refreshing.done():
+                return self._refreshing
+            if not force and self._attempted_at is not None and now - self._attempted_at < min(self.ttl, RETRY_INTERVAL):
+                return None
+            self._attempted_at = now
+            tokens = sorted(self.tokens)
+            self._refreshing = asyncio.run_coroutine_threadsafe(self._refresh(tokens), self._event_loop())
+            return self._refreshing
+
+    async def _refresh(self, tokens):
+        start = time.perf_counter()
+        try:
+            prices = await asyncio.wait_for(self.source.fetch(tokens), self.timeout)
+        except Exception:
+            logger.exception("Price refresh failed for %s", ", ".join(tokens))
+            METRICS.inc("price_refresh_errors")
+            return {}
+        finally:
+            METRICS.observe("price_refresh", time.perf_counter() - start)
+        fetched_at = time.monotonic()
+        prices = {token: float(price) for token, price in prices.items() if _valid_price(price)}
+        with self._lock:
+            for token, price in prices.items():
+                self._prices[token] = (price, fetched_at)
+            for token in tokens:
+                self._checked[token] = fetched_at
+        METRICS.inc("price_refreshes")
+        return prices
+
+    def wait(self, timeout=None):
+        """Block until the in-flight refresh (if any) finishes; for startup and tests"""
+        future = self._refreshing
+        if future is None:
+            return True
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            return False
+        return True
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            ages = [now - fetched_at for _, fetched_at in self._prices.values()]
+        return {"tokens_priced": len(ages), "max_age_seconds": max(ages, default=0.0)}
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+
+def usd_total(amounts_by_token, prices):
+    """USD value of {token: amount} and the {token: amount} left unpriced"""
+    total = 0.0
+    unpriced = {}
+    for token, amount in amounts_by_token.items():
+        price = prices.get(token)
+        if price is None:
+            unpriced[token] = amount
+        else:
+            total += amount * price
+    return total, unpriced
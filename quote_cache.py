@@ -0,0 +1,63 @@
+"""Bounded LRU cache of payout quotes shared by every session"""
+import threading
+from collections import OrderedDict
+
+from money import quote_payouts
+
+
+class QuoteCache:
+    """LRU cache of `quote_payouts` results keyed by (request id, version, stake)
+
+    The request version is part of the key, so a quote is never served for a
+    request whose pool has changed since it was computed. Hit, miss and
+    eviction counters are kept for monitoring.
+    """
+
+    def __init__(self, maxsize=10_000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def quote(self, request, my_contribution):
+        """Payouts for staking `my_contribution` on `request`, computed at most once"""
+        key = (request['id'], request['version'], my_contribution)
+        with self._lock:
+            payouts = self._entries.get(key)
+            if payouts is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return payouts
+            self.misses += 1
+        payouts = quote_payouts(request, my_contribution)
+        with self._lock:
+            self._entries[key] = payouts
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return payouts
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hit_rate(),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,371 @@
+"""Headless HTTP/JSON quote service on asyncio, for bots and scripts (no Streamlit)
+
+    GET  /health
+    GET  /requests?sort=apr&desc=1&token=ERG&type=fixed&offset=0&limit=50
+    GET  /requests/<id>
+    POST /requests   {"amount", "token", "type", "ratio", "term_months"[, "borrower"]}
+    GET  /quote?request_id=1&stake=500
+    POST /quotes     {"quotes": [{"request_id": 1, "stake": 500}, ...]}
+    POST /stakes     {"insurer", "amount", "request_id"}
+                     or {"insurer", "amount", "token"[, "type", "min_apr", "rest"]}
+
+Connections stay open (HTTP/1.1 keep-alive) and requests on one connection
+are answered in order. At most `max_connections` are served at once; any
+more get 503 and are closed. Single quotes that arrive in the same
+event-loop tick, from any connection, are evaluated together in one
+vectorized call; `/quotes` does the same for an explicit batch. Stakes go through the same
+`MatchingEngine` as the app.
+"""
+import asyncio
+import json
+import logging
+import math
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from market_index import SORT_KEYS
+from matching import StakeOrder
+from metrics import METRICS
+from money import service_fee_for
+from payouts import PAYOUT_FIELDS
+from request_rules import (
+    APR_PER_RATIO, FIXED_RATIO, INTEREST_RATE_PER_RATIO, TOKEN_ICONS, validation_errors,
+)
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8780
+MAX_BODY_BYTES = 1 << 20
+MAX_BATCH = 10_000
+MAX_PAGE = 500
+# Idle keep-alive connections are closed after this many seconds
+IDLE_TIMEOUT = 60.0
+# Connections beyond this many get 503 and are closed straight away
+MAX_CONNECTIONS = 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+def _stake(value):
+    try:
+        stake = float(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, "stake must be a number") from None
+    if not math.isfinite(stake) or stake <= 0:
+        raise HTTPError(400, "stake must be positive")
+    return stake
+
+
+def quote_many(market, request_ids, stakes):
+    """Quotes for (request id, stake) pairs in one vectorized evaluation
+
+    Unknown or settled requests get {"request_id", "error"} instead.
+    """
+    market.poll()
+    with market.lock:
+        catalog = market.catalog
+        rows = catalog.rows_of(request_ids)
+        open_rows = rows >= 0
+        open_rows[open_rows] = catalog.column("settled_at")[rows[open_rows]] == 0
+        known = np.flatnonzero(open_rows)
+        payouts = catalog.quote(rows[known], np.asarray(stakes, dtype=np.float64)[known])
+        versions = catalog.column("version")[rows[known]].tolist()
+    METRICS.inc("api_quotes", len(request_ids))
+    quotes = [{"request_id": request_id, "error": "unknown or settled request"} for request_id in request_ids]
+    fields = {name: payouts[name].tolist() for name in PAYOUT_FIELDS}
+    for k, i in enumerate(known.tolist()):
+        quote = {"request_id": request_ids[i], "stake": stakes[i], "version": versions[k]}
+        quote.update((name, values[k]) for name, values in fields.items())
+        quotes[i] = quote
+    return quotes
+
+
+class QuoteBatcher:
+    """Coalesces single quotes issued in the same event-loop tick into one `quote_many` call"""
+
+    def __init__(self, market):
+        self.market = market
+        self._pending = []
+
+    def quote(self, request_id, stake):
+        future = asyncio.get_running_loop().create_future()
+        if not self._pending:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._pending.append((request_id, stake, future))
+        return future
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        try:
+            quotes = quote_many(self.market, [item[0] for item in pending], [item[1] for item in pending])
+        except Exception as exc:
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, _, future), quote in zip(pending, quotes):
+            if not future.done():
+                future.set_result(quote)
+
+
+def new_request(body):
+    """Complete request from API fields, derived like the create dialog does, or HTTPError"""
+    if not isinstance(body, dict):
+        raise HTTPError(400, "expected a JSON object")
+    request = dict(body)
+    if request.get("type") == "fixed":
+        request["ratio"] = FIXED_RATIO
+    errors = validation_errors(request)
+    if errors:
+        raise HTTPError(422, "; ".join(errors))
+    amount, ratio = float(request["amount"]), float(request["ratio"])
+    return {
+        "amount": amount,
+        "token": request["token"],
+        "icon": TOKEN_ICONS[request["token"]],
+        "ratio": ratio,
+        "type": request["type"],
+        "pool_size": 0,
+        "pool_filled": 0,
+        "term_months": int(float(request["term_months"])),
+        "interest_rate": int(ratio * INTEREST_RATE_PER_RATIO),
+        "apr": ratio * APR_PER_RATIO,
+        "service_fee": service_fee_for(amount, request["token"]),
+        "borrower": str(request.get("borrower") or "API"),
+    }
+
+
+class QuoteService:
+    """Routes HTTP requests to a `Market` and an optional `MatchingEngine`"""
+
+    def __init__(self, market, matching_engine=None, max_connections=MAX_CONNECTIONS):
+        self.market = market
+        self.matching_engine = matching_engine
+        self.max_connections = max_connections
+        self.connections = 0
+        self.batcher = QuoteBatcher(market)
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Start listening; returns the `asyncio.Server`"""
+        return await asyncio.start_server(self._serve_connection, host, port)
+
+    async def _serve_connection(self, reader, writer):
+        if self.connections >= self.max_connections:
+            METRICS.inc("api_connections_refused")
+            writer.write(_response(503, {"error": "too many connections"}, keep_alive=False))
+            writer.close()
+            return
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), IDLE_TIMEOUT)
+                except HTTPError as exc:
+                    writer.write(_response(exc.status, {"error": str(exc)}, keep_alive=False))
+                    break
+                if request is None:
+                    break
+                method, target, keep_alive, body = request
+                status, payload = await self.handle(method, target, body)
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def handle(self, method, target, body=b""):
+        """(status, JSON payload) for one request"""
+        METRICS.inc("api_requests")
+        try:
+            url = urlsplit(target)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            parts = [part for part in url.path.split("/") if part]
+            try:
+                data = json.loads(body) if body else None
+            except ValueError as exc:
+                raise HTTPError(400, f"invalid JSON: {exc}") from None
+            return 200, await self._route(method, parts, query, data)
+        except HTTPError as exc:
+            return exc.status, {"error": str(exc)}
+        except Exception:
+            logger.exception("Quote service failed on %s %s", method, target)
+            return 500, {"error": "internal error"}
+
+    async def _route(self, method, parts, query, data):
+        if parts == ["health"] and method == "GET":
+            return {"status": "ok", "version": self.market.poll()}
+        if parts == ["quote"] and method == "GET":
+            quote = await self.batcher.quote(_request_id(query.get("request_id")), _stake(query.get("stake")))
+            if "error" in quote:
+                raise HTTPError(404, quote["error"])
+            return quote
+        if parts == ["quotes"] and method == "POST":
+            return {"quotes": self._quote_batch(data)}
+        if parts == ["requests"] and method == "GET":
+            return self._list(query)
+        if parts == ["requests"] and method == "POST":
+            request = new_request(data)
+            loop = asyncio.get_running_loop()
+            request_id = await loop.run_in_executor(None, self.market.create_request, request)
+            return {"id": request_id}
+        if len(parts) == 2 and parts[0] == "requests" and method == "GET":
+            request = self.market.get_request(_request_id(parts[1]))
+            if request is None:
+                raise HTTPError(404, "unknown request")
+            return request.to_dict()
+        if parts == ["stakes"] and method == "POST":
+            return await self._stake(data)
+        raise HTTPError(404 if method in ("GET", "POST") else 405)
+
+    def _quote_batch(self, data):
+        quotes = data.get("quotes") if isinstance(data, dict) else None
+        if not isinstance(quotes, list):
+            raise HTTPError(400, 'expected {"quotes": [{"request_id", "stake"}, ...]}')
+        if len(quotes) > MAX_BATCH:
+            raise HTTPError(413, f"at most {MAX_BATCH} quotes per batch")
+        try:
+            request_ids = [_request_id(quote["request_id"]) for quote in quotes]
+            stakes = [_stake(quote["stake"]) for quote in quotes]
+        except (KeyError, TypeError):
+            raise HTTPError(400, "every quote needs a request_id and a stake") from None
+        return quote_many(self.market, request_ids, stakes)
+
+    def _list(self, query):
+        sort = query.get("sort", "id")
+        if sort not in SORT_KEYS:
+            raise HTTPError(400, f"sort must be one of {', '.join(SORT_KEYS)}")
+        try:
+            offset = max(int(query.get("offset", 0)), 0)
+            limit = min(max(int(query.get("limit", 50)), 0), MAX_PAGE)
+        except ValueError:
+            raise HTTPError(400, "offset and limit must be integers") from None
+        descending = query.get("desc", "0").lower() in ("1", "true", "yes")
+        token, ins_type = query.get("token"), query.get("type")
+        version = self.market.poll()
+        with self.market.lock:
+            total = self.market.count(token, ins_type)
+            page = self.market.page(sort, descending, token, ins_type, offset, limit)
+            requests = [request.to_dict() for request in page]
+        return {"version": version, "total": total, "offset": offset, "requests": requests}
+
+    async def _stake(self, data):
+        if self.matching_engine is None:
+            raise HTTPError(503, "stake submission is disabled")
+        if not isinstance(data, dict) or not data.get("insurer"):
+            raise HTTPError(400, "a stake needs an insurer")
+        order = StakeOrder(
+            insurer=str(data["insurer"]),
+            amount=_stake(data.get("amount")),
+            request_id=_request_id(data["request_id"]) if data.get("request_id") is not None else None,
+            token=data.get("token"),
+            ins_type=data.get("type"),
+            min_apr=_number(data.get("min_apr", 0.0), "min_apr"),
+            rest=bool(data.get("rest", False)),
+        )
+        if order.request_id is None and order.token is None:
+            raise HTTPError(400, "a stake needs a request_id or a token")
+        fills = await asyncio.wrap_future(self.matching_engine.submit(order))
+        return {"order_id": order.order_id, "filled": sum(fill["amount"] for fill in fills), "fills": fills}
+
+
+def _number(value, name):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{name} must be a number") from None
+
+
+def _request_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, "request_id must be an integer") from None
+
+
+async def _read_request(reader):
+    """(method, target, keep_alive, body) of the next request, or None at end of stream"""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "malformed request line") from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(400, "invalid Content-Length") from None
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413)
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, keep_alive, body
+
+
+def _response(status, payload, keep_alive=True):
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    head = (
+        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+async def serve(market, matching_engine=None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = await QuoteService(market, matching_engine).start(host, port)
+    logger.info("Quote service listening on %s", ", ".join(str(sock.getsockname()) for sock in server.sockets))
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    import argparse
+
+    from market import Market
+    from matching import MatchingEngine
+    from request_store import RequestStore
+
+    parser = argparse.ArgumentParser(description="Headless HTTP/JSON quote service")
+    parser.add_argument("--db", help="request database (default: $SIGMASHIELD_DB or insurance_requests.db)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--read-only", action="store_true", help="disable stake submission")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    market = Market(RequestStore(args.db))
+    engine = None if args.read_only else MatchingEngine(market)
+    try:
+        asyncio.run(serve(market, engine, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if engine is not None:
+            engine.close()
+        market.store.close()
+
+
+if __name__ == "__main__":
+    main()
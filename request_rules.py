@@ -0,0 +1,47 @@
+"""Limits and pricing rules for insurance requests, shared by the dialog and bulk import"""
+
+TOKENS = ["SigUSD", "ERG", "AHT", "Other"]
+TYPES = ["variable", "fixed"]
+ICONS = ["purple", "orange", "blue", "red"]
+
+# Default card icon per token for requests that do not pick one
+TOKEN_ICONS = {"SigUSD": "purple", "ERG": "orange", "AHT": "blue", "Other": "red"}
+
+MIN_AMOUNT = 100
+MAX_AMOUNT = 100000
+MIN_RATIO = 0.0
+MAX_RATIO = 5.0
+MIN_TERM_MONTHS = 1
+MAX_TERM_MONTHS = 36
+
+# Fixed requests always pay out 1:1
+FIXED_RATIO = 1.0
+
+SERVICE_FEE_BP = 100  # 1% fee, in basis points
+SERVICE_FEE_RATE = SERVICE_FEE_BP / 10_000
+INTEREST_RATE_PER_RATIO = 20
+APR_PER_RATIO = 15
+
+
+def _in_range(value, low, high):
+    try:
+        return low <= float(value) <= high
+    except (TypeError, ValueError):
+        return False
+
+
+def validation_errors(request):
+    """Reasons `request` breaks the rules, empty if it is valid"""
+    errors = []
+    if request.get('token') not in TOKENS:
+        errors.append(f"token must be one of {', '.join(TOKENS)}")
+    if request.get('type') not in TYPES:
+        errors.append(f"type must be one of {', '.join(TYPES)}")
+    if not _in_range(request.get('amount'), MIN_AMOUNT, MAX_AMOUNT):
+        errors.append(f"amount must be a number between {MIN_AMOUNT} and {MAX_AMOUNT}")
+    if not _in_range(request.get('ratio'), MIN_RATIO, MAX_RATIO):
+        errors.append(f"ratio must be a number between {MIN_RATIO} and {MAX_RATIO}")
+    term = request.get('term_months')
+    if not _in_range(term, MIN_TERM_MONTHS, MAX_TERM_MONTHS) or float(term) != int(float(term)):
+        errors.append(f"term_months must be a whole number between {MIN_TERM_MONTHS} and {MAX_TERM_MONTHS}")
+    return errors
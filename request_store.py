@@ -0,0 +1,366 @@
+"""SQLite-backed insurance request store shared by every session"""
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "insurance_requests.db")
+
+REQUEST_COLUMNS = (
+    "id", "amount", "token", "icon", "ratio", "type", "pool_size", "pool_filled",
+    "term_months", "interest_rate", "apr", "service_fee", "borrower", "created_at", "settled_at", "version",
+)
+
+# Columns written on insert; the rest start at their defaults
+INSERT_COLUMNS = REQUEST_COLUMNS[:-2]
+
+SORTABLE_COLUMNS = ("id", "apr", "ratio", "term_months", "pool_filled", "amount")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS insurance_requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    amount NUMERIC NOT NULL,
+    token TEXT NOT NULL,
+    icon TEXT NOT NULL,
+    ratio REAL NOT NULL,
+    type TEXT NOT NULL,
+    pool_size NUMERIC NOT NULL DEFAULT 0,
+    pool_filled INTEGER NOT NULL DEFAULT 0,
+    term_months INTEGER NOT NULL,
+    interest_rate INTEGER NOT NULL,
+    apr REAL NOT NULL,
+    service_fee NUMERIC NOT NULL,
+    borrower TEXT NOT NULL,
+    created_at REAL NOT NULL DEFAULT 0,
+    settled_at REAL NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_requests_token ON insurance_requests(token);
+CREATE INDEX IF NOT EXISTS idx_requests_type ON insurance_requests(type);
+CREATE INDEX IF NOT EXISTS idx_requests_pool_filled ON insurance_requests(pool_filled);
+CREATE INDEX IF NOT EXISTS idx_requests_apr ON insurance_requests(apr);
+CREATE TABLE IF NOT EXISTS market_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO market_meta (key, value) VALUES ('version', 0);
+CREATE TABLE IF NOT EXISTS fill_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id TEXT NOT NULL,
+    insurer TEXT NOT NULL,
+    request_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    pool_before REAL NOT NULL,
+    pool_after REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fill_log_request ON fill_log(request_id);
+CREATE INDEX IF NOT EXISTS idx_fill_log_insurer ON fill_log(insurer);
+CREATE TABLE IF NOT EXISTS settlements (
+    request_id INTEGER PRIMARY KEY,
+    claimed INTEGER NOT NULL,
+    buyer_payout REAL NOT NULL,
+    settled_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS insurer_payouts (
+    request_id INTEGER NOT NULL,
+    insurer TEXT NOT NULL,
+    stake REAL NOT NULL,
+    payout REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_insurer_payouts_request ON insurer_payouts(request_id);
+CREATE INDEX IF NOT EXISTS idx_insurer_payouts_insurer ON insurer_payouts(insurer);
+"""
+
+FILL_COLUMNS = ("seq", "order_id", "insurer", "request_id", "amount", "pool_before", "pool_after", "created_at")
+
+
+class StaleWriteError(RuntimeError):
+    """A conditional write found a row at a different version than expected"""
+
+
+class RequestStore:
+    """Insurance requests persisted in one SQLite database (WAL mode)
+
+    A single connection is shared between Streamlit's script threads and
+    guarded by a lock. Other processes can open the same file; WAL lets their
+    readers run alongside a writer. Every write bumps the `version` counter so
+    callers can cache reads until the market actually changes.
+
+    Request ids come from a counter in `market_meta` that is bumped inside
+    the same write-locked transaction as the insert, so ids are monotonic and
+    unique across threads and processes and are never reused, even after rows are deleted.
+    """
+
+    def __init__(self, path=None):
+        # Resolved per instance so tools can point new stores at another file
+        self.path = path or os.environ.get("SIGMASHIELD_DB") or DEFAULT_DB_PATH
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Bring databases created by older versions up to the current schema"""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(insurance_requests)")}
+        if "version" not in columns:
+            self._conn.execute(
+                "ALTER TABLE insurance_requests ADD COLUMN version INTEGER NOT NULL DEFAULT 1"
+            )
+        if "created_at" not in columns:
+            # Older rows have no creation time; their terms start now
+            self._conn.execute(
+                "ALTER TABLE insurance_requests ADD COLUMN created_at REAL NOT NULL DEFAULT 0"
+            )
+            self._conn.execute("UPDATE insurance_requests SET created_at = ?", (time.time(),))
+        if "settled_at" not in columns:
+            self._conn.execute(
+                "ALTER TABLE insurance_requests ADD COLUMN settled_at REAL NOT NULL DEFAULT 0"
+            )
+        # Start the id allocator above every id ever handed out, deleted ones included
+        self._conn.execute(
+            "INSERT OR IGNORE INTO market_meta (key, value) SELECT 'next_request_id', 1 + MAX("
+            "COALESCE((SELECT MAX(id) FROM insurance_requests), 0), "
+            "COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'insurance_requests'), 0))"
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _write(self, fn, bump_version=True):
+        """Run `fn(conn)` in an immediate transaction and bump the version"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+                if bump_version:
+                    self._conn.execute("UPDATE market_meta SET value = value + 1 WHERE key = 'version'")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def allocate_ids(self, count=1):
+        """Reserve `count` consecutive request ids that will never be handed out again"""
+        return self._write(lambda conn: _allocate_ids(conn, count), bump_version=False)
+
+    def version(self):
+        """Monotonic counter bumped by every committed write"""
+        with self._lock:
+            return self._conn.execute("SELECT value FROM market_meta WHERE key = 'version'").fetchone()[0]
+
+    def seed(self, requests):
+        """Insert `requests` only if the store is empty (safe across processes)"""
+        def insert_if_empty(conn):
+            if conn.execute("SELECT 1 FROM insurance_requests LIMIT 1").fetchone():
+                return False
+            _insert_many(conn, requests)
+            return True
+        return self._write(insert_if_empty)
+
+    def add_request(self, request):
+        """Insert a new request and return the id assigned by the database"""
+        return self._write(lambda conn: _insert_many(conn, [request])[0])
+
+    def add_requests(self, requests):
+        """Insert many requests in one transaction and return their ids"""
+        return self._write(lambda conn: _insert_many(conn, requests))
+
+    def get_request(self, request_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM insurance_requests WHERE id = ?", (request_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_requests(self, request_ids):
+        """Fetch several requests by id, returned in the order asked for"""
+        request_ids = list(request_ids)
+        if not request_ids:
+            return []
+        rows = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(request_ids), 500):
+                chunk = request_ids[start:start + 500]
+                sql = f"SELECT * FROM insurance_requests WHERE id IN ({', '.join('?' for _ in chunk)})"
+                for row in self._conn.execute(sql, chunk):
+                    rows[row["id"]] = dict(row)
+        return [rows[request_id] for request_id in request_ids if request_id in rows]
+
+    def update_pool(self, request_id, pool_size, pool_filled):
+        """Set the pool size and fill percentage of one request and bump its version"""
+        def update(conn):
+            cur = conn.execute(
+                "UPDATE insurance_requests SET pool_size = ?, pool_filled = ?, version = version + 1 "
+                "WHERE id = ?",
+                (pool_size, pool_filled, request_id),
+            )
+            if cur.rowcount == 0:
+                raise KeyError(request_id)
+        self._write(update)
+
+    def apply_fills(self, updates, fills):
+        """Set several pools and append their fills to the fill log in one transaction
+
+        `updates` holds (request_id, expected_version, pool_size, pool_filled);
+        if any row is no longer at its expected version nothing is written and
+        `StaleWriteError` is raised. Returns the log sequence numbers of `fills`.
+        """
+        def write(conn):
+            for request_id, expected_version, pool_size, pool_filled in updates:
+                cur = conn.execute(
+                    "UPDATE insurance_requests SET pool_size = ?, pool_filled = ?, version = version + 1 "
+                    "WHERE id = ? AND version = ?",
+                    (pool_size, pool_filled, request_id, expected_version),
+                )
+                if cur.rowcount == 0:
+                    raise StaleWriteError(f"Request {request_id} changed since version {expected_version}")
+            return _append_fills(conn, fills)
+        return self._write(write)
+
+    def stakes_by_insurer(self, request_ids):
+        """Summed fill amounts as (request_id, insurer, stake) rows for the given requests"""
+        request_ids = list(request_ids)
+        rows = []
+        with self._lock:
+            for start in range(0, len(request_ids), 500):
+                chunk = request_ids[start:start + 500]
+                sql = (
+                    "SELECT request_id, insurer, SUM(amount) FROM fill_log "
+                    f"WHERE request_id IN ({', '.join('?' for _ in chunk)}) GROUP BY request_id, insurer"
+                )
+                rows.extend(tuple(row) for row in self._conn.execute(sql, chunk))
+        return rows
+
+    def open_stakes(self):
+        """Summed fill amounts as (request_id, insurer, stake) rows for every unsettled request"""
+        sql = (
+            "SELECT f.request_id, f.insurer, SUM(f.amount) FROM fill_log f "
+            "JOIN insurance_requests r ON r.id = f.request_id WHERE r.settled_at = 0 "
+            "GROUP BY f.request_id, f.insurer"
+        )
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute(sql)]
+
+    def settle(self, settlements, payouts, settled_at):
+        """Mark contracts settled and record their payouts in one transaction
+
+        `settlements` holds (request_id, claimed, buyer_payout) and `payouts`
+        holds (request_id, insurer, stake, payout). Contracts that are
+        already settled raise `StaleWriteError` and nothing is written.
+        """
+        def write(conn):
+            cur = conn.executemany(
+                "UPDATE insurance_requests SET settled_at = ?, version = version + 1 "
+                "WHERE id = ? AND settled_at = 0",
+                ((settled_at, request_id) for request_id, _, _ in settlements),
+            )
+            if cur.rowcount != len(settlements):
+                raise StaleWriteError("Some contracts were already settled")
+            conn.executemany(
+                "INSERT INTO settlements (request_id, claimed, buyer_payout, settled_at) VALUES (?, ?, ?, ?)",
+                ((request_id, int(claimed), buyer_payout, settled_at) for request_id, claimed, buyer_payout in settlements),
+            )
+            conn.executemany(
+                "INSERT INTO insurer_payouts (request_id, insurer, stake, payout) VALUES (?, ?, ?, ?)",
+                payouts,
+            )
+        self._write(write)
+
+    def fills(self, since=0, request_id=None, insurer=None, limit=None):
+        """Fill log entries after sequence number `since`, oldest first"""
+        clauses, params = ["seq > ?"], [since]
+        if request_id is not None:
+            clauses.append("request_id = ?")
+            params.append(request_id)
+        if insurer is not None:
+            clauses.append("insurer = ?")
+            params.append(insurer)
+        sql = f"SELECT * FROM fill_log WHERE {' AND '.join(clauses)} ORDER BY seq"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def list_requests(self, token=None, ins_type=None, order_by="id", descending=False, limit=None, offset=0):
+        """Return requests as dicts, optionally filtered, sorted and paged"""
+        if order_by not in SORTABLE_COLUMNS:
+            raise ValueError(f"Cannot sort by {order_by!r}")
+        where, params = _where(token, ins_type)
+        sql = "SELECT * FROM insurance_requests" + where
+        direction = "DESC" if descending else "ASC"
+        sql += f" ORDER BY {order_by} {direction}, id {direction}"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset])
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_requests(self, token=None, ins_type=None):
+        """Number of requests matching the same filters as `list_requests`"""
+        where, params = _where(token, ins_type)
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM insurance_requests" + where, params).fetchone()[0]
+
+
+def _where(token, ins_type):
+    clauses, params = [], []
+    if token is not None:
+        clauses.append("token = ?")
+        params.append(token)
+    if ins_type is not None:
+        clauses.append("type = ?")
+        params.append(ins_type)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def _allocate_ids(conn, count):
+    """Bump the id counter by `count` inside the caller's write transaction"""
+    start = conn.execute("SELECT value FROM market_meta WHERE key = 'next_request_id'").fetchone()[0]
+    conn.execute("UPDATE market_meta SET value = ? WHERE key = 'next_request_id'", (start + count,))
+    return list(range(start, start + count))
+
+
+def _append_fills(conn, fills):
+    if not fills:
+        return []
+    start = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM fill_log").fetchone()[0] + 1
+    now = time.time()
+    conn.executemany(
+        "INSERT INTO fill_log (seq, order_id, insurer, request_id, amount, pool_before, pool_after, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (seq, fill["order_id"], fill["insurer"], fill["request_id"], fill["amount"],
+             fill["pool_before"], fill["pool_after"], now)
+            for seq, fill in zip(range(start, start + len(fills)), fills)
+        ),
+    )
+    return list(range(start, start + len(fills)))
+
+
+def _insert_many(conn, requests):
+    requests = list(requests)
+    columns = INSERT_COLUMNS
+    sql = (
+        f"INSERT INTO insurance_requests ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' for _ in columns)})"
+    )
+    ids = _allocate_ids(conn, len(requests))
+    now = time.time()
+    conn.executemany(
+        sql,
+        (
+            [request_id] + [request[col] for col in columns[1:-1]] + [request.get("created_at") or now]
+            for request_id, request in zip(ids, requests)
+        ),
+    )
+    return ids
@@ -0,0 +1,105 @@
+"""Payout sensitivity of a request over a ratio x pool size x stake grid"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from payouts import calculate_payouts_batch, pool_target
+from request_rules import MAX_RATIO, MIN_RATIO
+
+
+RATIO_POINTS = 200
+POOL_POINTS = 200
+STAKE_POINTS = 50
+SURFACE_FIELDS = ('my_earnings_no_claim', 'my_loss_if_claim', 'buyer_payout_if_claim')
+
+
+class PayoutSurface:
+    """Payouts of one request version for every (ratio, pool size, stake) on a grid
+
+    The grid is evaluated with `calculate_payouts_batch` one stake slice at a
+    time, on first use, so moving a stake slider costs at most one
+    ratio x pool evaluation and afterwards nothing. Fixed requests ignore the
+    ratio and get a single-point ratio axis.
+    """
+
+    def __init__(self, request, max_stake, ratio_points=RATIO_POINTS, pool_points=POOL_POINTS,
+                 stake_points=STAKE_POINTS):
+        self.key = (request['id'], request['version'])
+        self.amount = float(request['amount'])
+        self.fixed = request['type'] == "fixed"
+        if self.fixed:
+            self.ratios = np.array([float(request['ratio'])])
+        else:
+            self.ratios = np.linspace(MIN_RATIO, MAX_RATIO, ratio_points)
+        target = float(pool_target(self.amount, MAX_RATIO, self.fixed))
+        self.pool_sizes = np.linspace(0.0, max(target, 1.5 * float(request['pool_size']), 1.0), pool_points)
+        self.stakes = np.linspace(0.0, float(max_stake), stake_points)
+        self._slices = {}
+        self._lock = threading.Lock()
+
+    @property
+    def shape(self):
+        return len(self.ratios), len(self.pool_sizes), len(self.stakes)
+
+    def stake_index(self, stake):
+        """Grid index of the stake closest to `stake`"""
+        return int(np.abs(self.stakes - stake).argmin())
+
+    def stake_slice(self, index):
+        """{field: (ratio, pool size) float32 array} at `stakes[index]`"""
+        with self._lock:
+            surface = self._slices.get(index)
+        if surface is None:
+            payouts = calculate_payouts_batch(
+                self.amount, self.ratios[:, None], self.pool_sizes[None, :], self.fixed, self.stakes[index]
+            )
+            surface = {field: payouts[field].astype(np.float32) for field in SURFACE_FIELDS}
+            with self._lock:
+                surface = self._slices.setdefault(index, surface)
+        return surface
+
+    def cube(self):
+        """{field: (ratio, pool size, stake) float32 array} for the whole grid at once"""
+        payouts = calculate_payouts_batch(
+            self.amount, self.ratios[:, None, None], self.pool_sizes[None, :, None], self.fixed,
+            self.stakes[None, None, :],
+        )
+        return {field: payouts[field].astype(np.float32) for field in SURFACE_FIELDS}
+
+    def nbytes(self):
+        with self._lock:
+            return sum(values.nbytes for surface in self._slices.values() for values in surface.values())
+
+
+class SurfaceCache:
+    """LRU of `PayoutSurface`s keyed by (request id, version, max stake)
+
+    A new request version gets a fresh surface, so a grid is never served
+    for a pool that has changed since it was evaluated.
+    """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def surface(self, request, max_stake):
+        key = (request['id'], request['version'], max_stake)
+        with self._lock:
+            surface = self._entries.get(key)
+            if surface is not None:
+                self._entries.move_to_end(key)
+                return surface
+            surface = self._entries[key] = PayoutSurface(request, max_stake)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return surface
+
+    def stats(self):
+        with self._lock:
+            surfaces = list(self._entries.values())
+        return {'size': len(surfaces), 'bytes': sum(surface.nbytes() for surface in surfaces)}
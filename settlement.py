@@ -0,0 +1,183 @@
+"""Contract expiry scheduling and vectorized batch settlement"""
+import heapq
+import logging
+import threading
+import time
+
+import numpy as np
+
+from metrics import METRICS
+from money import calculate_payouts_units
+
+
+logger = logging.getLogger(__name__)
+
+# Terms are counted in average calendar months
+MONTH_SECONDS = 365.25 / 12 * 24 * 3600
+# Pool capital not traced to any fill (e.g. seeded pools) is paid out under this name
+UNATTRIBUTED = "unattributed"
+SETTLE_BATCH = 50_000
+MAX_SLEEP_SECONDS = 60.0
+
+
+def expiry_times(created_at, term_months):
+    """Unix time at which each contract matures"""
+    return np.asarray(created_at, dtype=np.float64) + np.asarray(term_months, dtype=np.float64) * MONTH_SECONDS
+
+
+def settle_batch(amount, ratio, pool_size, ins_type, claimed, stake_rows, stakes):
+    """Buyer payout per contract and insurer payout per stake, all at once, in exact token units
+
+    `amount`, `pool_size` and `stakes` are int64 token units and `ratio` is
+    in basis points (see `money`). Contract arguments have one entry per
+    contract; `stake_rows` maps each insurer stake in `stakes` to its
+    contract. With a claim each insurer gets its stake minus
+    `my_loss_if_claim`, without one its stake plus `my_earnings_no_claim`,
+    both rounded down. The buyer gets the rest of the contract's capital:
+    its amount plus the stakes, less what the insurers take. So payouts
+    always add up exactly, and a contract with an empty pool simply refunds
+    the buyer.
+    """
+    amount = np.asarray(amount, dtype=np.int64)
+    ratio = np.asarray(ratio, dtype=np.int64)
+    pool_size = np.asarray(pool_size, dtype=np.int64)
+    ins_type = np.asarray(ins_type)
+    claimed = np.asarray(claimed, dtype=bool)
+    stake_rows = np.asarray(stake_rows, dtype=np.int64)
+    stakes = np.asarray(stakes, dtype=np.int64)
+
+    shares = calculate_payouts_units(
+        amount[stake_rows], ratio[stake_rows], pool_size[stake_rows], ins_type[stake_rows], stakes
+    )
+    insurer = np.where(
+        claimed[stake_rows], stakes - shares['my_loss_if_claim'], stakes + shares['my_earnings_no_claim']
+    )
+    buyer = amount.copy()
+    np.add.at(buyer, stake_rows, stakes - insurer)
+    return buyer, insurer
+
+
+class ExpiryScheduler:
+    """Min-heap of (expires_at, request_id)
+
+    Finding the next due contract is O(1) and popping each one O(log n), so
+    nothing ever scans the book for matured contracts.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, request_id, expires_at):
+        with self._lock:
+            heapq.heappush(self._heap, (expires_at, request_id))
+
+    def schedule_many(self, request_ids, expires_at):
+        """Add many contracts; large batches are appended and heapified once"""
+        entries = list(zip(np.asarray(expires_at).tolist(), np.asarray(request_ids).tolist()))
+        with self._lock:
+            if len(entries) > len(self._heap):
+                self._heap.extend(entries)
+                heapq.heapify(self._heap)
+            else:
+                for entry in entries:
+                    heapq.heappush(self._heap, entry)
+
+    def next_expiry(self):
+        """Earliest scheduled expiry time, or None"""
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now, limit=None):
+        """Ids of up to `limit` contracts that expired at or before `now`, earliest first"""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+                due.append(heapq.heappop(self._heap)[1])
+        return due
+
+
+def no_claims(request_ids):
+    """Default claim outcomes: nothing was claimed"""
+    return np.zeros(len(request_ids), dtype=bool)
+
+
+class SettlementEngine:
+    """Settles contracts of a `Market` as they mature
+
+    Requests appended to the catalog since the last run are scheduled by
+    expiry, so each run looks only at new rows. `run_once` settles everything due in batches of `batch_size`,
+    asking `claim_outcomes(request_ids)` for a boolean claim mask per batch.
+    `start` runs it on a daemon thread that sleeps until the next expiry.
+    """
+
+    def __init__(self, market, claim_outcomes=no_claims, batch_size=SETTLE_BATCH, clock=time.time):
+        self.market = market
+        self.claim_outcomes = claim_outcomes
+        self.batch_size = batch_size
+        self.clock = clock
+        self.scheduler = ExpiryScheduler()
+        self._last_request_id = 0
+        # Catalog rows already looked at; rows are only ever appended to a catalog
+        self._catalog = None
+        self._scanned_rows = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _schedule_new(self):
+        with self.market.lock:
+            catalog = self.market.catalog
+            if catalog is not self._catalog:
+                # A reloaded catalog is scanned once; the id filter skips contracts already scheduled
+                self._catalog, self._scanned_rows = catalog, 0
+            start, self._scanned_rows = self._scanned_rows, len(catalog)
+            ids = catalog.column("id")[start:]
+            new = (ids > self._last_request_id) & (catalog.column("settled_at")[start:] == 0)
+            if not new.any():
+                return
+            self.scheduler.schedule_many(
+                ids[new],
+                expiry_times(catalog.column("created_at")[start:][new], catalog.column("term_months")[start:][new]),
+            )
+            self._last_request_id = max(self._last_request_id, int(ids.max()))
+
+    def run_once(self, now=None):
+        """Settle every contract due by `now`; returns how many were settled"""
+        now = self.clock() if now is None else now
+        self._schedule_new()
+        settled = 0
+        while True:
+            due = self.scheduler.pop_due(now, self.batch_size)
+            if not due:
+                return settled
+            claimed = self.claim_outcomes(np.asarray(due))
+            with METRICS.span("settle_batch"):
+                count = self.market.settle(due, claimed, settled_at=now)
+            settled += count
+            # Contracts settled elsewhere meanwhile came due here but are not counted
+            METRICS.inc("contracts_settled", count)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Settlement run failed")
+            next_expiry = self.scheduler.next_expiry()
+            delay = MAX_SLEEP_SECONDS if next_expiry is None else next_expiry - self.clock()
+            self._stop.wait(min(max(delay, 0.0), MAX_SLEEP_SECONDS))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="settlement", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
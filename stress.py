@@ -0,0 +1,333 @@
+"""Monte Carlo solvency stress test of the open book under correlated token shocks
+
+Each path first decides which tokens crash: one standard normal factor per
+token, correlated through `Scenario.correlation`, crashes its token when it
+falls below the quantile of the token's crash probability. Every open
+request then claims independently with its crash or calm claim probability,
+both of which can be set per token, per type or per (token, type). The
+payout rules of `calculate_payouts_batch` turn claims into pool losses,
+uncovered shortfalls and insurer losses for the whole catalog at once.
+
+Paths are simulated in fixed-size chunks, each with its own child of one
+`SeedSequence`, so results depend only on the seed and not on how many
+worker processes ran them.
+"""
+import concurrent.futures
+import os
+from dataclasses import dataclass
+from statistics import NormalDist
+
+import numpy as np
+
+from payouts import calculate_payouts_batch, pool_target
+from settlement import UNATTRIBUTED
+
+
+DEFAULT_PATHS = 1_000_000
+# Claim draws (paths x requests) per chunk, which bounds each worker's memory
+CHUNK_DRAWS = 1 << 24
+TOP_INSURERS = 20
+# Insurers outside the largest TOP_INSURERS are reported together
+OTHER_INSURERS = "other"
+
+CLAIM_PROB = 0.02
+CRASH_PROB = 0.05
+CRASH_CLAIM_PROB = 0.5
+CORRELATION = 0.3
+
+
+@dataclass
+class Scenario:
+    """Claim model; probabilities are a number or a dict keyed by (token, type), token or type
+
+    "ERG crashes and half the ERG requests claim" is
+    `Scenario(crash_prob={"ERG": 1.0}, crash_claim_prob={"ERG": 0.5})`.
+    Requests a dict does not cover use its "*" entry, else the module default.
+    """
+    claim_prob: object = CLAIM_PROB
+    crash_prob: object = CRASH_PROB
+    crash_claim_prob: object = CRASH_CLAIM_PROB
+    correlation: float = CORRELATION
+
+
+def _lookup(value, token, ins_type, default):
+    if not isinstance(value, dict):
+        return value
+    for key in ((token, ins_type), token, ins_type):
+        if key in value:
+            return value[key]
+    return value.get("*", default)
+
+
+@dataclass
+class StressBook:
+    """Open requests and insurer capital, valued in USD (or token units without prices)"""
+    request_ids: np.ndarray
+    tokens: list
+    types: list
+    claim_cost: np.ndarray
+    no_claim_gain: np.ndarray
+    shortfall: np.ndarray
+    insurers: list
+    shares: np.ndarray
+    unpriced: list
+
+    def __len__(self):
+        return len(self.request_ids)
+
+
+def book_from_market(market, prices=None, top_insurers=TOP_INSURERS):
+    """Snapshot the open requests of a `Market` for stress testing
+
+    `claim_cost` is what a claim takes out of the pool (the buyer payout),
+    `no_claim_gain` what the pool keeps without one and `shortfall` the part
+    of the pool target nobody funded. Insurer shares come from the fill log;
+    capital not traced to any fill is `UNATTRIBUTED`. With `prices`,
+    unpriced tokens are valued at zero and listed in `unpriced`.
+    """
+    with market.lock:
+        catalog = market.catalog
+        rows = np.flatnonzero(catalog.column("settled_at") == 0)
+        request_ids = catalog.column("id")[rows].copy()
+        amount = catalog.column("amount")[rows]
+        ratio = catalog.column("ratio")[rows]
+        pool_size = catalog.column("pool_size")[rows]
+        fixed = catalog.is_fixed(rows)
+        token_names = catalog.categories["token"].values
+        type_names = catalog.categories["type"].values
+        tokens = [token_names[code] for code in catalog.column("token")[rows].tolist()]
+        types = [type_names[code] for code in catalog.column("type")[rows].tolist()]
+        stakes = market.store.stakes_by_insurer(request_ids.tolist())
+
+    if prices is None:
+        price, unpriced = np.ones(len(rows)), []
+    else:
+        price = np.array([prices.get(token, np.nan) for token in tokens], dtype=np.float64)
+        unpriced = sorted({token for token in tokens if token not in prices})
+        price = np.nan_to_num(price, nan=0.0)
+
+    # Without a pool there is no counterparty: a claim just refunds the buyer
+    has_pool = pool_size > 0
+    payouts = calculate_payouts_batch(amount, ratio, pool_size, fixed, 0.0)
+    claim_cost = np.where(has_pool, payouts['buyer_payout_if_claim'], 0.0) * price
+    no_claim_gain = np.where(has_pool, payouts['pool_gets_no_claim'], 0.0) * price
+    shortfall = np.maximum(pool_target(amount, ratio, fixed) - pool_size, 0.0) * price
+
+    position = {request_id: i for i, request_id in enumerate(request_ids.tolist())}
+    capital = {}
+    for request_id, insurer, stake in stakes:
+        capital.setdefault(insurer, np.zeros(len(rows)))[position[request_id]] += stake
+    untraced = pool_size - sum(capital.values(), np.zeros(len(rows)))
+    if (untraced > 1e-9).any():
+        capital.setdefault(UNATTRIBUTED, np.zeros(len(rows)))[:] += np.maximum(untraced, 0.0)
+
+    ranked = sorted(capital, key=lambda insurer: -(capital[insurer] * price).sum())
+    insurers = ranked[:top_insurers]
+    columns = [capital[insurer] for insurer in insurers]
+    if len(ranked) > top_insurers:
+        insurers.append(OTHER_INSURERS)
+        columns.append(sum((capital[insurer] for insurer in ranked[top_insurers:]), np.zeros(len(rows))))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.column_stack(columns) / pool_size[:, None] if columns else np.zeros((len(rows), 0))
+    shares = np.nan_to_num(shares, nan=0.0, posinf=0.0)
+
+    return StressBook(request_ids, tokens, types, claim_cost, no_claim_gain, shortfall, insurers, shares, unpriced)
+
+
+class _Simulator:
+    """Per-process state for simulating chunks of paths against one book"""
+
+    def __init__(self, book, scenario):
+        self.token_names = sorted(set(book.tokens))
+        codes = {token: code for code, token in enumerate(self.token_names)}
+        self.token_codes = np.array([codes[token] for token in book.tokens], dtype=np.intp)
+        self.calm_prob = np.array([
+            _lookup(scenario.claim_prob, token, ins_type, CLAIM_PROB) for token, ins_type in zip(book.tokens, book.types)
+        ], dtype=np.float32)
+        self.crash_claim_prob = np.array([
+            _lookup(scenario.crash_claim_prob, token, ins_type, CRASH_CLAIM_PROB)
+            for token, ins_type in zip(book.tokens, book.types)
+        ], dtype=np.float32)
+
+        n_tokens = len(self.token_names)
+        correlation = np.full((n_tokens, n_tokens), scenario.correlation) + (1 - scenario.correlation) * np.eye(n_tokens)
+        # A little jitter keeps perfectly correlated tokens factorizable
+        self.factor_loading = np.linalg.cholesky(correlation + 1e-9 * np.eye(n_tokens))
+        crash_prob = [_lookup(scenario.crash_prob, token, None, CRASH_PROB) for token in self.token_names]
+        self.crash_threshold = np.array([
+            -np.inf if p <= 0 else np.inf if p >= 1 else NormalDist().inv_cdf(p) for p in crash_prob
+        ])
+
+        swing = book.claim_cost + book.no_claim_gain
+        self.swing = swing.astype(np.float32)
+        self.base_gain = float(book.no_claim_gain.sum())
+        self.shortfall = book.shortfall.astype(np.float32)
+        self.insurer_swing = (swing[:, None] * book.shares).astype(np.float32)
+        self.insurer_base_gain = book.no_claim_gain @ book.shares
+
+    def simulate(self, seed, paths):
+        """(pool loss, shortfall, claim count, insurer losses) for `paths` paths"""
+        rng = np.random.default_rng(seed)
+        factors = rng.standard_normal((paths, len(self.token_names))) @ self.factor_loading.T
+        crashed = factors < self.crash_threshold
+        claim_prob = np.where(crashed[:, self.token_codes], self.crash_claim_prob, self.calm_prob)
+        claims = (rng.random(claim_prob.shape, dtype=np.float32) < claim_prob).astype(np.float32)
+        # A claim swings a pool from keeping its gain to paying the buyer
+        pool_loss = claims @ self.swing - self.base_gain
+        shortfall = claims @ self.shortfall
+        insurer_loss = claims @ self.insurer_swing - self.insurer_base_gain.astype(np.float32)
+        return pool_loss.astype(np.float64), shortfall.astype(np.float64), claims.sum(axis=1), insurer_loss
+
+
+_SIMULATOR = None
+
+
+def _init_worker(book, scenario):
+    global _SIMULATOR
+    _SIMULATOR = _Simulator(book, scenario)
+
+
+def _simulate_chunk(seed, paths):
+    return _SIMULATOR.simulate(seed, paths)
+
+
+@dataclass
+class StressResult:
+    """Per-path outcomes of a stress run; losses are positive, gains negative"""
+    paths: int
+    seed: int
+    pool_loss: np.ndarray
+    shortfall: np.ndarray
+    claims: np.ndarray
+    insurers: list
+    insurer_loss: np.ndarray
+    unpriced: list
+
+    @staticmethod
+    def var(losses, level=0.99):
+        """Value at risk: the loss exceeded in only `1 - level` of paths"""
+        return float(np.quantile(losses, level)) if len(losses) else 0.0
+
+    @staticmethod
+    def cvar(losses, level=0.99):
+        """Mean loss over the paths at or beyond the VaR"""
+        if not len(losses):
+            return 0.0
+        return float(losses[losses >= np.quantile(losses, level)].mean())
+
+    def summary(self, levels=(0.95, 0.99)):
+        summary = {
+            "paths": self.paths,
+            "seed": self.seed,
+            "expected_pool_loss": float(self.pool_loss.mean()) if self.paths else 0.0,
+            "expected_claims": float(self.claims.mean()) if self.paths else 0.0,
+            "shortfall_probability": float((self.shortfall > 0).mean()) if self.paths else 0.0,
+            "expected_shortfall": float(self.shortfall.mean()) if self.paths else 0.0,
+            "unpriced_tokens": self.unpriced,
+        }
+        for level in levels:
+            percent = f"{level * 100:g}"
+            summary[f"pool_loss_var_{percent}"] = self.var(self.pool_loss, level)
+            summary[f"pool_loss_cvar_{percent}"] = self.cvar(self.pool_loss, level)
+            summary[f"shortfall_var_{percent}"] = self.var(self.shortfall, level)
+        summary["insurers"] = {
+            insurer: {
+                "expected_loss": float(losses.mean()),
+                "loss_probability": float((losses > 0).mean()),
+                **{f"var_{level * 100:g}": self.var(losses, level) for level in levels},
+            }
+            for insurer, losses in zip(self.insurers, self.insurer_loss.T)
+        }
+        return summary
+
+
+def run_stress(book, scenario=None, paths=DEFAULT_PATHS, seed=0, processes=None, chunk_paths=None):
+    """Simulate `paths` scenarios of `book` on a process pool and collect the outcomes
+
+    `processes=1` runs in this process. Chunks default to CHUNK_DRAWS claim
+    draws each, so memory per worker stays flat however large the book is.
+    """
+    scenario = scenario or Scenario()
+    chunk_paths = chunk_paths or max(1, min(paths, CHUNK_DRAWS // max(len(book), 1)))
+    sizes = [chunk_paths] * (paths // chunk_paths) + ([paths % chunk_paths] if paths % chunk_paths else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if processes == 1 or len(sizes) <= 1:
+        simulator = _Simulator(book, scenario)
+        chunks = [simulator.simulate(chunk_seed, size) for chunk_seed, size in zip(seeds, sizes)]
+    else:
+        workers = min(processes or os.cpu_count() or 1, len(sizes))
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(book, scenario)) as pool:
+            chunks = list(pool.map(_simulate_chunk, seeds, sizes))
+
+    def joined(i, empty):
+        return np.concatenate([chunk[i] for chunk in chunks]) if chunks else empty
+
+    return StressResult(
+        paths=paths,
+        seed=seed,
+        pool_loss=joined(0, np.zeros(0)),
+        shortfall=joined(1, np.zeros(0)),
+        claims=joined(2, np.zeros(0)),
+        insurers=list(book.insurers),
+        insurer_loss=joined(3, np.zeros((0, len(book.insurers)), dtype=np.float32)),
+        unpriced=list(book.unpriced),
+    )
+
+
+def _probabilities(values):
+    """Parse TOKEN=P, TYPE=P or TOKEN:TYPE=P arguments into a scenario dict"""
+    probabilities = {}
+    for value in values or []:
+        key, _, probability = value.partition("=")
+        key = tuple(key.split(":", 1)) if ":" in key else key
+        probabilities[key] = float(probability)
+    return probabilities
+
+
+def main(argv=None):
+    import argparse
+    import asyncio
+    import json
+
+    from market import Market
+    from prices import price_source_from_env
+    from request_store import RequestStore
+
+    parser = argparse.ArgumentParser(description="Monte Carlo stress test of the open insurance book")
+    parser.add_argument("--db", help="request database (default: $SIGMASHIELD_DB or insurance_requests.db)")
+    parser.add_argument("--paths", type=int, default=DEFAULT_PATHS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--claim-prob", type=float, default=CLAIM_PROB, help="claim probability without a crash")
+    parser.add_argument("--crash-prob", type=float, default=CRASH_PROB, help="crash probability of each token")
+    parser.add_argument("--crash-claim-prob", type=float, default=CRASH_CLAIM_PROB,
+                        help="claim probability of a crashed token's requests")
+    parser.add_argument("--crash", action="append", metavar="TOKEN=P", help="crash probability of one token")
+    parser.add_argument("--crash-claim", action="append", metavar="TOKEN[:TYPE]=P",
+                        help="claim probability after a crash for one token, type or both")
+    parser.add_argument("--correlation", type=float, default=CORRELATION, help="correlation of token crashes")
+    parser.add_argument("--usd", action="store_true", help="value pools in USD using the price source")
+    args = parser.parse_args(argv)
+
+    scenario = Scenario(
+        claim_prob=args.claim_prob,
+        crash_prob={"*": args.crash_prob, **_probabilities(args.crash)},
+        crash_claim_prob={"*": args.crash_claim_prob, **_probabilities(args.crash_claim)},
+        correlation=args.correlation,
+    )
+    market = Market(RequestStore(args.db))
+    try:
+        prices = None
+        if args.usd:
+            tokens = market.catalog.categories["token"].values
+            prices = asyncio.run(price_source_from_env().fetch(tokens))
+        book = book_from_market(market, prices)
+    finally:
+        market.store.close()
+    result = run_stress(book, scenario, args.paths, args.seed, args.processes)
+    print(json.dumps(result.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""Shared fixtures: a market over a temporary database seeded with deterministic requests"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fixtures import make_requests  # noqa: E402
+from market import Market  # noqa: E402
+from request_store import RequestStore  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RequestStore(str(tmp_path / "requests.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def market(store):
+    store.add_requests(make_requests(20, seed=0))
+    return Market(store)
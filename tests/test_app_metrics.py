@@ -0,0 +1,27 @@
+import os
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from conftest import ROOT
+from metrics import METRICS
+
+
+def test_rerun_span_is_recorded_when_the_script_is_cut_short(tmp_path, monkeypatch):
+    monkeypatch.setenv("SIGMASHIELD_DB", str(tmp_path / "app.db"))
+    monkeypatch.setenv("SIGMASHIELD_JOURNAL", str(tmp_path / "app.journal"))
+    monkeypatch.setenv("SIGMASHIELD_METRICS_PORT", "0")
+    st.cache_resource.clear()
+    METRICS.reset()
+    try:
+        at = AppTest.from_file(os.path.join(ROOT, "crypto_insurance_app.py"), default_timeout=60).run()
+        assert not at.exception
+        # Opening a request calls st.rerun() from the middle of the script
+        next(button for button in at.button if button.key.startswith("view_")).click().run()
+        assert not at.exception
+        data = METRICS.to_dict()
+        assert data["counters"]["reruns"] >= 3
+        assert data["spans"]["rerun"]["count"] == data["counters"]["reruns"]
+        assert data["spans"]["card_grid"]["count"] >= 2
+    finally:
+        st.cache_resource.clear()
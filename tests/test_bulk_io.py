@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+
+from benchmarks.fixtures import make_requests
+from bulk_io import export_requests, import_requests, validate_chunk
+from market import Market
+from request_store import RequestStore
+
+HEADER = "amount,token,type,ratio,term_months,pool_size,borrower\n"
+
+
+def write_csv(tmp_path, rows):
+    path = tmp_path / "requests.csv"
+    path.write_text(HEADER + "".join(row + "\n" for row in rows))
+    return path
+
+
+def test_blank_optional_cells_take_defaults(market, tmp_path):
+    path = write_csv(tmp_path, [
+        "500,ERG,variable,2.0,6,,",
+        "700,SigUSD,fixed,1.0,3,  ,  ",
+        "900,AHT,variable,1.5,12,250,9abc",
+    ])
+    report = import_requests(market, path)
+    assert (report.rows_imported, report.rows_rejected) == (3, 0)
+    imported = [market.get_request(request_id) for request_id in range(21, 24)]
+    assert [request['borrower'] for request in imported] == ["Imported", "Imported", "9abc"]
+    assert [request['pool_size'] for request in imported] == [0.0, 0.0, 250.0]
+
+
+def test_bad_pool_size_rejects_the_row(market, tmp_path):
+    path = write_csv(tmp_path, [
+        "500,ERG,variable,2.0,6,lots,9a",
+        "500,ERG,variable,2.0,6,-5,9b",
+        "500,ERG,variable,2.0,6,inf,9c",
+        "500,ERG,variable,2.0,6,100,9d",
+    ])
+    report = import_requests(market, path)
+    assert (report.rows_imported, report.rows_rejected) == (1, 3)
+    assert [row for row, _ in report.errors] == [0, 1, 2]
+    for _, reasons in report.errors:
+        assert reasons == ["pool_size must be a non-negative number"]
+
+
+def test_rejected_rows_across_chunks_keep_their_row_numbers(market, tmp_path):
+    rows = ["500,ERG,variable,2.0,6,0,9a"] * 5
+    rows[1] = "50,ERG,variable,2.0,6,0,9a"
+    rows[4] = "500,ERG,variable,2.0,6,x,9a"
+    report = import_requests(market, write_csv(tmp_path, rows), chunksize=2)
+    assert (report.rows_read, report.rows_imported) == (5, 3)
+    assert [row for row, _ in report.errors] == [1, 4]
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_settled_contracts_stay_settled_after_a_round_trip(market, tmp_path, suffix):
+    settled = market.catalog.column("id")[:3].tolist()
+    assert market.settle(settled) == 3
+    path = tmp_path / f"export{suffix}"
+    assert export_requests(market, path) == 20
+
+    copy_store = RequestStore(str(tmp_path / "copy.db"))
+    try:
+        copy = Market(copy_store)
+        report = import_requests(copy, path)
+        assert (report.rows_imported, report.rows_rejected) == (17, 3)
+        assert [row for row, _ in report.errors] == [0, 1, 2]
+
+        def open_requests(market):
+            return sorted(
+                (request['borrower'], request['created_at'], request['amount'])
+                for request in market.catalog if not request['settled_at']
+            )
+        assert open_requests(copy) == open_requests(market)
+        assert len(copy.catalog) == 17
+    finally:
+        copy_store.close()
+
+
+def test_fixture_requests_follow_the_import_rules():
+    requests = make_requests(500, seed=3)
+    validated, rejected = validate_chunk(pd.DataFrame(requests))
+    assert not rejected.any()
+    for column in ("ratio", "pool_filled", "interest_rate", "apr", "service_fee"):
+        assert validated[column].tolist() == pytest.approx([request[column] for request in requests]), column
+    assert {request['pool_filled'] for request in requests} >= {0, 100}
@@ -0,0 +1,69 @@
+import pytest
+
+import cards
+from cards import format_amount, render_card, render_card_page, risk_badge
+from matching import _room
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    cards._card_cache.clear()
+    cards._page_cache.clear()
+
+
+def open_request(market):
+    return next(request.to_dict() for request in market.catalog if not request['settled_at'] and _room(request) > 1)
+
+
+@pytest.mark.parametrize("pool_filled, expected", [(0, ("danger", "△ -100%")), (49, ("danger", "△ -51%")),
+                                                   (50, ("warning", "△ -50%")), (80, ("success", "△ -20%")),
+                                                   (100, ("success", "△ -0%"))])
+def test_risk_badge(pool_filled, expected):
+    assert risk_badge(pool_filled) == expected
+
+
+def test_card_for_a_settled_request_is_rendered_from_the_settled_version(market):
+    request = open_request(market)
+    render_card(request)
+    market.settle([request['id']])
+    settled = market.catalog.get(request['id']).to_dict()
+    assert settled['version'] > request['version']
+
+    card = render_card(settled, usd_price=2.0)
+    assert (settled['id'], settled['version'], 2.0) in cards._card_cache
+    assert f"Insurance request #{settled['id']}" in card
+    assert f'<span class="card-amount">{format_amount(settled["amount"])}</span>' in card
+    assert f"≈{format_amount(settled['pool_size'] * 2.0)} USD" in card
+    assert f"{settled['ratio']:.1f}:1" in card
+
+
+def test_card_for_a_full_pool_shows_the_new_pool_and_no_shortfall(market):
+    request = open_request(market)
+    before = render_card(request)
+    assert f"badge-{risk_badge(request['pool_filled'])[0]}" in before
+
+    market.add_coverage(request['id'], _room(request), insurer="me")
+    full = market.catalog.get(request['id']).to_dict()
+    assert full['pool_filled'] == 100
+    card = render_card(full)
+    assert '<div class="collateral-badge badge-success">△ -0%</div>' in card
+    assert f'<span class="pool-amount">{format_amount(full["pool_size"])}</span>' in card
+    assert "≈– USD" in card
+    assert render_card(request) == before
+
+
+def test_card_fields_are_escaped(market):
+    request = dict(open_request(market), borrower="<script>x</script>", version=-1)
+    card = render_card(request)
+    assert "<script>" not in card
+    assert "&lt;script&gt;x&lt;/script&gt;" in card
+
+
+def test_page_joins_the_cards_and_prices_only_known_tokens(market):
+    requests = [request.to_dict() for request in market.catalog][:3]
+    prices = {requests[0]['token']: 1.5}
+    page = render_card_page(requests, prices)
+    assert page == cards.GRID_TEMPLATE.substitute(
+        cards="".join(render_card(request, prices.get(request['token'])) for request in requests)
+    )
+    assert render_card_page(requests, prices) is page
@@ -0,0 +1,67 @@
+import threading
+
+from change_feed import ChangeFeed
+
+
+def test_changes_since_merges_every_entry_after_the_cursor():
+    feed = ChangeFeed()
+    feed.publish(1, [1, 2])
+    feed.publish(2, [3])
+    feed.publish(5, [2, 4])
+    assert feed.version == 5
+    assert feed.changes_since(0) == (5, frozenset({1, 2, 3, 4}))
+    assert feed.changes_since(1) == (5, frozenset({2, 3, 4}))
+    assert feed.changes_since(2) == (5, frozenset({2, 4}))
+    assert feed.changes_since(5) == (5, frozenset())
+
+
+def test_cursor_resumes_where_the_last_poll_stopped():
+    feed = ChangeFeed()
+    seen = []
+    cursor = feed.version
+    for version, request_ids in enumerate([[1], [2, 3], [], [1, 4]], start=1):
+        feed.publish(version, request_ids)
+        cursor, changed = feed.changes_since(cursor)
+        seen.append(sorted(changed))
+    assert cursor == 4
+    assert seen == [[1], [2, 3], [], [1, 4]]
+    assert feed.changes_since(cursor) == (4, frozenset())
+
+
+def test_subscriber_behind_the_history_must_reload():
+    feed = ChangeFeed(max_entries=3)
+    for version in range(1, 6):
+        feed.publish(version, [version])
+    assert feed.changes_since(1) == (5, None)
+    assert feed.changes_since(2) == (5, frozenset({3, 4, 5}))
+    # A cursor from the future (e.g. a feed rebuilt after a restart) is not trusted
+    assert feed.changes_since(9) == (5, None)
+
+
+def test_full_reset_drops_the_history_before_it():
+    feed = ChangeFeed()
+    feed.publish(1, [1])
+    feed.publish(2, None)
+    feed.publish(3, [7])
+    assert feed.changes_since(1) == (3, None)
+    assert feed.changes_since(2) == (3, frozenset({7}))
+
+
+def test_market_writes_reach_the_feed(market):
+    cursor = market.feed.version
+    request_id = market.catalog.column("id")[0].item()
+    market.add_coverage(request_id, 1.0, insurer="me")
+    version, changed = market.feed.changes_since(cursor)
+    assert version > cursor
+    assert changed == {request_id}
+
+
+def test_wait_wakes_on_publish():
+    feed = ChangeFeed()
+    publisher = threading.Timer(0.05, feed.publish, (1, [1]))
+    publisher.start()
+    try:
+        assert feed.wait(0, timeout=5) == 1
+    finally:
+        publisher.join()
+    assert feed.wait(1, timeout=0.01) == 1
@@ -0,0 +1,95 @@
+import glob
+import os
+
+import pytest
+
+from benchmarks.fixtures import make_requests
+from catalog import RequestCatalog
+from event_log import KEEP_SNAPSHOTS, Journal
+from market import Market
+from request_store import RequestStore
+
+
+def requests_by_id(catalog):
+    return {request['id']: request.to_dict() for request in catalog}
+
+
+def reloaded(store):
+    return requests_by_id(RequestCatalog.from_requests(store.list_requests()))
+
+
+@pytest.fixture
+def journal_dir(tmp_path):
+    return str(tmp_path / "journal")
+
+
+def trade(market, seed):
+    """Creates, fills and settles a few requests through the market"""
+    request_ids = market.create_requests(make_requests(6, seed=seed))
+    for request_id in request_ids[:4]:
+        market.add_coverage(request_id, 100.0, insurer=f"insurer-{seed}")
+    market.settle(request_ids[:2])
+    return request_ids
+
+
+def test_recover_matches_a_full_reload(store, journal_dir):
+    journal = Journal(journal_dir)
+    market = Market(store, journal)
+    trade(market, seed=1)
+    journal.flush()
+    recovered = journal.recover(store.version())
+    journal.close()
+    assert recovered is not None
+    assert requests_by_id(recovered) == reloaded(store)
+
+
+def test_torn_last_line_is_ignored(store, journal_dir):
+    journal = Journal(journal_dir)
+    trade(Market(store, journal), seed=1)
+    journal.close()
+    with open(sorted(glob.glob(os.path.join(journal_dir, "events-*.jsonl")))[-1], "a") as f:
+        f.write('[999,"pool",{"updates":[[1,')
+
+    journal = Journal(journal_dir)
+    try:
+        recovered = journal.recover(store.version())
+    finally:
+        journal.close()
+    assert requests_by_id(recovered) == reloaded(store)
+
+
+def test_recover_after_compaction(store, journal_dir):
+    journal = Journal(journal_dir, snapshot_every_rows=4)
+    market = Market(store, journal)
+    for seed in range(6):
+        trade(market, seed)
+    journal.close()
+    assert len(glob.glob(os.path.join(journal_dir, "snapshot-*.npz"))) == KEEP_SNAPSHOTS
+    assert len(glob.glob(os.path.join(journal_dir, "events-*.jsonl"))) <= KEEP_SNAPSHOTS + 1
+
+    journal = Journal(journal_dir)
+    try:
+        recovered = journal.recover(store.version())
+        assert requests_by_id(recovered) == reloaded(store)
+        assert requests_by_id(Market(store, journal).catalog) == reloaded(store)
+    finally:
+        journal.close()
+
+
+def test_log_behind_the_store_falls_back_to_a_full_reload(store, journal_dir, tmp_path):
+    journal = Journal(journal_dir)
+    trade(Market(store, journal), seed=1)
+    journal.close()
+    # Another process writes without a journal
+    other = RequestStore(str(tmp_path / "requests.db"))
+    other.add_requests(make_requests(3, seed=2))
+    other.close()
+
+    journal = Journal(journal_dir)
+    try:
+        assert journal.recover(store.version()) is None
+        market = Market(store, journal)
+        assert requests_by_id(market.catalog) == reloaded(store)
+        assert len(market.catalog) == 9
+    finally:
+        journal.close()
@@ -0,0 +1,6 @@
+import pytest
+
+
+def test_update_pool_of_an_unknown_request_raises_key_error(market):
+    with pytest.raises(KeyError):
+        market.update_pool(999_999, 100.0, 10)
@@ -0,0 +1,104 @@
+import random
+
+import pytest
+
+from market_index import SORT_KEYS, MarketIndex
+
+BASE58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+TOKENS = ["SigUSD", "ERG", "AHT", "Other"]
+
+
+def make_request(rng, request_id):
+    # Some addresses start like a token symbol so prefixes can match both
+    first = rng.choice(["9", "9", "A", "E", "S", "e"])
+    return {
+        "id": request_id, "token": rng.choice(TOKENS), "type": rng.choice(["fixed", "variable"]),
+        "borrower": first + "".join(rng.choice(BASE58) for _ in range(8)),
+        # Few distinct values, so sorting has to break ties by id
+        "apr": rng.random(), "ratio": rng.choice([0.5, 1.0, 2.5]), "term_months": rng.randint(1, 6),
+        "pool_filled": rng.choice([0, 10, 100]),
+    }
+
+
+@pytest.fixture
+def indexed():
+    rng = random.Random(4)
+    requests = [make_request(rng, request_id) for request_id in range(1, 2001)]
+    index = MarketIndex.from_requests(requests[:1000])
+    for request in requests[1000:1400]:
+        index.add(request)
+    index.add_many(requests[1400:])
+    index.remove_many(range(1, 300))
+    for request_id in range(300, 340):
+        index.remove(request_id)
+    return index, [request for request in requests if request["id"] >= 340]
+
+
+def all_pages(index, prefix, limit=7):
+    found, offset = [], 0
+    while page := index.search(prefix, offset, limit):
+        found += page
+        offset += limit
+    return found
+
+
+@pytest.mark.parametrize("prefix", ["9", "A", "Ah", "E", "e", "er", "s", "Sig", "S", "9a", "zz", "other", ""])
+def test_search_matches_address_or_token_prefix(indexed, prefix):
+    index, live = indexed
+    expected = {
+        request["id"] for request in live
+        if request["borrower"].startswith(prefix) or request["token"].casefold().startswith(prefix.casefold())
+    }
+    found = all_pages(index, prefix)
+    assert len(found) == len(set(found)) == index.search_count(prefix)
+    assert set(found) == expected
+
+
+def test_address_matches_come_first(indexed):
+    index, live = indexed
+    borrowers = {request["id"]: request["borrower"] for request in live}
+    found = all_pages(index, "E")
+    by_address = [request_id for request_id in found if borrowers[request_id].startswith("E")]
+    assert found[:len(by_address)] == by_address
+    assert by_address == sorted(by_address, key=lambda request_id: (borrowers[request_id], request_id))
+
+
+def test_search_follows_updates(indexed):
+    index, live = indexed
+    request = dict(live[0], borrower="Zmoved", token="ERG")
+    index.update(request)
+    assert index.search("Zmoved") == [request["id"]]
+    assert request["id"] in all_pages(index, "erg")
+    index.remove(request["id"])
+    assert index.search_count("Zmoved") == 0
+
+
+def all_sorted_pages(index, sort_key, descending, token, ins_type, limit=9):
+    found, offset = [], 0
+    while page := index.page(sort_key, descending, token, ins_type, offset, limit):
+        found += page
+        offset += limit
+    return found
+
+
+@pytest.mark.parametrize("sort_key", SORT_KEYS)
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("token, ins_type", [(None, None), ("ERG", None), (None, "fixed"), ("AHT", "variable")])
+def test_page_matches_a_sorted_filter(indexed, sort_key, descending, token, ins_type):
+    index, live = indexed
+    matching = [request for request in live if token in (None, request["token"]) and ins_type in (None, request["type"])]
+    expected = [
+        request["id"]
+        for request in sorted(matching, key=lambda request: (request[sort_key], request["id"]), reverse=descending)
+    ]
+    assert index.count(token, ins_type) == len(expected)
+    assert all_sorted_pages(index, sort_key, descending, token, ins_type) == expected
+
+
+def test_page_follows_updates_and_rejects_unknown_keys(indexed):
+    index, live = indexed
+    index.update(dict(live[0], apr=2.0, token="ERG"))
+    assert index.page("apr", True, "ERG", None, 0, 1) == [live[0]["id"]]
+    assert index.page("apr", True, "Nope") == []
+    with pytest.raises(ValueError):
+        index.page("amount")
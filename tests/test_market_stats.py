@@ -0,0 +1,26 @@
+import pytest
+
+from market_stats import MarketStats
+
+
+def test_snapshot_is_empty_once_every_contract_has_settled(market):
+    request_ids = market.catalog.column("id").tolist()
+    for i, request_id in enumerate(request_ids[:12]):
+        market.add_coverage(request_id, 0.1 * (i + 1) + 0.2, insurer=f"insurer-{i % 3}")
+    assert market.stats.snapshot()['pool_by_token']
+
+    assert market.settle(request_ids) == 20
+    snapshot = market.stats.snapshot()
+    assert snapshot['tvl_by_token'] == {}
+    assert snapshot['pool_by_token'] == {}
+    assert snapshot['avg_apr_by_type'] == {}
+    assert (snapshot['request_count'], snapshot['open_count']) == (20, 0)
+
+
+def test_running_sums_match_a_rebuild_from_the_catalog(market):
+    for i, request_id in enumerate(market.catalog.column("id").tolist()[:8]):
+        market.add_coverage(request_id, 123.456 * (i + 1))
+    market.settle(market.catalog.column("id").tolist()[:3])
+    running, rebuilt = market.stats.snapshot(), MarketStats.from_catalog(market.catalog).snapshot()
+    assert running.pop('avg_apr_by_type') == pytest.approx(rebuilt.pop('avg_apr_by_type'))
+    assert running == rebuilt
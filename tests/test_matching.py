@@ -0,0 +1,123 @@
+import pytest
+
+from market import Market
+from matching import MatchingEngine, StakeOrder, _room, replay_fills
+from request_store import RequestStore
+
+
+@pytest.fixture
+def engine(market):
+    engine = MatchingEngine(market)
+    yield engine
+    engine.close()
+
+
+def open_requests(market, token, ins_type=None, min_apr=0.0):
+    """Open requests an order for `token` may fill, best APR first as the index pages them"""
+    requests = [
+        request.to_dict() for request in market.catalog
+        if request['token'] == token and not request['settled_at'] and ins_type in (None, request['type'])
+        and request['apr'] >= min_apr
+    ]
+    return sorted(requests, key=lambda request: (request['apr'], request['id']), reverse=True)
+
+
+@pytest.fixture
+def other_process(store, tmp_path):
+    """A second market on the same database, standing in for another server process"""
+    other_store = RequestStore(str(tmp_path / "requests.db"))
+    yield Market(other_store)
+    other_store.close()
+
+
+def test_fills_are_resized_when_another_process_fills_the_pool_meanwhile(market, other_process):
+    request_id = market.catalog.column("id")[0].item()
+    room = _room(market.catalog.get(request_id))
+    engine = MatchingEngine(market)
+    match = engine._match
+    attempts = []
+
+    def match_then_interleave(orders):
+        result = match(orders)
+        if not attempts:
+            other_process.add_coverage(request_id, room / 2, insurer="elsewhere")
+        attempts.append(result)
+        return result
+
+    engine._match = match_then_interleave
+    try:
+        fills = engine.place(StakeOrder("me", room, request_id=request_id))
+    finally:
+        engine.close()
+
+    assert len(attempts) == 2
+    assert [fill["amount"] for fill in fills] == [pytest.approx(room / 2)]
+    assert _room(market.catalog.get(request_id)) == pytest.approx(0)
+
+
+def test_resting_orders_snapshot_in_priority_order(market):
+    engine = MatchingEngine(market)
+    try:
+        orders = [StakeOrder("me", 1.0, token="Nope", min_apr=apr, rest=True) for apr in (5.0, 1.0, 3.0)]
+        for order in orders:
+            engine.place(order)
+        assert engine.resting_orders("Nope") == [orders[1], orders[2], orders[0]]
+        assert engine.cancel(orders[1].order_id)
+        assert engine.resting_orders() == [orders[2], orders[0]]
+    finally:
+        engine.close()
+
+
+def test_single_request_order_is_capped_at_the_pool_room(market, engine):
+    request = next(request.to_dict() for request in market.catalog if _room(request) > 1)
+    room = _room(request)
+    order = StakeOrder("me", room * 2, request_id=request['id'])
+    fills = engine.place(order)
+    assert [fill["amount"] for fill in fills] == [pytest.approx(room)]
+    assert order.filled == pytest.approx(room)
+    assert _room(market.catalog.get(request['id'])) == pytest.approx(0)
+    assert engine.place(StakeOrder("me", 10.0, request_id=request['id'])) == []
+
+
+@pytest.mark.parametrize("ins_type", [None, "fixed", "variable"])
+def test_cross_request_order_fills_best_apr_first_down_to_min_apr(market, engine, ins_type):
+    template = market.catalog.get(1).to_dict()
+    market.create_requests([
+        dict(template, token="TST", type=("fixed", "variable")[i % 2], ratio=1.0, amount=100.0 * (i + 1),
+             apr=apr, pool_size=0, pool_filled=0)
+        for i, apr in enumerate([12.0, 30.0, 7.0, 30.0, 18.0, 25.0, 3.0])
+    ])
+    candidates = open_requests(market, "TST", ins_type)
+    min_apr = candidates[2]['apr']
+    eligible = [request for request in candidates if request['apr'] >= min_apr]
+    amount = sum(_room(request) for request in eligible) + 1_000.0
+
+    fills = engine.place(StakeOrder("me", amount, token="TST", ins_type=ins_type, min_apr=min_apr))
+    assert [fill["request_id"] for fill in fills] == [request['id'] for request in eligible]
+    assert [fill["amount"] for fill in fills] == pytest.approx([_room(request) for request in eligible])
+    assert all(ins_type in (None, request['type']) for request in eligible)
+    assert len(eligible) < len(open_requests(market, "TST"))
+
+
+def test_cancelled_resting_order_is_not_filled_by_new_requests(market, engine):
+    order = StakeOrder("me", 50.0, token="ERG", rest=True, min_apr=1e9)
+    assert engine.place(order) == []
+    assert engine.cancel(order.order_id)
+    assert not engine.cancel(order.order_id)
+    market.create_requests([dict(market.catalog.get(1).to_dict(), id=None, token="ERG", apr=2e9, pool_size=0)])
+    engine.place(StakeOrder("other", 1.0, request_id=1))
+    assert order.filled == 0
+    assert engine.resting_orders() == []
+
+
+def test_replay_fills_reports_pool_before_mismatches():
+    fills = [
+        {"seq": 1, "request_id": 1, "amount": 10.0, "pool_before": 0.0},
+        {"seq": 2, "request_id": 2, "amount": 5.0, "pool_before": 100.0},
+        {"seq": 3, "request_id": 1, "amount": 20.0, "pool_before": 10.0},
+        {"seq": 4, "request_id": 1, "amount": 1.0, "pool_before": 25.0},
+        {"seq": 5, "request_id": 2, "amount": 5.0, "pool_before": 105.0},
+    ]
+    pools, mismatches = replay_fills(reversed(fills), {2: 100.0})
+    assert pools == {1: 31.0, 2: 110.0}
+    assert mismatches == [4]
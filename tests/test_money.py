@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from money import BP, calculate_payouts_units, from_units, mul_div, quote_payouts, to_units, token_decimals
+from request_rules import MAX_AMOUNT, MAX_RATIO, MIN_AMOUNT
+from settlement import settle_batch
+
+
+def reference_payouts(amount, ratio, pool_size, fixed, stake):
+    """`calculate_payouts_units` for one contract in Python integers"""
+    pooled_stake = stake if pool_size > 0 else 0
+    safe_pool = max(pool_size, 1)
+    insurer_payout = min(pool_size * BP // ratio, amount) if ratio > 0 else amount
+    buyer_payout = min(amount * ratio // BP, pool_size)
+    pool_gets = amount if fixed else insurer_payout
+    takes_all = fixed and stake >= pool_size
+    return {
+        'my_earnings_no_claim': amount if takes_all else pooled_stake * pool_gets // safe_pool,
+        'my_loss_if_claim': stake if fixed else stake - pooled_stake * (pool_size - buyer_payout) // safe_pool,
+        'buyer_payout_if_claim': pool_size if fixed else buyer_payout,
+        'pool_gets_no_claim': pool_gets,
+        'my_share_bp': BP if takes_all else pooled_stake * BP // safe_pool,
+    }
+
+
+def random_contracts(n, decimals, seed=0):
+    rng = np.random.default_rng(seed)
+    amount = rng.uniform(MIN_AMOUNT, MAX_AMOUNT, n)
+    ratio = rng.choice([0.0, 0.0001, 0.37, 1.0, 2.5, MAX_RATIO], n)
+    fixed = rng.random(n) < 0.3
+    pool_size = rng.uniform(0, 1, n) * amount * np.where(fixed, 1, np.maximum(ratio, 1)) * (rng.random(n) > 0.1)
+    stake = rng.uniform(0, 1.2, n) * pool_size
+    return (
+        to_units(amount, decimals), np.rint(ratio * BP).astype(np.int64), to_units(pool_size, decimals),
+        fixed, to_units(stake, decimals),
+    )
+
+
+@pytest.mark.parametrize("token", ["SigUSD", "AHT", "ERG"])
+def test_payout_units_match_integer_arithmetic(token):
+    contracts = random_contracts(5_000, token_decimals(token))
+    payouts = calculate_payouts_units(*contracts)
+    for i, row in enumerate(zip(*(column.tolist() for column in contracts))):
+        assert {field: int(values[i]) for field, values in payouts.items()} == reference_payouts(*row)
+
+
+def test_tiny_ratio_with_a_large_pool_caps_the_insurer_side_at_the_amount():
+    decimals = token_decimals("ERG")
+    amount, pool_size = to_units(1e5, decimals), to_units(3e6, decimals)
+    payouts = calculate_payouts_units(amount, 1, pool_size, "variable", pool_size // 3)
+    assert int(payouts['pool_gets_no_claim']) == 10 ** 14
+    assert int(payouts['my_earnings_no_claim']) == 33333333333333
+
+
+def test_payout_units_stay_exact_for_pools_far_beyond_their_target():
+    rng = np.random.default_rng(4)
+    n = 20_000
+    amount = rng.integers(10 ** 11, 10 ** 14 + 1, n)
+    ratio = rng.choice([1, 2, 3, 7, 37, 5_000, 50_000], n)
+    pool_size = rng.integers(0, 10 ** 17, n)
+    fixed = rng.random(n) < 0.3
+    stake = (rng.uniform(0, 1.2, n) * pool_size).astype(np.int64)
+    contracts = amount, ratio, pool_size, fixed, stake
+    payouts = calculate_payouts_units(*contracts)
+    for i, row in enumerate(zip(*(column.tolist() for column in contracts))):
+        assert {field: int(values[i]) for field, values in payouts.items()} == reference_payouts(*row)
+
+
+def test_mul_div_is_exact_when_the_product_overflows_int64():
+    rng = np.random.default_rng(1)
+    a = rng.integers(1, 2 ** 40, 10_000)
+    b = rng.integers(1, 2 ** 40, 10_000)
+    c = rng.integers(2 ** 31, 2 ** 40, 10_000)
+    expected = [x * y // z for x, y, z in zip(a.tolist(), b.tolist(), c.tolist())]
+    assert mul_div(a, b, c).tolist() == expected
+
+
+def test_settlement_pays_out_exactly_the_capital_in_each_contract():
+    amount, ratio, pool_size, fixed, _ = random_contracts(2_000, token_decimals("ERG"), seed=2)
+    rng = np.random.default_rng(2)
+    # Split every pool between up to three insurers
+    cuts = np.sort(rng.uniform(0, 1, (len(pool_size), 2)), axis=1)
+    parts = np.diff(np.c_[np.zeros(len(pool_size)), cuts, np.ones(len(pool_size))] * pool_size[:, None], axis=1)
+    parts = np.rint(parts).astype(np.int64)
+    parts[:, -1] += pool_size - parts.sum(axis=1)
+    # Settlement only ever sees recorded (non-zero) stakes
+    stake_rows = np.repeat(np.arange(len(pool_size)), 3)[parts.ravel() > 0]
+    stakes = parts.ravel()[parts.ravel() > 0]
+    claimed = rng.random(len(pool_size)) < 0.5
+
+    buyer, insurer = settle_batch(amount, ratio, pool_size, fixed, claimed, stake_rows, stakes)
+    paid = buyer.copy()
+    np.add.at(paid, stake_rows, insurer)
+    assert paid.tolist() == (amount + pool_size).tolist()
+    assert (insurer >= 0).all() and (buyer >= 0).all()
+
+
+@pytest.mark.parametrize("ins_type", ["fixed", "variable"])
+@pytest.mark.parametrize("claimed", [False, True])
+def test_quote_shows_what_settlement_pays(ins_type, claimed):
+    request = {'amount': 1234.567891, 'ratio': 1.0 if ins_type == "fixed" else 2.37, 'pool_size': 2925.81,
+               'type': ins_type, 'token': "ERG"}
+    decimals = token_decimals("ERG")
+    stake = to_units(777.123456789, decimals)
+    quote = {field: int(to_units(value, decimals)) for field, value in
+             quote_payouts(request, float(from_units(stake, decimals))).items()}
+    _, insurer = settle_batch(
+        to_units([request['amount']], decimals), np.rint([request['ratio'] * BP]).astype(np.int64),
+        to_units([request['pool_size']], decimals), [ins_type], [claimed], [0], [stake],
+    )
+    expected = stake - quote['my_loss_if_claim'] if claimed else stake + quote['my_earnings_no_claim']
+    assert insurer.tolist() == [expected]
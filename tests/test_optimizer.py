@@ -0,0 +1,14 @@
+import numpy as np
+
+
+def test_optimize_skips_settled_requests(market):
+    request_ids = market.catalog.column("id").tolist()
+    assert len(market.optimize(1_000_000, claim_prob=0.0))
+
+    market.settle(request_ids[:10])
+    allocation = market.optimize(1_000_000, claim_prob=0.0)
+    assert not set(allocation.request_ids.tolist()) & set(request_ids[:10])
+
+    market.settle(request_ids[10:])
+    assert len(market.optimize(1_000_000, claim_prob=0.0)) == 0
+    assert np.all(market.catalog.column("settled_at") > 0)
@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from benchmarks.fixtures import make_requests
+from payouts import PAYOUT_FIELDS, calculate_payouts, calculate_payouts_batch
+
+
+def scalar_payouts(request, my_contribution):
+    """The per-request payout rules `calculate_payouts_batch` replaced"""
+    amount, ratio, pool_size = request['amount'], request['ratio'], request['pool_size']
+    if request['type'] == "fixed":
+        my_share = 1.0 if my_contribution >= pool_size else my_contribution / pool_size
+        return {
+            'my_earnings_no_claim': amount * my_share,
+            'my_loss_if_claim': my_contribution,
+            'buyer_payout_if_claim': pool_size,
+            'pool_gets_no_claim': amount,
+            'my_share_pct': my_share * 100,
+        }
+    insurer_payout = min(pool_size * (1 / ratio), amount)
+    buyer_payout = min(amount * ratio, pool_size)
+    my_share = my_contribution / pool_size if pool_size > 0 else 0
+    return {
+        'my_earnings_no_claim': my_share * insurer_payout,
+        'my_loss_if_claim': my_contribution - (
+            my_contribution * (pool_size - buyer_payout) / pool_size if pool_size > 0 else 0
+        ),
+        'buyer_payout_if_claim': buyer_payout,
+        'pool_gets_no_claim': insurer_payout,
+        'my_share_pct': my_share * 100,
+    }
+
+
+def quote_pairs():
+    rng = random.Random(3)
+    requests = make_requests(500, seed=3)
+    for request in requests[::5]:
+        request['pool_size'] = 0
+    return [(request, rng.choice([10, 250, 500, request['pool_size'], 2 * request['amount']])) for request in requests]
+
+
+def test_batch_matches_the_scalar_rules_exactly():
+    pairs = quote_pairs()
+    columns = [[request[name] for request, _ in pairs] for name in ('amount', 'ratio', 'pool_size', 'type')]
+    batch = calculate_payouts_batch(*columns, [stake for _, stake in pairs])
+    for i, (request, stake) in enumerate(pairs):
+        assert {field: batch[field][i] for field in PAYOUT_FIELDS} == scalar_payouts(request, stake)
+
+
+@pytest.mark.parametrize("ins_type", ["fixed", "variable"])
+def test_single_quote_with_an_empty_pool(ins_type):
+    request = {'amount': 1000.0, 'ratio': 2.0, 'pool_size': 0.0, 'type': ins_type}
+    assert calculate_payouts(request, 500) == scalar_payouts(request, 500)
@@ -0,0 +1,62 @@
+import prices
+from prices import DEFAULT_TTL, RETRY_INTERVAL, PriceOracle, StaticPriceSource
+
+
+class CountingSource(StaticPriceSource):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def fetch(self, tokens):
+        self.calls += 1
+        return await super().fetch(tokens)
+
+
+def test_unpriced_token_is_refreshed_once_per_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(prices.time, "monotonic", lambda: clock[0])
+    source = CountingSource()
+    oracle = PriceOracle(source, ["SigUSD", "ERG", "Other"])
+    try:
+        oracle.prices()
+        oracle.wait(5)
+        assert source.calls == 1
+        assert "Other" not in oracle.prices() and oracle.price("ERG") == 1.25
+
+        for _ in range(5):
+            clock[0] += RETRY_INTERVAL + 1
+            oracle.prices()
+            oracle.wait(5)
+        assert clock[0] - 1000.0 < DEFAULT_TTL
+        assert source.calls == 1
+
+        clock[0] = 1000.0 + DEFAULT_TTL
+        oracle.prices()
+        oracle.wait(5)
+        assert source.calls == 2
+    finally:
+        oracle.close()
+
+
+def test_failed_refresh_is_retried(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(prices.time, "monotonic", lambda: clock[0])
+
+    class FlakySource(CountingSource):
+        async def fetch(self, tokens):
+            if not self.calls:
+                self.calls += 1
+                raise ConnectionError("offline")
+            return await super().fetch(tokens)
+
+    source = FlakySource()
+    oracle = PriceOracle(source, ["ERG"])
+    try:
+        assert oracle.prices() == {}
+        oracle.wait(5)
+        clock[0] += RETRY_INTERVAL
+        oracle.prices()
+        oracle.wait(5)
+        assert source.calls == 2 and oracle.price("ERG") == 1.25
+    finally:
+        oracle.close()
@@ -0,0 +1,41 @@
+from money import quote_payouts
+from quote_cache import QuoteCache
+
+
+def test_repeated_quotes_are_served_from_the_cache(market):
+    cache = QuoteCache()
+    request = market.catalog.get(1).to_dict()
+    first = cache.quote(request, 10.0)
+    assert cache.quote(request, 10.0) is first
+    assert first == quote_payouts(request, 10.0)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_version_bump_invalidates_the_quote(market):
+    cache = QuoteCache()
+    request = market.catalog.get(1).to_dict()
+    stale = cache.quote(request, 10.0)
+
+    market.add_coverage(request['id'], 50.0, insurer="other")
+    updated = market.catalog.get(request['id']).to_dict()
+    assert updated['version'] > request['version']
+    fresh = cache.quote(updated, 10.0)
+    assert cache.misses == 2
+    assert fresh == quote_payouts(updated, 10.0)
+    assert fresh != stale
+
+
+def test_least_recently_used_quote_is_evicted(market):
+    cache = QuoteCache(maxsize=2)
+    request = market.catalog.get(1).to_dict()
+    cache.quote(request, 1.0)
+    cache.quote(request, 2.0)
+    cache.quote(request, 1.0)
+    cache.quote(request, 3.0)
+    assert len(cache) == 2 and cache.evictions == 1
+    cache.quote(request, 1.0)
+    assert cache.hits == 2
+    cache.quote(request, 2.0)
+    stats = cache.stats()
+    assert (stats['misses'], stats['evictions']) == (4, 2)
+    assert stats['hit_rate'] == 2 / 6
@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import pytest
+
+from market_index import SORT_KEYS
+from money import quote_payouts
+from payouts import PAYOUT_FIELDS
+from quote_service import QuoteService
+
+
+def get(market, target):
+    return asyncio.run(QuoteService(market).handle("GET", target))
+
+
+@pytest.mark.parametrize("sort_key", SORT_KEYS)
+@pytest.mark.parametrize("desc", ["0", "1"])
+def test_list_sorts_by_every_index_key(market, sort_key, desc):
+    status, payload = get(market, f"/requests?sort={sort_key}&desc={desc}&limit=20")
+    assert status == 200, payload
+    values = [request[sort_key] for request in payload["requests"]]
+    assert len(values) == payload["total"] == 20
+    assert values == sorted(values, reverse=desc == "1")
+
+
+@pytest.mark.parametrize("sort_key", ["amount", "pool_size", "borrower"])
+def test_list_rejects_unindexed_sort_keys(market, sort_key):
+    status, payload = get(market, f"/requests?sort={sort_key}")
+    assert status == 400
+    assert "sort must be one of" in payload["error"]
+
+
+async def send(port, method, target, body=b""):
+    """(status, JSON payload) of one request over a fresh connection"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(
+            f"{method} {target} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        return await read_response(reader)
+    finally:
+        writer.close()
+
+
+async def read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers["content-length"])))
+
+
+def serve(service, client):
+    """Run `client(port)` against `service` listening on a free localhost port"""
+    async def main():
+        server = await service.start("127.0.0.1", 0)
+        async with server:
+            return await client(server.sockets[0].getsockname()[1])
+    return asyncio.run(main())
+
+
+def test_quote_matches_quote_payouts(market):
+    request_id = market.catalog.column("id")[3].item()
+    target = f"/quote?request_id={request_id}&stake=250"
+    status, payload = serve(QuoteService(market), lambda port: send(port, "GET", target))
+    assert status == 200
+    expected = quote_payouts(market.get_request(request_id), 250.0)
+    assert {field: payload[field] for field in PAYOUT_FIELDS} == expected
+
+
+def test_unknown_request_is_404(market):
+    async def client(port):
+        return [await send(port, "GET", target) for target in ("/quote?request_id=999999&stake=10", "/requests/999999")]
+    for status, payload in serve(QuoteService(market), client):
+        assert status == 404
+        assert "error" in payload
+
+
+@pytest.mark.parametrize("body", [b"{not json", b'{"quotes": 3}', b'{"quotes": [{"stake": 5}]}'])
+def test_malformed_batch_is_400(market, body):
+    status, payload = serve(QuoteService(market), lambda port: send(port, "POST", "/quotes", body))
+    assert status == 400
+    assert "error" in payload
+
+
+def test_connections_over_the_limit_get_503(market):
+    async def client(port):
+        held = [await asyncio.open_connection("127.0.0.1", port) for _ in range(2)]
+        for reader, writer in held:
+            # A request makes sure the server has taken the connection on
+            writer.write(b"GET /health HTTP/1.1\r\nHost: test\r\n\r\n")
+            assert (await read_response(reader))[0] == 200
+        refused = await send(port, "GET", "/health")
+        for _, writer in held:
+            writer.close()
+        return refused
+    status, payload = serve(QuoteService(market, max_connections=2), client)
+    assert status == 503
+    assert payload == {"error": "too many connections"}
@@ -0,0 +1,136 @@
+import sqlite3
+import threading
+
+import pytest
+
+from benchmarks.fixtures import make_requests
+from request_store import RequestStore, StaleWriteError
+
+# insurance_requests as the first release of the store created it
+BASELINE_SCHEMA = """
+CREATE TABLE insurance_requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    amount NUMERIC NOT NULL,
+    token TEXT NOT NULL,
+    icon TEXT NOT NULL,
+    ratio REAL NOT NULL,
+    type TEXT NOT NULL,
+    pool_size NUMERIC NOT NULL DEFAULT 0,
+    pool_filled INTEGER NOT NULL DEFAULT 0,
+    term_months INTEGER NOT NULL,
+    interest_rate INTEGER NOT NULL,
+    apr REAL NOT NULL,
+    service_fee NUMERIC NOT NULL,
+    borrower TEXT NOT NULL
+);
+CREATE TABLE market_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT INTO market_meta (key, value) VALUES ('version', 0);
+"""
+
+BASELINE_COLUMNS = (
+    "amount", "token", "icon", "ratio", "type", "pool_size", "pool_filled",
+    "term_months", "interest_rate", "apr", "service_fee", "borrower",
+)
+
+
+def test_ids_stay_unique_across_connections_allocating_at_once(tmp_path):
+    path = str(tmp_path / "requests.db")
+    stores = [RequestStore(path), RequestStore(path)]
+    requests = make_requests(3, seed=0)
+    start = threading.Barrier(4)
+    allocated = [[] for _ in range(4)]
+
+    def allocate(store, ids):
+        start.wait()
+        for i in range(50):
+            ids.extend(store.add_requests(requests) if i % 2 else store.allocate_ids(2))
+
+    threads = [threading.Thread(target=allocate, args=(stores[i % 2], allocated[i])) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        ids = [request_id for ids in allocated for request_id in ids]
+        assert len(ids) == 4 * 25 * (3 + 2)
+        assert len(set(ids)) == len(ids)
+        stored = [request['id'] for request in stores[1].list_requests()]
+        assert len(stored) == 4 * 25 * 3
+        assert set(stored) <= set(ids)
+        # Each connection's own allocations come back in increasing order
+        assert all(ids == sorted(ids) for ids in allocated)
+    finally:
+        for store in stores:
+            store.close()
+
+
+def test_baseline_database_is_migrated_in_place(tmp_path):
+    path = str(tmp_path / "requests.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(
+        f"INSERT INTO insurance_requests ({', '.join(BASELINE_COLUMNS)}) "
+        f"VALUES ({', '.join('?' for _ in BASELINE_COLUMNS)})",
+        [[request[column] for column in BASELINE_COLUMNS] for request in make_requests(4, seed=0)],
+    )
+    # A deleted row's id must not be handed out again
+    conn.execute("DELETE FROM insurance_requests WHERE id = 4")
+    conn.commit()
+    conn.close()
+
+    store = RequestStore(path)
+    try:
+        requests = store.list_requests()
+        assert [request['id'] for request in requests] == [1, 2, 3]
+        assert all(request['version'] == 1 and request['settled_at'] == 0 for request in requests)
+        assert all(request['created_at'] > 0 for request in requests)
+        assert store.add_requests(make_requests(1, seed=1)) == [5]
+        store.update_pool(1, 10.0, 5)
+        assert store.get_request(1)['version'] == 2
+    finally:
+        store.close()
+
+    # Opening a migrated database again leaves it as it is
+    store = RequestStore(path)
+    try:
+        assert [request['id'] for request in store.list_requests()] == [1, 2, 3, 5]
+        assert store.allocate_ids() == [6]
+    finally:
+        store.close()
+
+
+def test_apply_fills_writes_nothing_when_a_version_moved(store, tmp_path):
+    first, second = store.add_requests(make_requests(2, seed=0))
+    other = RequestStore(str(tmp_path / "requests.db"))
+    try:
+        other.update_pool(second, 5.0, 1)
+    finally:
+        other.close()
+    before = store.version()
+    fills = [
+        {"order_id": "o", "insurer": "me", "request_id": request_id, "amount": 1.0, "pool_before": 0.0,
+         "pool_after": 1.0}
+        for request_id in (first, second)
+    ]
+
+    with pytest.raises(StaleWriteError):
+        store.apply_fills([(first, 1, 1.0, 1), (second, 1, 1.0, 1)], fills)
+    assert store.version() == before
+    assert store.get_request(first)['version'] == 1
+    assert store.get_request(first)['pool_size'] == make_requests(2, seed=0)[0]['pool_size']
+    assert store.fills() == []
+
+    assert store.apply_fills([(first, 1, 1.0, 1), (second, 2, 6.0, 1)], fills) == [1, 2]
+    assert store.get_request(second)['version'] == 3
+
+
+def test_market_rejects_fills_sized_against_an_old_version(market):
+    request = market.catalog.get(1).to_dict()
+    market.add_coverage(request['id'], 1.0, insurer="other")
+    fill = {"order_id": "o", "insurer": "me", "request_id": request['id'], "amount": 1.0}
+    with pytest.raises(StaleWriteError):
+        market.apply_fills([fill], {request['id']: request['version']})
+    assert market.catalog.get(request['id'])['pool_size'] == request['pool_size'] + 1.0
@@ -0,0 +1,36 @@
+from benchmarks.fixtures import make_requests
+from metrics import METRICS
+from settlement import SettlementEngine
+
+LATER = 1e12
+
+
+def test_contracts_settled_counts_only_contracts_this_engine_settled(market):
+    METRICS.reset()
+    engine = SettlementEngine(market)
+    assert engine.run_once(now=0) == 0
+    already_settled = market.catalog.column("id")[:5].tolist()
+    assert market.settle(already_settled) == 5
+
+    assert engine.run_once(now=LATER) == 15
+    assert METRICS.to_dict()["counters"]["contracts_settled"] == 15
+
+
+def test_each_run_schedules_only_requests_added_since_the_last(market):
+    engine = SettlementEngine(market)
+    engine.run_once(now=0)
+    scheduled = []
+    schedule_many = engine.scheduler.schedule_many
+
+    def spy(request_ids, expires_at):
+        scheduled.extend(request_ids.tolist())
+        schedule_many(request_ids, expires_at)
+
+    engine.scheduler.schedule_many = spy
+
+    new_ids = market.create_requests(make_requests(3, seed=1))
+    engine.run_once(now=0)
+    assert scheduled == new_ids
+    engine.run_once(now=0)
+    assert scheduled == new_ids
+    assert engine.run_once(now=LATER) == 23
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from benchmarks.fixtures import make_requests
+from market import Market
+from stress import Scenario, StressResult, book_from_market, run_stress
+
+
+def test_results_depend_only_on_the_seed(market):
+    book = book_from_market(market)
+    scenario = Scenario()
+    one = run_stress(book, scenario, paths=2_000, seed=7, processes=1, chunk_paths=300)
+    many = run_stress(book, scenario, paths=2_000, seed=7, processes=3, chunk_paths=300)
+    other = run_stress(book, scenario, paths=2_000, seed=8, processes=1, chunk_paths=300)
+
+    for name in ("pool_loss", "shortfall", "claims", "insurer_loss"):
+        np.testing.assert_array_equal(getattr(one, name), getattr(many, name))
+    assert not np.array_equal(one.claims, other.claims)
+    assert one.summary() == many.summary()
+
+
+@pytest.fixture
+def small_book(store):
+    """A fixed and a variable ERG/AHT request whose payouts are easy to work out by hand
+
+    Fixed: amount 100, pool 80, all from "a": a claim costs the pool 80,
+    no claim gains it 100, 20 of its target is unfunded.
+    Variable: amount 100 at 2:1, pool 150 (100 from "a", 50 from "b"): a
+    claim costs 150, no claim gains 150 / 2 = 75, 50 of its 200 target is
+    unfunded.
+    """
+    market = Market(store)
+    template = make_requests(1, seed=0)[0]
+    fixed_id, variable_id = market.create_requests([
+        dict(template, token="ERG", type="fixed", amount=100.0, ratio=1.0, pool_size=0, pool_filled=0),
+        dict(template, token="AHT", type="variable", amount=100.0, ratio=2.0, pool_size=0, pool_filled=0),
+    ])
+    market.add_coverage(fixed_id, 80.0, insurer="a")
+    market.add_coverage(variable_id, 100.0, insurer="a")
+    market.add_coverage(variable_id, 50.0, insurer="b")
+    return book_from_market(market)
+
+
+def test_book_values_each_request_by_its_payout_rules(small_book):
+    np.testing.assert_allclose(small_book.claim_cost, [80.0, 150.0])
+    np.testing.assert_allclose(small_book.no_claim_gain, [100.0, 75.0])
+    np.testing.assert_allclose(small_book.shortfall, [20.0, 50.0])
+    assert small_book.insurers == ["a", "b"]
+    np.testing.assert_allclose(small_book.shares, [[1.0, 0.0], [2 / 3, 1 / 3]])
+
+
+@pytest.mark.parametrize("scenario, pool_loss, shortfall, insurer_loss", [
+    # Only the fixed request claims: it pays 80 and the variable pool keeps 75
+    (Scenario(claim_prob={"fixed": 1.0, "variable": 0.0}, crash_prob=0.0), 5.0, 20.0, [30.0, -25.0]),
+    # Every token crashes and every request claims
+    (Scenario(claim_prob=0.0, crash_prob=1.0, crash_claim_prob=1.0), 230.0, 70.0, [180.0, 50.0]),
+    # No claims: both pools keep their gains
+    (Scenario(claim_prob=0.0, crash_prob=0.0), -175.0, 0.0, [-150.0, -25.0]),
+])
+def test_certain_scenarios_lose_exactly_the_hand_computed_amounts(small_book, scenario, pool_loss, shortfall,
+                                                                  insurer_loss):
+    result = run_stress(small_book, scenario, paths=100, seed=0, processes=1)
+    np.testing.assert_allclose(result.pool_loss, pool_loss)
+    np.testing.assert_allclose(result.shortfall, shortfall)
+    np.testing.assert_allclose(result.insurer_loss, np.tile(insurer_loss, (100, 1)), atol=1e-4)
+    summary = result.summary()
+    assert summary["pool_loss_var_99"] == pytest.approx(pool_loss)
+    assert summary["pool_loss_cvar_99"] == pytest.approx(pool_loss)
+
+
+def test_independent_claims_match_the_exact_loss_distribution(small_book):
+    # Fixed claims with 0.5, variable with 0.2, independently:
+    # loss -175 (p 0.4), 5 (p 0.4), 50 (p 0.1), 230 (p 0.1)
+    scenario = Scenario(claim_prob={"fixed": 0.5, "variable": 0.2}, crash_prob=0.0)
+    result = run_stress(small_book, scenario, paths=200_000, seed=3, processes=1)
+    summary = result.summary(levels=(0.5, 0.85, 0.95))
+
+    assert summary["expected_pool_loss"] == pytest.approx(-40.0, abs=2.0)
+    assert summary["expected_claims"] == pytest.approx(0.7, abs=0.01)
+    assert summary["shortfall_probability"] == pytest.approx(0.6, abs=0.01)
+    assert summary["expected_shortfall"] == pytest.approx(0.5 * 20 + 0.2 * 50, abs=0.2)
+    assert summary["pool_loss_var_50"] == pytest.approx(5.0)
+    assert summary["pool_loss_var_85"] == pytest.approx(50.0)
+    assert summary["pool_loss_var_95"] == pytest.approx(230.0)
+    # Paths at or beyond the 85% VaR lose 50 or 230 with equal probability
+    assert summary["pool_loss_cvar_85"] == pytest.approx(140.0, abs=3.0)
+    assert summary["pool_loss_cvar_95"] == pytest.approx(230.0)
+
+
+@pytest.mark.parametrize("correlation, both, one", [(1.0, 0.3, 0.0), (0.0, 0.09, 0.42)])
+def test_crash_correlation_between_tokens(small_book, correlation, both, one):
+    scenario = Scenario(claim_prob=0.0, crash_prob=0.3, crash_claim_prob=1.0, correlation=correlation)
+    claims = run_stress(small_book, scenario, paths=100_000, seed=5, processes=1).claims
+    assert (claims == 2).mean() == pytest.approx(both, abs=0.01)
+    assert (claims == 1).mean() == pytest.approx(one, abs=0.01)
+
+
+def test_var_and_cvar_on_a_known_sample():
+    losses = np.arange(1.0, 101.0)
+    assert StressResult.var(losses, 0.95) == pytest.approx(95.05)
+    assert StressResult.cvar(losses, 0.95) == pytest.approx(np.mean([96, 97, 98, 99, 100]))
+    assert StressResult.var(losses, 1.0) == StressResult.cvar(losses, 1.0) == 100.0
+    assert StressResult.var(np.zeros(0)) == StressResult.cvar(np.zeros(0)) == 0.0